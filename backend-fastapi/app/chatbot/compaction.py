@@ -0,0 +1,295 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from pymongo.errors import DuplicateKeyError
+from app.chatbot.context import TokenCounter
+from app.chatbot.summaries import touch_summary
+
+# One document per compacted conversation, keyed by conversationId
+COMPACTIONS_COLLECTION = "conversation_compactions"
+
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the conversation so far so it can replace the earlier messages. "
+    "Keep facts about the user, decisions, names, numbers and open questions. "
+    "Write at most a few short paragraphs."
+)
+
+
+def message_key(message: Dict[str, Any]):
+    """Sort key of a message, the same order as the history queries"""
+    return (message["createdAt"], message["_id"])
+
+
+def after_key_query(conversation_id: str, created_at: datetime, message_id) -> Dict[str, Any]:
+    return {
+        "conversationId": conversation_id,
+        "$or": [
+            {"createdAt": {"$gt": created_at}},
+            {"createdAt": created_at, "_id": {"$gt": message_id}},
+        ],
+    }
+
+
+def through_key_query(conversation_id: str, created_at: datetime, message_id) -> Dict[str, Any]:
+    return {
+        "conversationId": conversation_id,
+        "$or": [
+            {"createdAt": {"$lt": created_at}},
+            {"createdAt": created_at, "_id": {"$lte": message_id}},
+        ],
+    }
+
+
+def summary_prompt(previous_summary: Optional[str], messages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Build the prompt that folds old turns into the running summary"""
+    prompt = [{"role": "system", "content": SUMMARY_INSTRUCTIONS}]
+    if previous_summary:
+        prompt.append({"role": "system", "content": f"Summary of the conversation before these messages: {previous_summary}"})
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    prompt.append({"role": "user", "content": transcript})
+    return prompt
+
+
+class Compactor:
+    """Folds the old turns of long conversations into a stored rolling summary
+
+    Once a conversation has more than `threshold` messages after its current
+    summary, everything but the newest `keep_recent` messages is summarized
+    together with the previous summary. The old messages are read with a
+    cursor and folded in chunks whose prompts fit in `max_tokens`, each chunk
+    into the summary left by the one before. The summary records the
+    (createdAt, _id) of the last message it covers, so prompts use it plus
+    the messages after that point.
+
+    Jobs run on `workers` background tasks fed by a queue of at most
+    `queue_size` conversations; when it is full new requests are dropped and
+    picked up again on a later turn. A job is idempotent: it only advances a
+    summary that nobody else advanced in the meantime. Unless `keep_originals`
+    is set the messages of each chunk are deleted once it is stored, and the
+    conversation's summary in `conversations_collection` loses them from its
+    messageCount and gets a new version since its history changed.
+    """
+
+    def __init__(
+        self,
+        messages_collection,
+        compactions_collection,
+        summarize: Callable[[List[Dict[str, str]]], Awaitable[str]],
+        threshold: int = 100,
+        keep_recent: int = 20,
+        keep_originals: bool = True,
+        queue_size: int = 100,
+        workers: int = 1,
+        cache_size: int = 1000,
+        cache_ttl: float = 600.0,
+        conversations_collection=None,
+        hidden_before: Optional[Callable[[str], Optional[datetime]]] = None,
+        max_tokens: int = 3000,
+        token_counter: Optional[TokenCounter] = None,
+    ):
+        self.messages_collection = messages_collection
+        self.compactions_collection = compactions_collection
+        self.summarize = summarize
+        self.threshold = threshold
+        self.keep_recent = keep_recent
+        self.keep_originals = keep_originals
+        self.queue_size = queue_size
+        self.workers = workers
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.conversations_collection = conversations_collection
+        # Cutoff of a deletion in progress, whose messages must not be summarized
+        self.hidden_before = hidden_before
+        self.max_tokens = max_tokens
+        self.token_counter = token_counter or TokenCounter("")
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued = set()
+        self._tasks: List[asyncio.Task] = []
+        # conversationId -> (expiry, compaction document or None when it has none)
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self.scheduled = 0
+        self.dropped = 0
+        self.compactions = 0
+        self.chunks = 0
+        self.conflicts = 0
+        self.failures = 0
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.ensure_future(self._run()))
+
+    def schedule(self, conversation_id: str) -> bool:
+        """Queue a conversation to be checked; never waits"""
+        if conversation_id in self._queued:
+            return True
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(conversation_id)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self._queued.add(conversation_id)
+        self.scheduled += 1
+        return True
+
+    async def _run(self):
+        while True:
+            conversation_id = await self._queue.get()
+            self._queued.discard(conversation_id)
+            try:
+                await self.compact(conversation_id)
+            except Exception as error:
+                self.failures += 1
+                print(f"Error compacting conversation {conversation_id}: {error}")
+            finally:
+                self._queue.task_done()
+
+    async def join(self):
+        """Wait until every queued job has run"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def get_compaction(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """Get the conversation's compaction document, cached per process for `cache_ttl` seconds"""
+        cached = self._cache.get(conversation_id)
+        if cached is not None and cached[0] > time.monotonic():
+            self._cache.move_to_end(conversation_id)
+            return cached[1]
+        document = await self.compactions_collection.find_one({"_id": conversation_id})
+        self._remember(conversation_id, document)
+        return document
+
+    def _remember(self, conversation_id: str, document: Optional[Dict[str, Any]]):
+        self._cache[conversation_id] = (time.monotonic() + self.cache_ttl, document)
+        self._cache.move_to_end(conversation_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def forget(self, conversation_id: str):
+        self._cache.pop(conversation_id, None)
+
+    async def delete(self, conversation_id: str):
+        self.forget(conversation_id)
+        await self.compactions_collection.delete_one({"_id": conversation_id})
+
+    async def compact(self, conversation_id: str) -> bool:
+        """Summarize the conversation's old turns if it is over the threshold"""
+        current = await self.compactions_collection.find_one({"_id": conversation_id})
+        query = {"conversationId": conversation_id}
+        if current is not None:
+            query = after_key_query(conversation_id, current["throughCreatedAt"], current["throughId"])
+        hidden = self.hidden_before(conversation_id) if self.hidden_before else None
+        if hidden is not None:
+            query["createdAt"] = {"$gt": hidden}
+        pending = await self.messages_collection.count_documents(query)
+        if pending <= self.threshold:
+            self._remember(conversation_id, current)
+            return False
+        to_fold = pending - self.keep_recent
+        if to_fold <= 0:
+            return False
+
+        started = time.perf_counter()
+        cursor = (
+            self.messages_collection.find(query, {"role": 1, "content": 1, "createdAt": 1})
+            .sort([("createdAt", 1), ("_id", 1)])
+            .limit(to_fold)
+        )
+        folded = 0
+        chunk: List[Dict[str, Any]] = []
+        chunk_tokens = 0
+        budget = self._chunk_budget(current)
+        async for message in cursor:
+            tokens = self.token_counter.count_message(message)
+            if chunk and chunk_tokens + tokens > budget:
+                current = await self._fold(conversation_id, current, chunk)
+                if current is None:
+                    return folded > 0
+                folded += len(chunk)
+                chunk, chunk_tokens = [], 0
+                budget = self._chunk_budget(current)
+            chunk.append(message)
+            chunk_tokens += tokens
+        if chunk:
+            if await self._fold(conversation_id, current, chunk) is None:
+                return folded > 0
+            folded += len(chunk)
+
+        self.compactions += 1
+        print(
+            f"Compacted {folded} messages of conversation {conversation_id} "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+        return True
+
+    def _chunk_budget(self, current: Optional[Dict[str, Any]]) -> int:
+        """Tokens left for a chunk's transcript once the instructions and previous summary are counted"""
+        prompt = summary_prompt(current and current["summary"], [])
+        return self.max_tokens - sum(self.token_counter.count_message(message) for message in prompt)
+
+    async def _fold(
+        self, conversation_id: str, current: Optional[Dict[str, Any]], chunk: List[Dict[str, Any]]
+    ) -> Optional[Dict[str, Any]]:
+        """Fold one chunk into the summary and store it; None if another job got there first"""
+        summary = await self.summarize(summary_prompt(current and current["summary"], chunk))
+        last = chunk[-1]
+        document = {
+            "_id": conversation_id,
+            "summary": summary,
+            "throughCreatedAt": last["createdAt"],
+            "throughId": last["_id"],
+            "compactedCount": (current["compactedCount"] if current else 0) + len(chunk),
+            "updatedAt": datetime.utcnow(),
+        }
+        if current is None:
+            try:
+                await self.compactions_collection.insert_one(document)
+            except DuplicateKeyError:
+                self.conflicts += 1
+                self.forget(conversation_id)
+                return None
+        else:
+            result = await self.compactions_collection.replace_one(
+                {"_id": conversation_id, "throughId": current["throughId"]}, document
+            )
+            if result.matched_count == 0:
+                # Another job advanced the summary first
+                self.conflicts += 1
+                self.forget(conversation_id)
+                return None
+
+        self.chunks += 1
+        self._remember(conversation_id, document)
+        if not self.keep_originals:
+            result = await self.messages_collection.delete_many(
+                through_key_query(conversation_id, last["createdAt"], last["_id"])
+            )
+            if self.conversations_collection is not None:
+                await touch_summary(self.conversations_collection, conversation_id, result.deleted_count)
+        return document
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "scheduled": self.scheduled,
+            "dropped": self.dropped,
+            "compactions": self.compactions,
+            "chunks": self.chunks,
+            "conflicts": self.conflicts,
+            "failures": self.failures,
+        }
@@ -0,0 +1,96 @@
+import asyncio
+from typing import List, Dict, Callable, Optional
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional, fall back to a character heuristic
+    tiktoken = None
+
+SYSTEM_PROMPT = "You are a helpful assistant. Be concise and friendly."
+
+# Fixed per-message cost of the chat format (role markers and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Tokens reserved for priming the assistant reply
+REPLY_PRIMING_TOKENS = 3
+
+
+def _get_encoder(model: str) -> Optional[Callable[[str], List[int]]]:
+    """Get a tiktoken encode function for the model, if tiktoken is installed"""
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as error:
+        # Encodings are downloaded on first use, which fails when offline
+        print(f"Could not load tiktoken encoding, estimating tokens instead: {error}")
+        return None
+    return encoding.encode
+
+
+class TokenCounter:
+    """Counts tokens with tiktoken once `load` has succeeded, by a character heuristic before"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self._encode: Optional[Callable[[str], List[int]]] = None
+
+    async def load(self, timeout: float = 10.0) -> bool:
+        """Load the model's encoding in a thread; it may be downloaded, so give up after `timeout`"""
+        if tiktoken is None:
+            return False
+        try:
+            self._encode = await asyncio.wait_for(asyncio.to_thread(_get_encoder, self.model), timeout)
+        except asyncio.TimeoutError:
+            print(f"Loading the tiktoken encoding took over {timeout}s, estimating tokens instead")
+            return False
+        return self._encode is not None
+
+    def count_text(self, text: str) -> int:
+        """Count the tokens in a piece of text"""
+        if not text:
+            return 0
+        if self._encode is not None:
+            return len(self._encode(text))
+        # Roughly four characters per token for English text
+        return (len(text) + 3) // 4
+
+    def count_message(self, message: Dict[str, str]) -> int:
+        """Count the tokens a chat message contributes to the prompt"""
+        return MESSAGE_OVERHEAD_TOKENS + self.count_text(message["content"])
+
+
+def build_context(
+    history: List[Dict],
+    max_tokens: int,
+    counter: TokenCounter,
+    system_prompt: str = SYSTEM_PROMPT,
+    summary: Optional[str] = None,
+) -> List[Dict[str, str]]:
+    """Build the OpenAI prompt from the newest messages that fit in the token budget
+
+    `history` must be in chronological order. The newest message is always kept,
+    even if it exceeds the budget on its own. A `summary` of the turns before
+    `history` is sent after the system prompt.
+    """
+    system_message = {"role": "system", "content": system_prompt}
+    budget = max_tokens - REPLY_PRIMING_TOKENS - counter.count_message(system_message)
+    preamble = [system_message]
+    if summary:
+        summary_message = {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+        budget -= counter.count_message(summary_message)
+        preamble.append(summary_message)
+
+    selected = []
+    for msg in reversed(history):
+        message = {"role": msg["role"], "content": msg["content"]}
+        cost = counter.count_message(message)
+        if selected and cost > budget:
+            break
+        selected.append(message)
+        budget -= cost
+
+    selected.reverse()
+    return preamble + selected
@@ -0,0 +1,131 @@
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+
+class _Entry:
+    __slots__ = ("messages", "capacity", "expires_at", "version")
+
+    def __init__(self, messages: List[Dict[str, Any]], capacity: int, expires_at: float, version: Optional[int]):
+        self.messages = messages
+        self.capacity = capacity
+        self.expires_at = expires_at
+        self.version = version
+
+
+class HistoryCache:
+    """LRU cache of the newest messages of recently active conversations
+
+    Each entry holds the tail of a conversation, at most `capacity` messages,
+    in chronological order. Entries are filled from Mongo on a miss, appended
+    to as the service writes messages, and expire `ttl` seconds after they
+    were last written.
+
+    All methods are synchronous, so they run atomically on the event loop. A
+    fill that raced with a write or an invalidation is discarded: callers take
+    a token with `begin_load` before awaiting Mongo and hand it to `put`.
+
+    The cache only sees writes made by its own process. With several workers,
+    callers pass the conversation summary's `version`, read before the fill,
+    to `put` and the current one to `get`; an entry whose version differs was
+    written to elsewhere and counts as a stale miss. The process's own flushes
+    move entries along through `recorded`.
+    """
+
+    def __init__(self, max_conversations: int = 1000, ttl: float = 600.0):
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._loads: Dict[str, object] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_conversations > 0
+
+    def get(self, conversation_id: str, limit: int, version: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        """Get a copy of the newest `limit` messages, or None on a miss"""
+        entry = self._entries.get(conversation_id)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            del self._entries[conversation_id]
+            entry = None
+        if entry is not None and version is not None and entry.version != version:
+            del self._entries[conversation_id]
+            entry = None
+            self.stale += 1
+        if entry is None or limit > entry.capacity:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(conversation_id)
+        self.hits += 1
+        return entry.messages[-limit:]
+
+    def begin_load(self, conversation_id: str) -> object:
+        """Register a fill that is about to read the conversation from Mongo"""
+        token = object()
+        self._loads[conversation_id] = token
+        return token
+
+    def put(
+        self,
+        conversation_id: str,
+        messages: List[Dict[str, Any]],
+        capacity: int,
+        token: object,
+        version: Optional[int] = None,
+    ):
+        """Store a conversation tail loaded from Mongo, unless it went stale meanwhile"""
+        if self._loads.get(conversation_id) is not token:
+            return
+        del self._loads[conversation_id]
+        if not self.enabled:
+            return
+        self._entries[conversation_id] = _Entry(
+            list(messages[-capacity:]), capacity, time.monotonic() + self.ttl, version
+        )
+        self._entries.move_to_end(conversation_id)
+        while len(self._entries) > self.max_conversations:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def append(self, conversation_id: str, message: Dict[str, Any]):
+        """Record a message written by the service"""
+        # Any fill in progress may have missed this message
+        self._loads.pop(conversation_id, None)
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return
+        entry.messages.append(message)
+        if len(entry.messages) > entry.capacity:
+            del entry.messages[:len(entry.messages) - entry.capacity]
+        entry.expires_at = time.monotonic() + self.ttl
+        self._entries.move_to_end(conversation_id)
+
+    def recorded(self, conversation_id: str, version: int):
+        """Follow a version bump caused by this process's own flush"""
+        entry = self._entries.get(conversation_id)
+        if entry is None or entry.version is None:
+            return
+        if entry.version == version - 1:
+            entry.version = version
+        else:
+            # Another process wrote in between
+            del self._entries[conversation_id]
+
+    def invalidate(self, conversation_id: str):
+        """Drop a conversation, e.g. after it was deleted"""
+        self._loads.pop(conversation_id, None)
+        self._entries.pop(conversation_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Get the hit, miss, eviction and stale counters"""
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "stale": self.stale,
+        }
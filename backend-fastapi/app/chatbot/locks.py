@@ -0,0 +1,155 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+POLICY_QUEUE = "queue"
+POLICY_REJECT = "reject"
+POLICY_COALESCE = "coalesce"
+POLICIES = (POLICY_QUEUE, POLICY_REJECT, POLICY_COALESCE)
+
+
+class ConversationBusyError(Exception):
+    """The conversation already has a turn in progress and cannot take another now"""
+
+
+class _Entry:
+    __slots__ = ("lock", "users", "shared")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # Turns holding or waiting for the lock
+        self.users = 0
+        # Result of the turn in progress per request key, for coalescing
+        self.shared: Dict[Hashable, asyncio.Future] = {}
+
+
+class Turn:
+    """A reserved place in a conversation's queue of turns
+
+    Use as an async context manager around the turn. With the coalesce
+    policy, a reservation for a request identical to one in progress gets
+    `shared` instead: a future with that turn's result.
+    """
+
+    def __init__(self, locks: "ConversationLocks", conversation_id: str, entry: Optional[_Entry],
+                 key: Optional[Hashable], shared: Optional[asyncio.Future] = None):
+        self._locks = locks
+        self._conversation_id = conversation_id
+        self._entry = entry
+        self._key = key
+        self._future: Optional[asyncio.Future] = None
+        self._released = False
+        self.shared = shared
+
+    async def __aenter__(self):
+        try:
+            await self._entry.lock.acquire()
+        except BaseException:
+            self.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._entry.lock.release()
+        self.release()
+
+    def set_result(self, value: Any):
+        """Share the turn's result with identical requests that arrive while it runs"""
+        if self._future is not None and not self._future.done():
+            self._future.set_result(value)
+
+    def release(self):
+        """Give up the reservation; also for turns that never started"""
+        if self._released or self._entry is None:
+            return
+        self._released = True
+        if self._future is not None:
+            if self._entry.shared.get(self._key) is self._future:
+                del self._entry.shared[self._key]
+            if not self._future.done():
+                # Followers of a failed turn run their own
+                self._future.cancel()
+        self._locks._leave(self._conversation_id, self._entry)
+
+
+class ConversationLocks:
+    """Serializes the turns of each conversation
+
+    Every conversation with a turn in progress has an entry with its own lock,
+    so different conversations never wait on each other. Entries are removed
+    as soon as the last turn leaves, which bounds the table by the number of
+    busy conversations. At most `max_queued` turns may hold or wait for one
+    conversation's lock. The locks live in this process, so turns served by
+    different workers are not serialized against each other.
+
+    Policies for a conversation that is busy:
+    - queue: wait for the turns before it
+    - reject: raise ConversationBusyError
+    - coalesce: share the result of an identical request in progress,
+      otherwise wait like queue
+    """
+
+    def __init__(self, policy: str = POLICY_QUEUE, max_queued: int = 8):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown conversation lock policy: {policy}")
+        self.policy = policy
+        self.max_queued = max_queued
+        self._entries: Dict[str, _Entry] = {}
+        self.rejected = 0
+        self.coalesced = 0
+        self.waited = 0
+
+    def reserve(self, conversation_id: str, key: Optional[Hashable] = None) -> Turn:
+        """Reserve a turn; synchronous, so checking and reserving cannot interleave"""
+        entry = self._entries.get(conversation_id)
+        if entry is not None and self.policy == POLICY_COALESCE and key in entry.shared:
+            future = entry.shared[key]
+            if not future.cancelled():
+                self.coalesced += 1
+                return Turn(self, conversation_id, None, key, shared=future)
+
+        busy = entry is not None and entry.users > 0
+        if busy and (self.policy == POLICY_REJECT or entry.users >= self.max_queued):
+            self.rejected += 1
+            raise ConversationBusyError(f"Conversation {conversation_id} is busy, try again shortly")
+
+        if entry is None:
+            entry = self._entries[conversation_id] = _Entry()
+        if busy:
+            self.waited += 1
+        entry.users += 1
+        turn = Turn(self, conversation_id, entry, key)
+        if self.policy == POLICY_COALESCE and key is not None:
+            turn._future = asyncio.get_event_loop().create_future()
+            entry.shared[key] = turn._future
+        return turn
+
+    def _leave(self, conversation_id: str, entry: _Entry):
+        entry.users -= 1
+        if entry.users == 0 and self._entries.get(conversation_id) is entry:
+            del self._entries[conversation_id]
+
+    async def run(self, conversation_id: str, key: Hashable, turn_fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run one turn of a conversation under the policy and return its result"""
+        while True:
+            turn = self.reserve(conversation_id, key)
+            if turn.shared is None:
+                break
+            try:
+                return await asyncio.shield(turn.shared)
+            except asyncio.CancelledError:
+                if not turn.shared.cancelled():
+                    raise
+                # The turn we were following failed; run our own
+
+        async with turn:
+            result = await turn_fn()
+            turn.set_result(result)
+            return result
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "busyConversations": len(self._entries),
+            "rejected": self.rejected,
+            "coalesced": self.coalesced,
+            "waited": self.waited,
+        }
@@ -0,0 +1,185 @@
+import asyncio
+from datetime import datetime
+from typing import Callable, List, Dict, Any, Optional
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from app.chatbot.summaries import record_messages
+
+DUPLICATE_KEY_ERROR = 11000
+# Messages the database kept rejecting, with the error, for inspection and replay
+DEAD_LETTER_COLLECTION = "messages_dead_letter"
+# Buffered batches allowed before writers wait for a flush
+MAX_PENDING_BATCHES = 10
+
+
+class MessageWriter:
+    """Write-behind buffer that persists messages with batched insert_many calls
+
+    Messages are queued in memory and flushed when `max_batch_size` messages
+    are pending or `flush_interval` seconds have passed. Queued and in-flight
+    messages stay visible through `pending_for`, so readers can merge them
+    with what is already in Mongo (read-your-writes). `on_recorded` is called
+    with each conversation's new summary version after a flush.
+
+    A message the database rejects (other than as a duplicate) is retried on
+    the next flushes; after `max_attempts` it is moved to the dead-letter
+    collection so the messages queued behind it are written.
+    """
+
+    def __init__(
+        self,
+        messages_collection,
+        conversations_collection,
+        max_batch_size: int = 100,
+        flush_interval: float = 0.05,
+        enabled: bool = True,
+        on_recorded: Optional[Callable[[str, int], None]] = None,
+        dead_letters_collection=None,
+        max_attempts: int = 5,
+    ):
+        self.messages_collection = messages_collection
+        self.conversations_collection = conversations_collection
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self.on_recorded = on_recorded
+        self.dead_letters_collection = dead_letters_collection
+        self.max_attempts = max_attempts
+        # _id -> failed attempts of messages the database rejected
+        self._attempts: Dict[ObjectId, int] = {}
+        self.dead_lettered = 0
+        self._buffer: List[Dict[str, Any]] = []
+        self._inflight: List[Dict[str, Any]] = []
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def _ensure_started(self):
+        """Start the background flush task on the running event loop"""
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._flush_lock = asyncio.Lock()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def write(self, document: Dict[str, Any]):
+        """Queue a message document for persistence
+
+        Documents must carry a client-generated `_id` so that readers can
+        de-duplicate messages that are both pending and already flushed.
+        """
+        if not self.enabled:
+            await self.messages_collection.insert_one(document)
+            self._recorded(await record_messages(self.conversations_collection, [document]))
+            return
+        self._ensure_started()
+        self._buffer.append(document)
+        if len(self._buffer) >= self.max_batch_size * MAX_PENDING_BATCHES:
+            # Mongo is not keeping up, make the writer wait instead of growing the buffer
+            await self.flush()
+        elif len(self._buffer) >= self.max_batch_size:
+            self._wakeup.set()
+
+    def pending_for(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """Get the messages of a conversation that may not be in Mongo yet, in write order"""
+        return [
+            document
+            for document in self._inflight + self._buffer
+            if document["conversationId"] == conversation_id
+        ]
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Persist every queued message"""
+        if self._flush_lock is None:
+            return
+        async with self._flush_lock:
+            while self._buffer:
+                batch = self._buffer[:self.max_batch_size]
+                del self._buffer[:len(batch)]
+                self._inflight = batch
+                try:
+                    inserted = await self._insert_batch(batch)
+                finally:
+                    self._inflight = []
+                if inserted < len(batch):
+                    # Put the unwritten tail back in front and retry on the next tick
+                    self._buffer[:0] = batch[inserted:]
+                    break
+
+    async def _insert_batch(self, batch: List[Dict[str, Any]]) -> int:
+        """Insert a batch in order and return how many messages are done with, persisted or dead-lettered"""
+        skipped = 0
+        try:
+            await self.messages_collection.insert_many(batch, ordered=True)
+            inserted = len(batch)
+        except BulkWriteError as error:
+            inserted = error.details.get("nInserted", 0)
+            write_errors = error.details.get("writeErrors", [])
+            if write_errors and write_errors[0].get("code") == DUPLICATE_KEY_ERROR:
+                # Written by an earlier attempt whose acknowledgement was lost
+                inserted += 1
+            elif write_errors and inserted < len(batch):
+                if await self._reject(batch[inserted], write_errors[0]):
+                    skipped = 1
+            remaining = len(batch) - inserted - skipped
+            print(f"Error flushing messages, {remaining} will be retried: {error}")
+        except Exception as error:
+            print(f"Error flushing messages, {len(batch)} will be retried: {error}")
+            return 0
+        if self._attempts:
+            for document in batch[:inserted]:
+                self._attempts.pop(document["_id"], None)
+        try:
+            self._recorded(await record_messages(self.conversations_collection, batch[:inserted]))
+        except Exception as error:
+            print(f"Error updating conversation summaries: {error}")
+        return inserted + skipped
+
+    async def _reject(self, document: Dict[str, Any], write_error: Dict[str, Any]) -> bool:
+        """Count a failed attempt at a message; past `max_attempts` dead-letter it and return True"""
+        attempts = self._attempts.get(document["_id"], 0) + 1
+        if attempts < self.max_attempts:
+            self._attempts[document["_id"]] = attempts
+            return False
+        self._attempts.pop(document["_id"], None)
+        self.dead_lettered += 1
+        print(
+            f"Giving up on message {document['_id']} of conversation {document['conversationId']} "
+            f"after {attempts} attempts: {write_error.get('errmsg')}"
+        )
+        if self.dead_letters_collection is not None:
+            try:
+                await self.dead_letters_collection.insert_one({
+                    "_id": ObjectId(),
+                    "message": document,
+                    "error": {"code": write_error.get("code"), "errmsg": write_error.get("errmsg")},
+                    "attempts": attempts,
+                    "failedAt": datetime.utcnow(),
+                })
+            except Exception as error:
+                print(f"Error dead-lettering message {document['_id']}: {error}; dropped: {document!r}")
+        return True
+
+    def _recorded(self, versions: Dict[str, int]):
+        if self.on_recorded is not None:
+            for conversation_id, version in versions.items():
+                self.on_recorded(conversation_id, version)
+
+    async def close(self):
+        """Stop the background task and flush whatever is still queued"""
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
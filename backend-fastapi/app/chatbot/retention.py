@@ -0,0 +1,324 @@
+import asyncio
+import gzip
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import quote
+from bson import ObjectId
+from pymongo import ReturnDocument
+from app.utils.serialization import to_ndjson_line
+
+# Pending background deletes, so they resume after a restart
+PURGES_COLLECTION = "conversation_purges"
+# A claim on an expired conversation lapses after this long, e.g. if its worker died
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def archive_path(archive_dir: str, conversation_id: str, last_message_time: datetime) -> str:
+    """Where a conversation is archived: one gzipped NDJSON file per conversation, by month"""
+    name = f"{quote(conversation_id, safe='')}-{last_message_time.strftime('%Y%m%dT%H%M%S')}.ndjson.gz"
+    return os.path.join(archive_dir, last_message_time.strftime("%Y"), last_message_time.strftime("%m"), name)
+
+
+async def write_archive(messages_collection, conversation_id: str, before: datetime, path: str, batch_size: int) -> int:
+    """Write a conversation's messages up to `before` to a gzipped NDJSON file and return the count
+
+    Messages are streamed from the cursor one batch at a time and compressed
+    off the event loop. The file appears under its final name only once it is
+    complete.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.{os.getpid()}.partial"
+    archive = await asyncio.to_thread(gzip.open, partial, "wb")
+    count = 0
+    try:
+        cursor = (
+            messages_collection.find({"conversationId": conversation_id, "createdAt": {"$lte": before}})
+            .sort([("createdAt", 1), ("_id", 1)])
+            .batch_size(batch_size)
+        )
+        lines = []
+        async for message in cursor:
+            lines.append(to_ndjson_line(message))
+            count += 1
+            if len(lines) >= batch_size:
+                await asyncio.to_thread(archive.write, b"".join(lines))
+                lines = []
+        if lines:
+            await asyncio.to_thread(archive.write, b"".join(lines))
+        await asyncio.to_thread(archive.close)
+    except BaseException:
+        await asyncio.to_thread(archive.close)
+        os.remove(partial)
+        raise
+    os.replace(partial, path)
+    return count
+
+
+class Purger:
+    """Deletes the messages of removed conversations in batches, in the background
+
+    A job covers a conversation's messages created up to `before`, so messages
+    written to the same conversation id afterwards are kept. Each round
+    deletes at most `batch_size` messages by _id and then yields for `pause`
+    seconds, so a large conversation never holds up requests. Jobs are stored
+    in the purges collection until done and are picked up again by `resume`.
+    Until a job finishes, `cutoff` tells readers in this process which
+    messages to hide.
+    """
+
+    def __init__(self, messages_collection, purges_collection, batch_size: int = 1000, pause: float = 0.01):
+        self.messages_collection = messages_collection
+        self.purges_collection = purges_collection
+        self.batch_size = batch_size
+        self.pause = pause
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # conversationId -> newest `before` of its unfinished jobs
+        self._cutoffs: Dict[str, datetime] = {}
+        self._jobs: Dict[str, int] = {}
+        self.scheduled = 0
+        self.purged_messages = 0
+        self.failures = 0
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def cutoff(self, conversation_id: str) -> Optional[datetime]:
+        """Messages of the conversation created up to this time are being deleted"""
+        return self._cutoffs.get(conversation_id)
+
+    def cutoffs(self) -> Dict[str, datetime]:
+        """Cutoffs of every conversation with a deletion in progress"""
+        return dict(self._cutoffs)
+
+    def _track(self, job: Dict[str, Any]):
+        conversation_id = job["conversationId"]
+        current = self._cutoffs.get(conversation_id)
+        if current is None or job["before"] > current:
+            self._cutoffs[conversation_id] = job["before"]
+        self._jobs[conversation_id] = self._jobs.get(conversation_id, 0) + 1
+        self._ensure_started()
+        self._queue.put_nowait(job)
+
+    async def schedule(self, conversation_id: str, before: datetime):
+        """Record a job and queue it; returns once the job is stored, not when it is done"""
+        # Stored with Mongo's millisecond precision, so a resumed job covers the same messages
+        before = before.replace(microsecond=before.microsecond // 1000 * 1000)
+        job = {"_id": ObjectId(), "conversationId": conversation_id, "before": before, "createdAt": datetime.utcnow()}
+        await self.purges_collection.insert_one(job)
+        self.scheduled += 1
+        self._track(job)
+
+    async def resume(self) -> int:
+        """Queue the jobs left unfinished by a previous run"""
+        jobs = await self.purges_collection.find({}).sort("createdAt", 1).to_list(length=None)
+        for job in jobs:
+            self._track(job)
+        return len(jobs)
+
+    async def _run(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self.purge(job)
+            except Exception as error:
+                self.failures += 1
+                print(f"Error purging conversation {job['conversationId']}: {error}")
+            finally:
+                self._finish(job["conversationId"])
+                self._queue.task_done()
+
+    def _finish(self, conversation_id: str):
+        self._jobs[conversation_id] -= 1
+        if self._jobs[conversation_id] == 0:
+            del self._jobs[conversation_id]
+            del self._cutoffs[conversation_id]
+
+    async def purge(self, job: Dict[str, Any]) -> int:
+        """Delete a job's messages batch by batch, then the job itself"""
+        started = time.perf_counter()
+        query = {"conversationId": job["conversationId"], "createdAt": {"$lte": job["before"]}}
+        deleted = 0
+        while True:
+            batch = await (
+                self.messages_collection.find(query, {"_id": 1}).limit(self.batch_size).to_list(length=self.batch_size)
+            )
+            if not batch:
+                break
+            result = await self.messages_collection.delete_many({"_id": {"$in": [message["_id"] for message in batch]}})
+            deleted += result.deleted_count
+            self.purged_messages += result.deleted_count
+            await asyncio.sleep(self.pause)
+        await self.purges_collection.delete_one({"_id": job["_id"]})
+        print(
+            f"Purged {deleted} messages of conversation {job['conversationId']} "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+        return deleted
+
+    async def join(self):
+        """Wait until every queued job has run"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": sum(self._jobs.values()),
+            "scheduled": self.scheduled,
+            "purgedMessages": self.purged_messages,
+            "failures": self.failures,
+        }
+
+
+class RetentionSweeper:
+    """Expires conversations whose last message is older than `days`
+
+    Every `interval` seconds the oldest expired conversations are taken from
+    the summaries, up to `batch` at a time. Each one is claimed first so
+    several workers never handle it twice, archived to `archive_dir` unless
+    that is None, and passed to `remove`, which drops it from listings and
+    schedules its messages for batched deletion. `remove` gets the conditions
+    under which the summary is still the one that was claimed; a conversation
+    written to while it was being archived is left alone.
+    """
+
+    def __init__(
+        self,
+        messages_collection,
+        conversations_collection,
+        remove: Callable[[str, datetime, Dict[str, Any]], Awaitable[bool]],
+        days: int,
+        archive_dir: Optional[str] = None,
+        interval: float = 3600.0,
+        batch: int = 100,
+        export_batch_size: int = 500,
+    ):
+        self.messages_collection = messages_collection
+        self.conversations_collection = conversations_collection
+        self.remove = remove
+        self.days = days
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self.batch = batch
+        self.export_batch_size = export_batch_size
+        self._task: Optional[asyncio.Task] = None
+        self.expired = 0
+        self.archived_messages = 0
+        self.failures = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as error:
+                self.failures += 1
+                print(f"Error sweeping expired conversations: {error}")
+            await asyncio.sleep(self.interval)
+
+    async def sweep(self, now: Optional[datetime] = None) -> List[str]:
+        """Expire every conversation past retention and return their ids"""
+        now = now or datetime.utcnow()
+        cutoff = now - timedelta(days=self.days)
+        expired = []
+        query: Dict[str, Any] = {"lastMessageTime": {"$lt": cutoff}}
+        while True:
+            candidates = await (
+                self.conversations_collection.find(query, {"_id": 0, "conversationId": 1, "lastMessageTime": 1})
+                .sort([("lastMessageTime", 1), ("conversationId", 1)])
+                .limit(self.batch)
+                .to_list(length=self.batch)
+            )
+            for candidate in candidates:
+                if await self.expire(candidate["conversationId"], cutoff, now):
+                    expired.append(candidate["conversationId"])
+            if len(candidates) < self.batch:
+                return expired
+            # Continue after this batch; conversations claimed elsewhere are skipped, not retried
+            last = candidates[-1]
+            query = {"$or": [
+                {"lastMessageTime": {"$gt": last["lastMessageTime"], "$lt": cutoff}},
+                {"lastMessageTime": last["lastMessageTime"], "conversationId": {"$gt": last["conversationId"]}},
+            ]}
+
+    async def expire(self, conversation_id: str, cutoff: datetime, now: datetime) -> bool:
+        """Archive and remove one expired conversation unless another worker has it or it was written to"""
+        summary = await self.conversations_collection.find_one_and_update(
+            {
+                "conversationId": conversation_id,
+                "lastMessageTime": {"$lt": cutoff},
+                "$or": [
+                    {"retentionClaimedAt": {"$exists": False}},
+                    {"retentionClaimedAt": {"$lt": now - CLAIM_TIMEOUT}},
+                ],
+            },
+            {"$set": {"retentionClaimedAt": now}},
+            # The stored claim, which Mongo rounds to milliseconds
+            return_document=ReturnDocument.AFTER,
+        )
+        if summary is None:
+            # Written to again, already expired, or claimed by another worker
+            return False
+        before = summary["lastMessageTime"]
+        claim = {"lastMessageTime": before, "retentionClaimedAt": summary["retentionClaimedAt"]}
+        path = None
+        try:
+            if self.archive_dir is not None:
+                path = archive_path(self.archive_dir, conversation_id, before)
+                archived = await write_archive(
+                    self.messages_collection, conversation_id, before, path, self.export_batch_size
+                )
+            removed = await self.remove(conversation_id, before, claim)
+        except BaseException:
+            await self._release(conversation_id, claim)
+            raise
+        if not removed:
+            # A new message arrived meanwhile, so the conversation is live again
+            if path is not None:
+                os.remove(path)
+            await self._release(conversation_id, claim)
+            return False
+        if path is not None:
+            self.archived_messages += archived
+        self.expired += 1
+        return True
+
+    async def _release(self, conversation_id: str, claim: Dict[str, Any]):
+        """Give up a claim so the next sweep looks at the conversation again"""
+        await self.conversations_collection.update_one(
+            {"conversationId": conversation_id, "retentionClaimedAt": claim["retentionClaimedAt"]},
+            {"$unset": {"retentionClaimedAt": ""}},
+        )
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "expired": self.expired,
+            "archivedMessages": self.archived_messages,
+            "failures": self.failures,
+        }
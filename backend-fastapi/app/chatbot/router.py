@@ -1,16 +1,28 @@
-from fastapi import APIRouter, HTTPException, Response
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response, WebSocket
 from fastapi.responses import StreamingResponse
-from typing import List
+from typing import List, Optional, Union
 import json
-from bson import ObjectId
+from urllib.parse import quote
 from app.schemas.message import (
     CreateMessageRequest,
     CreateMessageResponse,
     ConversationInfo,
+    ConversationPage,
+    HistoryPage,
+    SearchPage,
     DeleteConversationResponse,
     HealthCheckResponse
 )
 from app.chatbot.service import get_chatbot_service
+from app.chatbot.streams import StreamNotFoundError, StreamExpiredError
+from app.chatbot.locks import ConversationBusyError
+from app.chatbot.websocket import ChatSocket
+from app.utils.openai_client import openai_client
+from app.utils.pagination import MAX_PAGE_SIZE
+from app.utils.serialization import dumps
+from app.utils.http_cache import REVALIDATE_HEADERS, etag_matches
+from app.utils.sse import sse_stream
+from app.config import settings
 
 router = APIRouter()
 
@@ -21,20 +33,22 @@ async def send_message(create_message_dto: CreateMessageRequest):
     try:
         result = await chatbot_service.process_message(create_message_dto)
         return result
+    except ConversationBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/message/stream")
-async def send_message_stream(create_message_dto: CreateMessageRequest):
-    """Send a message to the chatbot and stream the response"""
-    chatbot_service = get_chatbot_service()
-    
-    async def event_generator():
-        async for event in chatbot_service.process_message_stream(create_message_dto):
-            yield event
-    
+def _event_stream_response(request: Request, source, coalesce_ms: Optional[int], coalesce_bytes: Optional[int]):
+    window_ms = settings.SSE_COALESCE_MS if coalesce_ms is None else coalesce_ms
     return StreamingResponse(
-        event_generator(),
+        sse_stream(
+            source,
+            window=window_ms / 1000,
+            max_bytes=coalesce_bytes or settings.SSE_COALESCE_BYTES,
+            heartbeat_interval=settings.SSE_HEARTBEAT_SECONDS,
+            # Detaches from the generation promptly when the browser goes away
+            is_disconnected=request.is_disconnected,
+        ),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -44,56 +58,192 @@ async def send_message_stream(create_message_dto: CreateMessageRequest):
         }
     )
 
-@router.get("/conversations", response_model=List[ConversationInfo])
-async def get_all_conversations(response: Response):
-    """Get all conversations"""
+def _resume_stream(last_event_id: str):
+    """Find the buffered stream a Last-Event-ID points into"""
+    chatbot_service = get_chatbot_service()
+    try:
+        return chatbot_service.streams.resume(last_event_id)
+    except StreamNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except StreamExpiredError as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/message/stream")
+async def send_message_stream(
+    create_message_dto: CreateMessageRequest,
+    request: Request,
+    coalesce_ms: Optional[int] = Query(None, ge=0, le=1000),
+    coalesce_bytes: Optional[int] = Query(None, ge=1, le=65536),
+    last_event_id: Optional[str] = Header(None),
+):
+    """Send a message to the chatbot and stream the response
+
+    Token deltas are coalesced into frames of up to `coalesce_bytes` bytes or
+    `coalesce_ms` milliseconds; `coalesce_ms=0` sends one frame per token.
+    A retry carrying a `Last-Event-ID` header resumes the earlier stream
+    instead of sending the message again.
+    """
+    chatbot_service = get_chatbot_service()
+    if last_event_id:
+        buffer, after = _resume_stream(last_event_id)
+    else:
+        try:
+            buffer, after = chatbot_service.start_message_stream(create_message_dto), 0
+        except ConversationBusyError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    source = chatbot_service.streams.follow(buffer, after)
+    return _event_stream_response(request, source, coalesce_ms, coalesce_bytes)
+
+@router.get("/message/stream/{stream_id}")
+async def resume_message_stream(
+    stream_id: str,
+    request: Request,
+    coalesce_ms: Optional[int] = Query(None, ge=0, le=1000),
+    coalesce_bytes: Optional[int] = Query(None, ge=1, le=65536),
+    last_event_id: Optional[str] = Header(None),
+):
+    """Reattach to a stream, replaying the events after Last-Event-ID (or all of them)"""
+    chatbot_service = get_chatbot_service()
+    buffer, after = _resume_stream(last_event_id or f"{stream_id}:0")
+    if buffer.stream_id != stream_id:
+        raise HTTPException(status_code=400, detail="Last-Event-ID belongs to another stream")
+    source = chatbot_service.streams.follow(buffer, after)
+    return _event_stream_response(request, source, coalesce_ms, coalesce_bytes)
+
+@router.websocket("/ws")
+async def chat_socket(
+    websocket: WebSocket,
+    coalesce_ms: Optional[int] = Query(None, ge=0, le=1000),
+    coalesce_bytes: Optional[int] = Query(None, ge=1, le=65536),
+):
+    """Chat over one WebSocket, with the turns of many conversations multiplexed on it"""
+    await websocket.accept()
+    window_ms = settings.SSE_COALESCE_MS if coalesce_ms is None else coalesce_ms
+    await ChatSocket(
+        websocket,
+        get_chatbot_service(),
+        window=window_ms / 1000,
+        max_bytes=coalesce_bytes or settings.SSE_COALESCE_BYTES,
+        heartbeat_interval=settings.SSE_HEARTBEAT_SECONDS,
+        max_turns=settings.WS_MAX_TURNS,
+        send_queue_size=settings.WS_SEND_QUEUE_SIZE,
+    ).run()
+
+def _json_response(content: bytes, etag: Optional[str] = None) -> Response:
+    """Send pre-serialized JSON; skips response_model validation and re-encoding
+
+    With an ETag clients may keep the body but must revalidate it with
+    If-None-Match; without one it is not stored.
+    """
+    headers = {**REVALIDATE_HEADERS, "ETag": etag} if etag else {"Cache-Control": "no-store"}
+    return Response(content=content, media_type="application/json", headers=headers)
+
+async def _conditional_json(if_none_match: Optional[str], etag: str, load) -> Response:
+    """Answer 304 if the client's copy is current, otherwise load and send the body"""
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={**REVALIDATE_HEADERS, "ETag": etag})
+    return _json_response(await load(), etag)
+
+async def _dumps_page(page) -> bytes:
+    return dumps(await page)
+
+@router.get("/conversations", response_model=Union[List[ConversationInfo], ConversationPage])
+async def get_all_conversations(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+):
+    """Get all conversations, or one page of them when limit or cursor is given
+
+    Responses carry an ETag; send it back in If-None-Match to get a 304 when
+    nothing changed.
+    """
+    chatbot_service = get_chatbot_service()
+    if limit is not None or cursor is not None:
+        try:
+            etag = await chatbot_service.get_conversations_etag(limit, cursor)
+            return await _conditional_json(
+                if_none_match,
+                etag,
+                lambda: _dumps_page(chatbot_service.get_conversations_page(limit or MAX_PAGE_SIZE, cursor)),
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    try:
+        etag = await chatbot_service.get_conversations_etag()
+        return await _conditional_json(if_none_match, etag, chatbot_service.get_all_conversations_json)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/history/{conversation_id}", response_model=Union[List[dict], HistoryPage])
+async def get_history(
+    conversation_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+):
+    """Get conversation history, or one page of it when limit or cursor is given
+
+    Responses carry an ETag; send it back in If-None-Match to get a 304 when
+    nothing changed.
+    """
     chatbot_service = get_chatbot_service()
-    # Disable cache
-    response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate"
-    response.headers["Pragma"] = "no-cache"
-    response.headers["Expires"] = "0"
-    
+    if limit is not None or cursor is not None:
+        try:
+            etag = await chatbot_service.get_history_etag(conversation_id, limit, cursor)
+            return await _conditional_json(
+                if_none_match,
+                etag,
+                lambda: _dumps_page(chatbot_service.get_conversation_history_page(
+                    conversation_id, limit or MAX_PAGE_SIZE, cursor
+                )),
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
     try:
-        conversations = await chatbot_service.get_all_conversations()
-        # Ensure proper JSON serialization
-        serialized_conversations = []
-        for conversation in conversations:
-            serialized_conversation = {}
-            for key, value in conversation.items():
-                if isinstance(value, ObjectId):
-                    serialized_conversation[key] = str(value)
-                else:
-                    serialized_conversation[key] = value
-            serialized_conversations.append(serialized_conversation)
-        return serialized_conversations
+        etag = await chatbot_service.get_history_etag(conversation_id)
+        return await _conditional_json(
+            if_none_match, etag, lambda: chatbot_service.get_conversation_history_json(conversation_id)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/history/{conversation_id}")
-async def get_history(conversation_id: str, response: Response):
-    """Get conversation history"""
+@router.get("/search", response_model=SearchPage)
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+    """Search messages of all conversations; returns ranked hits with a snippet, one page at a time"""
     chatbot_service = get_chatbot_service()
-    # Disable cache
-    response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate"
-    response.headers["Pragma"] = "no-cache"
-    response.headers["Expires"] = "0"
-    
     try:
-        history = await chatbot_service.get_conversation_history(conversation_id)
-        # Ensure proper JSON serialization
-        serialized_history = []
-        for message in history:
-            serialized_message = {}
-            for key, value in message.items():
-                if isinstance(value, ObjectId):
-                    serialized_message[key] = str(value)
-                else:
-                    serialized_message[key] = value
-            serialized_history.append(serialized_message)
-        return serialized_history
+        return _json_response(dumps(await chatbot_service.search_messages(q, limit, cursor)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/history/{conversation_id}/export")
+async def export_history(conversation_id: str):
+    """Export conversation history as NDJSON, one message per line"""
+    chatbot_service = get_chatbot_service()
+    return StreamingResponse(
+        chatbot_service.export_conversation_history(conversation_id, settings.EXPORT_BATCH_SIZE),
+        media_type="application/x-ndjson",
+        headers={
+            "Cache-Control": "no-store",
+            "Content-Disposition": f'attachment; filename="{quote(conversation_id, safe="")}.ndjson"',
+        }
+    )
+
 @router.post("/conversations/{conversation_id}/delete", response_model=DeleteConversationResponse)
 async def delete_conversation(conversation_id: str):
     """Delete a conversation"""
@@ -110,6 +260,11 @@ async def delete_conversation(conversation_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/upstreams")
+async def get_upstreams():
+    """Get per-upstream load, latency and error statistics"""
+    return openai_client.upstream_stats()
+
 @router.get("/health", response_model=HealthCheckResponse)
 async def health_check():
     """Health check endpoint"""
@@ -0,0 +1,104 @@
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
+
+# Characters of message content shown around the first matching term
+SNIPPET_CHARS = 160
+
+_TOKEN = re.compile(r'-?"[^"]*"|\S+')
+_WORD = re.compile(r"\w+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def search_terms(query: str) -> List[str]:
+    """Get the lowercased words a $text query searches for, leaving out negated ones"""
+    terms = []
+    for token in _TOKEN.findall(query):
+        if token.startswith("-"):
+            continue
+        terms.extend(word.lower() for word in _WORD.findall(token))
+    return terms
+
+
+def make_snippet(content: str, terms: List[str], width: int = SNIPPET_CHARS) -> str:
+    """Cut `width` characters of content around the first occurrence of a search term
+
+    The text index matches stems, so a term is also found by its leading
+    characters (e.g. "running" by "runn"); without any match the snippet is
+    the start of the message.
+    """
+    content = _WHITESPACE.sub(" ", content).strip()
+    if len(content) <= width:
+        return content
+    prefixes = sorted({term[: max(len(term) - 3, 3)] for term in terms}, key=len, reverse=True)
+    start = 0
+    if prefixes:
+        match = re.search(r"\b(" + "|".join(re.escape(p) for p in prefixes) + ")", content, re.IGNORECASE)
+        if match is not None:
+            # Show some context before the match
+            start = max(min(match.start() - width // 4, len(content) - width), 0)
+    snippet = content[start:start + width]
+    if start > 0:
+        snippet = "…" + snippet.lstrip()
+    if start + width < len(content):
+        snippet = snippet.rstrip() + "…"
+    return snippet
+
+
+def search_pipeline(
+    query: str,
+    limit: int,
+    after: Optional[Tuple[float, ObjectId]] = None,
+    hidden: Optional[Dict[str, datetime]] = None,
+    max_candidates: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Build the aggregation for one page of hits, best first, keyed on (score, _id)
+
+    The $text stage reads the content_text index; the matches are then scored,
+    filtered to those after the previous page's last hit and sorted. `hidden`
+    maps conversations being deleted to the time up to which their messages
+    are left out. With `max_candidates` only that many matches are fetched
+    and ranked, which bounds the cost of a page for very common words at the
+    price of ranking just part of their hits.
+    """
+    match: Dict[str, Any] = {"$text": {"$search": query}}
+    if hidden:
+        match["$nor"] = [
+            {"conversationId": conversation_id, "createdAt": {"$lte": cutoff}}
+            for conversation_id, cutoff in hidden.items()
+        ]
+    pipeline: List[Dict[str, Any]] = [{"$match": match}]
+    if max_candidates:
+        pipeline.append({"$limit": max_candidates})
+    pipeline += [
+        {"$project": {
+            "conversationId": 1,
+            "role": 1,
+            "content": 1,
+            "createdAt": 1,
+            "score": {"$meta": "textScore"},
+        }},
+    ]
+    if after is not None:
+        score, message_id = after
+        pipeline.append({"$match": {"$or": [
+            {"score": {"$lt": score}},
+            {"score": score, "_id": {"$lt": message_id}},
+        ]}})
+    pipeline += [
+        {"$sort": {"score": -1, "_id": -1}},
+        {"$limit": limit + 1},
+    ]
+    return pipeline
+
+
+def to_hit(document: Dict[str, Any], terms: List[str]) -> Dict[str, Any]:
+    return {
+        "conversationId": document["conversationId"],
+        "messageId": str(document["_id"]),
+        "role": document["role"],
+        "createdAt": document["createdAt"],
+        "score": document["score"],
+        "snippet": make_snippet(document.get("content") or "", terms),
+    }
@@ -1,87 +1,244 @@
 import asyncio
-from typing import List, Dict, Any
+import os
+import time
+from typing import List, Dict, Any, Optional
 from datetime import datetime
 from bson import ObjectId
-from app.models.message import Message
 from app.schemas.message import CreateMessageRequest
 from app.database.connection import get_collection
-from app.utils.openai_client import openai_client
+from app.utils.openai_client import openai_client, MAX_TOKENS
+from app.chatbot.context import TokenCounter, build_context
+from app.chatbot.summaries import CONVERSATIONS_COLLECTION, SUMMARY_PROJECTION, delete_summary, get_list_stamp, get_version_stamp
+from app.chatbot.persistence import DEAD_LETTER_COLLECTION, MessageWriter
+from app.chatbot.history_cache import HistoryCache
+from app.chatbot.streams import StreamRegistry
+from app.chatbot.compaction import COMPACTIONS_COLLECTION, Compactor, message_key
+from app.chatbot.locks import ConversationLocks, Turn
+from app.chatbot.search import search_pipeline, search_terms, to_hit
+from app.chatbot.retention import PURGES_COLLECTION, Purger, RetentionSweeper
+from app.utils.pagination import encode_cursor, decode_cursor, encode_score_cursor, decode_score_cursor
+from app.utils.serialization import dumps, to_ndjson_line
+from app.utils.http_cache import make_etag
+from app.utils.metrics import STREAMS_IN_FLIGHT, observe_stage, record_generation
+from app.config import settings
+
+def _decode_history_cursor(cursor: str):
+    """Decode a history page cursor into (createdAt, ObjectId), raising ValueError if it is malformed"""
+    last_time, last_id = decode_cursor(cursor)
+    if not ObjectId.is_valid(last_id):
+        raise ValueError("Invalid cursor")
+    return last_time, ObjectId(last_id)
 
 class ChatbotService:
     def __init__(self):
         self.messages_collection = None
+        self.conversations_collection = None
+        self.compactions_collection = None
+        self.purges_collection = None
+        self.message_writer = None
+        self.compactor = None
+        self.purger = None
+        self.retention = None
+        self.history_cache = HistoryCache(
+            max_conversations=settings.HISTORY_CACHE_SIZE,
+            ttl=settings.HISTORY_CACHE_TTL_SECONDS,
+        )
+        self.streams = StreamRegistry(
+            max_streams=settings.STREAM_BUFFER_MAX_STREAMS,
+            max_events=settings.STREAM_BUFFER_EVENTS,
+            ttl=settings.STREAM_BUFFER_TTL_SECONDS,
+            grace=settings.STREAM_RESUME_GRACE_SECONDS,
+        )
+        self.locks = ConversationLocks(
+            policy=settings.CONVERSATION_LOCK_POLICY,
+            max_queued=settings.CONVERSATION_MAX_QUEUED,
+        )
+        self.token_counter = TokenCounter(settings.MODEL)
+        self.abandoned_streams = 0
+        self.tokens_saved = 0
         
     def _ensure_collection(self):
-        """Ensure the messages collection is initialized"""
+        """Ensure the messages and conversations collections and the message writer are initialized"""
         if self.messages_collection is None:
             self.messages_collection = get_collection("messages")
+        if self.conversations_collection is None:
+            self.conversations_collection = get_collection(CONVERSATIONS_COLLECTION)
+        if self.compactions_collection is None:
+            self.compactions_collection = get_collection(COMPACTIONS_COLLECTION)
+        if self.compactor is None and self.compactions_collection is not None:
+            self.compactor = Compactor(
+                self.messages_collection,
+                self.compactions_collection,
+                self._summarize,
+                threshold=settings.COMPACTION_THRESHOLD_MESSAGES,
+                keep_recent=settings.COMPACTION_KEEP_RECENT,
+                keep_originals=settings.COMPACTION_KEEP_ORIGINALS,
+                queue_size=settings.COMPACTION_QUEUE_SIZE,
+                workers=settings.COMPACTION_WORKERS,
+                cache_size=settings.HISTORY_CACHE_SIZE,
+                cache_ttl=settings.HISTORY_CACHE_TTL_SECONDS,
+                conversations_collection=self.conversations_collection,
+                hidden_before=self._hidden_before,
+                max_tokens=settings.CONTEXT_MAX_TOKENS,
+                token_counter=self.token_counter,
+            )
+        if self.purges_collection is None:
+            self.purges_collection = get_collection(PURGES_COLLECTION)
+        if self.purger is None and self.purges_collection is not None:
+            self.purger = Purger(
+                self.messages_collection,
+                self.purges_collection,
+                batch_size=settings.DELETE_BATCH_SIZE,
+                pause=settings.DELETE_BATCH_PAUSE_MS / 1000,
+            )
+        if self.retention is None and settings.RETENTION_DAYS > 0 and self.conversations_collection is not None:
+            self.retention = RetentionSweeper(
+                self.messages_collection,
+                self.conversations_collection,
+                self._remove_conversation,
+                days=settings.RETENTION_DAYS,
+                archive_dir=settings.ARCHIVE_DIR if settings.RETENTION_ARCHIVE else None,
+                interval=settings.RETENTION_SWEEP_INTERVAL_SECONDS,
+                batch=settings.RETENTION_SWEEP_BATCH,
+                export_batch_size=settings.EXPORT_BATCH_SIZE,
+            )
+        if self.message_writer is None:
+            self.message_writer = MessageWriter(
+                self.messages_collection,
+                self.conversations_collection,
+                max_batch_size=settings.WRITE_BATCH_SIZE,
+                flush_interval=settings.WRITE_FLUSH_INTERVAL_MS / 1000,
+                enabled=settings.WRITE_BEHIND_ENABLED,
+                on_recorded=self.history_cache.recorded,
+                dead_letters_collection=get_collection(DEAD_LETTER_COLLECTION),
+                max_attempts=settings.WRITE_MAX_ATTEMPTS,
+            )
         return self.messages_collection
 
+    async def start_background_jobs(self):
+        """Resume unfinished message purges and start the retention sweeper if it is enabled"""
+        self._ensure_collection()
+        if self.purger is not None:
+            resumed = await self.purger.resume()
+            if resumed:
+                print(f"Resumed {resumed} message purges")
+        if self.retention is not None:
+            self.retention.start()
+
+    async def close(self):
+        """Stop background jobs and flush pending message writes"""
+        if self.retention is not None:
+            await self.retention.close()
+        if self.purger is not None:
+            # Unfinished purges are stored and resume on the next start
+            await self.purger.close()
+        if self.compactor is not None:
+            await self.compactor.close()
+        if self.message_writer is not None:
+            await self.message_writer.close()
+
+    async def _summarize(self, prompt: List[Dict[str, str]]) -> str:
+        """Ask the model for a conversation summary"""
+        completion = await openai_client.create_chat_completion(prompt)
+        return completion.choices[0].message.content or ""
+
+    def _schedule_compaction(self, conversation_id: str):
+        """Check the conversation for compaction in the background, off the request path"""
+        if settings.COMPACTION_ENABLED and self.compactor is not None:
+            self.compactor.schedule(conversation_id)
+
+    def _merge_pending(
+        self, conversation_id: str, messages: List[Dict], pending_before: List[Dict]
+    ) -> List[Dict]:
+        """Append messages that are queued for writing but were not read back from Mongo
+
+        `pending_before` is the writer's pending list taken before the query, so
+        messages flushed while the query was running are not lost.
+        """
+        before_ids = {message["_id"] for message in pending_before}
+        pending = pending_before + [
+            message
+            for message in self.message_writer.pending_for(conversation_id)
+            if message["_id"] not in before_ids
+        ]
+        if not pending:
+            return messages
+        seen = {message["_id"] for message in messages}
+        return messages + [dict(message) for message in pending if message["_id"] not in seen]
+
+    async def _save_message(
+        self, conversation_id: str, role: str, content: str, truncated: bool = False
+    ) -> Dict[str, Any]:
+        """Queue a message for writing; the conversation summary is updated when it is flushed
+
+        The document is built directly in the shape of `app.models.message.Message`;
+        every field comes from the service itself, so there is nothing to validate.
+        """
+        now = datetime.utcnow()
+        document = {
+            # Generated here so pending and flushed copies can be matched up
+            "_id": ObjectId(),
+            "conversationId": conversation_id,
+            "role": role,
+            "content": content,
+            "createdAt": now,
+            "updatedAt": now
+        }
+        if truncated:
+            # The client disconnected before the reply was complete
+            document["truncated"] = True
+        await self.message_writer.write(document)
+        self.history_cache.append(
+            conversation_id,
+            {"_id": document["_id"], "role": role, "content": content, "createdAt": now},
+        )
+        return document
+
     async def process_message(self, create_message_dto: CreateMessageRequest) -> Dict[str, Any]:
-        """Process a message and generate AI response"""
+        """Process a message and generate AI response, one turn at a time per conversation
+
+        Raises ConversationBusyError when the lock policy turns the message away.
+        """
+        return await self.locks.run(
+            create_message_dto.conversationId,
+            ("message", create_message_dto.message),
+            lambda: self._process_turn(create_message_dto),
+        )
+
+    async def _process_turn(self, create_message_dto: CreateMessageRequest) -> Dict[str, Any]:
         self._ensure_collection()
+        started = time.perf_counter()
         
         # Save user message to database
-        user_message = Message(
-            conversation_id=create_message_dto.conversationId,
-            role="user",
-            content=create_message_dto.message,
-            created_at=datetime.utcnow(),
-            updated_at=datetime.utcnow()
-        )
-        
-        await self.messages_collection.insert_one({
-            "conversationId": user_message.conversation_id,
-            "role": user_message.role,
-            "content": user_message.content,
-            "createdAt": user_message.created_at,
-            "updatedAt": user_message.updated_at
-        })
-
-        # Get conversation history for context
-        history = await self.get_conversation_history(create_message_dto.conversationId)
-
-        # Prepare messages for OpenAI
-        messages = [
-            {
-                "role": "system",
-                "content": "You are a helpful assistant. Be concise and friendly."
-            }
-        ]
-        
-        for msg in history:
-            messages.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
+        await self._save_message(create_message_dto.conversationId, "user", create_message_dto.message)
+        stage_started = observe_stage("user_insert", started)
+
+        # Prepare messages for OpenAI from the recent conversation history
+        messages = await self.build_prompt(create_message_dto.conversationId)
 
         try:
             # Call OpenAI API
+            stage_started = time.perf_counter()
             completion = await openai_client.create_chat_completion(messages)
             
             ai_response = completion.choices[0].message.content if completion.choices[0].message.content else "Sorry, I could not generate a response."
+            generated_at = observe_stage("generation", stage_started)
+            usage = getattr(completion, "usage", None)
+            tokens = getattr(usage, "completion_tokens", None) or self.token_counter.count_text(ai_response)
+            record_generation("complete", tokens, generated_at - stage_started)
 
             # Save AI response to database
-            assistant_message = Message(
-                conversation_id=create_message_dto.conversationId,
-                role="assistant",
-                content=ai_response,
-                created_at=datetime.utcnow(),
-                updated_at=datetime.utcnow()
+            assistant_message = await self._save_message(
+                create_message_dto.conversationId, "assistant", ai_response
             )
-            
-            await self.messages_collection.insert_one({
-                "conversationId": assistant_message.conversation_id,
-                "role": assistant_message.role,
-                "content": assistant_message.content,
-                "createdAt": assistant_message.created_at,
-                "updatedAt": assistant_message.updated_at
-            })
+            observe_stage("assistant_insert", generated_at)
+            observe_stage("total", started)
+            self._schedule_compaction(create_message_dto.conversationId)
 
             return {
                 "message": ai_response,
                 "conversationId": create_message_dto.conversationId,
-                "timestamp": assistant_message.created_at
+                "timestamp": assistant_message["createdAt"]
             }
         except Exception as error:
             print(f"Error calling OpenAI: {error}")
@@ -91,136 +248,429 @@ class ChatbotService:
                 "error": str(error)
             }
 
+    def _hidden_before(self, conversation_id: str) -> Optional[datetime]:
+        """Messages of the conversation up to this time belong to a deletion still in progress"""
+        return self.purger.cutoff(conversation_id) if self.purger is not None else None
+
+    def _history_query(self, conversation_id: str) -> Dict[str, Any]:
+        """Filter for a conversation's messages, leaving out those of a deletion still in progress"""
+        query: Dict[str, Any] = {"conversationId": conversation_id}
+        cutoff = self._hidden_before(conversation_id)
+        if cutoff is not None:
+            query["createdAt"] = {"$gt": cutoff}
+        return query
+
+    async def _load_history(self, conversation_id: str) -> List[Dict]:
+        """Get a conversation's message documents as stored, oldest first"""
+        self._ensure_collection()
+        pending = self.message_writer.pending_for(conversation_id)
+        cursor = self.messages_collection.find(self._history_query(conversation_id)).sort(
+            [("createdAt", 1), ("_id", 1)]
+        )
+        return self._merge_pending(conversation_id, await cursor.to_list(length=None), pending)
+
     async def get_conversation_history(self, conversation_id: str) -> List[Dict]:
         """Get conversation history"""
-        self._ensure_collection()
-        cursor = self.messages_collection.find({"conversationId": conversation_id}).sort("createdAt", 1)
-        messages = await cursor.to_list(length=None)
+        messages = await self._load_history(conversation_id)
         # Convert ObjectId to string for JSON serialization
         for message in messages:
             if "_id" in message:
                 message["_id"] = str(message["_id"])
         return messages
 
+    async def get_conversation_history_json(self, conversation_id: str) -> bytes:
+        """Get conversation history as a JSON array
+
+        The encoder converts ObjectIds and datetimes while it writes, so the
+        documents are serialized straight from the cursor without copies.
+        """
+        return dumps(await self._load_history(conversation_id))
+
+    async def get_history_etag(
+        self, conversation_id: str, limit: Optional[int] = None, cursor: Optional[str] = None
+    ) -> str:
+        """Get the ETag of a conversation's history, or of one page of it
+
+        Costs one lookup of the conversation's summary on its unique index
+        instead of reading the messages. Messages still queued for writing are
+        part of the responses, so their ids are part of the tag as well. Call
+        this before loading the history: a write in between then yields a tag
+        older than the body, which only costs the client a refetch.
+        """
+        if cursor:
+            _decode_history_cursor(cursor)
+        self._ensure_collection()
+        pending = [message["_id"] for message in self.message_writer.pending_for(conversation_id)]
+        stamp = await get_version_stamp(self.conversations_collection, conversation_id) or {}
+        return make_etag(
+            "history",
+            conversation_id,
+            stamp.get("version"),
+            stamp.get("updatedAt"),
+            stamp.get("messageCount"),
+            pending,
+            limit,
+            cursor,
+        )
+
+    async def export_conversation_history(self, conversation_id: str, batch_size: int):
+        """Stream a conversation's history as NDJSON chunks of up to batch_size messages
+
+        Documents are serialized as they come off the cursor, so memory stays
+        bounded by one batch regardless of the conversation length.
+        """
+        self._ensure_collection()
+        cursor = (
+            self.messages_collection.find(self._history_query(conversation_id))
+            .sort([("createdAt", 1), ("_id", 1)])
+            .batch_size(batch_size)
+        )
+        lines = []
+        async for message in cursor:
+            lines.append(to_ndjson_line(message))
+            if len(lines) >= batch_size:
+                yield b"".join(lines)
+                lines = []
+        if lines:
+            yield b"".join(lines)
+
+    async def get_recent_history(self, conversation_id: str, limit: int) -> List[Dict]:
+        """Get the newest messages of a conversation in chronological order"""
+        self._ensure_collection()
+        version = None
+        if self.history_cache.enabled and self.conversations_collection is not None:
+            # Other workers may have written since; one lookup on the summary tells
+            stamp = await get_version_stamp(self.conversations_collection, conversation_id)
+            version = (stamp or {}).get("version", 0)
+        cached = self.history_cache.get(conversation_id, limit, version)
+        if cached is not None:
+            return cached
+
+        token = self.history_cache.begin_load(conversation_id)
+        pending = self.message_writer.pending_for(conversation_id)
+        cursor = (
+            self.messages_collection.find(
+                self._history_query(conversation_id),
+                {"role": 1, "content": 1, "createdAt": 1},
+            )
+            .sort([("createdAt", -1), ("_id", -1)])
+            .limit(limit)
+        )
+        messages = await cursor.to_list(length=limit)
+        messages.reverse()
+        messages = self._merge_pending(conversation_id, messages, pending)[-limit:]
+        self.history_cache.put(conversation_id, messages, limit, token, version)
+        return messages
+
+    async def build_prompt(self, conversation_id: str) -> List[Dict[str, str]]:
+        """Build the OpenAI messages for a conversation within the context budget"""
+        started = time.perf_counter()
+        history = await self.get_recent_history(conversation_id, settings.CONTEXT_MAX_MESSAGES)
+        summary = None
+        compaction = await self.compactor.get_compaction(conversation_id) if self.compactor else None
+        if compaction is not None:
+            # Turns up to the summary's last message are represented by the summary
+            through = (compaction["throughCreatedAt"], compaction["throughId"])
+            history = [message for message in history if message_key(message) > through]
+            summary = compaction["summary"]
+        started = observe_stage("history_fetch", started)
+        messages = build_context(history, settings.CONTEXT_MAX_TOKENS, self.token_counter, summary=summary)
+        observe_stage("prompt_build", started)
+        return messages
+
     async def get_all_conversations(self) -> List[Dict]:
-        """Get all conversations with their latest message"""
+        """Get all conversations with their latest message, newest first"""
         self._ensure_collection()
-        pipeline = [
-            {"$sort": {"createdAt": -1}},
-            {
-                "$group": {
-                    "_id": "$conversationId",
-                    "lastMessage": {"$first": "$content"},
-                    "lastMessageRole": {"$first": "$role"},
-                    "lastMessageTime": {"$first": "$createdAt"},
-                    "messageCount": {"$sum": 1},
-                    "firstMessage": {"$last": "$content"}
-                }
-            },
-            {"$sort": {"lastMessageTime": -1}},
-            {
-                "$project": {
-                    "conversationId": "$_id",
-                    "lastMessage": 1,
-                    "lastMessageRole": 1,
-                    "lastMessageTime": 1,
-                    "messageCount": 1,
-                    "firstMessage": 1,
-                    "_id": 0
-                }
-            }
-        ]
-        
-        result = await self.messages_collection.aggregate(pipeline).to_list(length=None)
-        # Ensure all ObjectIds are converted to strings
-        for conversation in result:
-            if "_id" in conversation:
-                conversation["_id"] = str(conversation["_id"])
-        return result
+        cursor = self.conversations_collection.find({}, SUMMARY_PROJECTION).sort(
+            [("lastMessageTime", -1), ("conversationId", -1)]
+        )
+        return await cursor.to_list(length=None)
+
+    async def get_conversations_etag(self, limit: Optional[int] = None, cursor: Optional[str] = None) -> str:
+        """Get the ETag of the conversation list, or of one page of it
+
+        Costs one read of the newest summary on the updatedAt index plus the
+        collection's metadata count, instead of reading the whole list.
+        """
+        if cursor:
+            decode_cursor(cursor)
+        self._ensure_collection()
+        newest, count = await get_list_stamp(self.conversations_collection)
+        newest = newest or {}
+        return make_etag(
+            "conversations",
+            newest.get("conversationId"),
+            newest.get("version"),
+            newest.get("updatedAt"),
+            count,
+            limit,
+            cursor,
+        )
+
+    async def get_all_conversations_json(self) -> bytes:
+        """Get all conversations as a JSON array"""
+        return dumps(await self.get_all_conversations())
+
+    async def get_conversations_page(self, limit: int, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Get one page of conversations, newest first, keyed on (lastMessageTime, conversationId)"""
+        self._ensure_collection()
+        query = {}
+        if cursor:
+            last_time, last_id = decode_cursor(cursor)
+            query = {"$or": [
+                {"lastMessageTime": {"$lt": last_time}},
+                {"lastMessageTime": last_time, "conversationId": {"$lt": last_id}},
+            ]}
+        documents = await (
+            self.conversations_collection.find(query, SUMMARY_PROJECTION)
+            .sort([("lastMessageTime", -1), ("conversationId", -1)])
+            .limit(limit + 1)
+            .to_list(length=limit + 1)
+        )
+        items = documents[:limit]
+        next_cursor = None
+        if len(documents) > limit:
+            last = items[-1]
+            next_cursor = encode_cursor(last["lastMessageTime"], last["conversationId"])
+        return {"items": items, "nextCursor": next_cursor}
+
+    async def get_conversation_history_page(
+        self, conversation_id: str, limit: int, cursor: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Get one page of a conversation's history, oldest first, keyed on (createdAt, _id)"""
+        self._ensure_collection()
+        query = self._history_query(conversation_id)
+        if cursor:
+            last_time, last_id = _decode_history_cursor(cursor)
+            query["$or"] = [
+                {"createdAt": {"$gt": last_time}},
+                {"createdAt": last_time, "_id": {"$gt": last_id}},
+            ]
+        documents = await (
+            self.messages_collection.find(query)
+            .sort([("createdAt", 1), ("_id", 1)])
+            .limit(limit + 1)
+            .to_list(length=limit + 1)
+        )
+        items = documents[:limit]
+        next_cursor = None
+        if len(documents) > limit:
+            last = items[-1]
+            next_cursor = encode_cursor(last["createdAt"], str(last["_id"]))
+        for message in items:
+            message["_id"] = str(message["_id"])
+        return {"items": items, "nextCursor": next_cursor}
+
+    async def search_messages(self, query: str, limit: int, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Search message content across all conversations, best matches first
+
+        Uses the content_text index, so words are matched by their stems,
+        "quoted phrases" must appear as is and -words exclude messages. Pages
+        are keyed on (score, _id). Messages still queued for writing are not
+        searchable until they are flushed.
+        """
+        terms = search_terms(query)
+        if not terms:
+            raise ValueError("Search query has no words to search for")
+        after = None
+        if cursor:
+            score, last_id = decode_score_cursor(cursor)
+            if not ObjectId.is_valid(last_id):
+                raise ValueError("Invalid cursor")
+            after = (score, ObjectId(last_id))
+        self._ensure_collection()
+        documents = await self.messages_collection.aggregate(
+            search_pipeline(
+                query,
+                limit,
+                after,
+                hidden=self.purger.cutoffs() if self.purger else None,
+                max_candidates=settings.SEARCH_MAX_CANDIDATES,
+            )
+        ).to_list(length=limit + 1)
+        items = [to_hit(document, terms) for document in documents[:limit]]
+        next_cursor = None
+        if len(documents) > limit:
+            last = items[-1]
+            next_cursor = encode_score_cursor(last["score"], last["messageId"])
+        return {"items": items, "nextCursor": next_cursor}
 
     async def delete_conversation(self, conversation_id: str) -> bool:
-        """Delete a conversation"""
+        """Delete a conversation
+
+        The conversation disappears from listings and history at once; its
+        messages are deleted in batches in the background.
+        """
         self._ensure_collection()
-        result = await self.messages_collection.delete_many({"conversationId": conversation_id})
-        return result.deleted_count > 0
+        # Flush first so queued messages are not written back after the delete
+        await self.message_writer.flush()
+        before = datetime.utcnow()
+        existed = await self._remove_conversation(conversation_id, before)
+        if not existed:
+            # Messages written before summaries existed have no summary to remove
+            existed = await self.messages_collection.find_one(
+                {"conversationId": conversation_id, "createdAt": {"$lte": before}}, {"_id": 1}
+            ) is not None
+            if existed:
+                await self._purge_messages(conversation_id, before)
+        return existed
+
+    async def _remove_conversation(
+        self, conversation_id: str, before: datetime, match: Optional[Dict[str, Any]] = None
+    ) -> bool:
+        """Drop a conversation's summary and derived state and purge its messages up to `before`
+
+        With `match` (conditions the summary must still meet, e.g. that it is
+        unchanged since it was claimed) nothing is removed unless the summary
+        is. Returns whether a summary was removed.
+        """
+        existed = await delete_summary(self.conversations_collection, conversation_id, match)
+        if match is not None and not existed:
+            return False
+        self.history_cache.invalidate(conversation_id)
+        if self.compactor is not None:
+            await self.compactor.delete(conversation_id)
+        if existed:
+            await self._purge_messages(conversation_id, before)
+        return existed
+
+    async def _purge_messages(self, conversation_id: str, before: datetime):
+        if self.purger is not None:
+            await self.purger.schedule(conversation_id, before)
+        else:
+            await self.messages_collection.delete_many(
+                {"conversationId": conversation_id, "createdAt": {"$lte": before}}
+            )
+
+    async def process_message_stream(self, create_message_dto: CreateMessageRequest, turn: Optional[Turn] = None):
+        """Process a message and stream AI response events (start, content, end or error)
 
-    async def process_message_stream(self, create_message_dto: CreateMessageRequest):
-        """Process a message and stream AI response"""
+        The turn holds the conversation's lock until the stream ends; one is
+        reserved here when the caller did not reserve it already.
+        """
+        if turn is None:
+            turn = self.locks.reserve(create_message_dto.conversationId)
+        stream_events = self._stream_turn(create_message_dto)
+        try:
+            async with turn:
+                async for event in stream_events:
+                    yield event
+        finally:
+            # Runs the turn's disconnect handling when this generator is closed early
+            await stream_events.aclose()
+
+    async def _stream_turn(self, create_message_dto: CreateMessageRequest):
         self._ensure_collection()
+        started = time.perf_counter()
         
         # Save user message to database
-        user_message = Message(
-            conversation_id=create_message_dto.conversationId,
-            role="user",
-            content=create_message_dto.message,
-            created_at=datetime.utcnow(),
-            updated_at=datetime.utcnow()
-        )
-        
-        await self.messages_collection.insert_one({
-            "conversationId": user_message.conversation_id,
-            "role": user_message.role,
-            "content": user_message.content,
-            "createdAt": user_message.created_at,
-            "updatedAt": user_message.updated_at
-        })
-
-        # Get conversation history for context
-        history = await self.get_conversation_history(create_message_dto.conversationId)
-
-        # Prepare messages for OpenAI
-        messages = [
-            {
-                "role": "system",
-                "content": "You are a helpful assistant. Be concise and friendly."
-            }
-        ]
-        
-        for msg in history:
-            messages.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
+        await self._save_message(create_message_dto.conversationId, "user", create_message_dto.message)
+        observe_stage("user_insert", started)
 
+        # Prepare messages for OpenAI from the recent conversation history
+        messages = await self.build_prompt(create_message_dto.conversationId)
+
+        stream = None
+        response_parts = []
+        STREAMS_IN_FLIGHT.inc()
         try:
             # Call OpenAI API with streaming
+            generation_started = time.perf_counter()
             stream = await openai_client.create_chat_completion(messages, stream=True)
             
-            full_response = ""
-            
             # Send initial metadata
-            yield f"data: {{\"type\": \"start\", \"conversationId\": \"{create_message_dto.conversationId}\"}}\n\n"
+            yield {"type": "start", "conversationId": create_message_dto.conversationId}
             
             # Stream the response chunks
             async for chunk in stream:
+                if not chunk.choices:
+                    continue
                 content = chunk.choices[0].delta.content if chunk.choices[0].delta.content else ""
                 if content:
-                    full_response += content
-                    yield f"data: {{\"type\": \"content\", \"content\": \"{content}\"}}\n\n"
+                    if not response_parts:
+                        observe_stage("first_token", generation_started)
+                    response_parts.append(content)
+                    yield {"type": "content", "content": content}
+            generated_at = observe_stage("generation", generation_started)
+            # Each streamed delta carries one token
+            record_generation("stream", len(response_parts), generated_at - generation_started)
             
             # Save AI response to database
-            assistant_message = Message(
-                conversation_id=create_message_dto.conversationId,
-                role="assistant",
-                content=full_response,
-                created_at=datetime.utcnow(),
-                updated_at=datetime.utcnow()
+            assistant_message = await self._save_message(
+                create_message_dto.conversationId, "assistant", "".join(response_parts)
             )
-            
-            await self.messages_collection.insert_one({
-                "conversationId": assistant_message.conversation_id,
-                "role": assistant_message.role,
-                "content": assistant_message.content,
-                "createdAt": assistant_message.created_at,
-                "updatedAt": assistant_message.updated_at
-            })
+            observe_stage("assistant_insert", generated_at)
+            observe_stage("total", started)
+            self._schedule_compaction(create_message_dto.conversationId)
             
             # Send completion signal with metadata
-            yield f"data: {{\"type\": \"end\", \"conversationId\": \"{create_message_dto.conversationId}\", \"timestamp\": \"{assistant_message.created_at}\"}}\n\n"
+            yield {
+                "type": "end",
+                "conversationId": create_message_dto.conversationId,
+                "timestamp": assistant_message["createdAt"].isoformat()
+            }
             
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client went away: stop generating and keep what was produced
+            await self._abandon_stream(create_message_dto.conversationId, stream, response_parts)
+            raise
         except Exception as error:
             print(f"Error in stream: {error}")
-            yield f"data: {{\"type\": \"error\", \"message\": \"Sorry, I encountered an error processing your request.\", \"error\": \"{str(error)}\"}}\n\n"
+            yield {
+                "type": "error",
+                "message": "Sorry, I encountered an error processing your request.",
+                "error": str(error)
+            }
+        finally:
+            STREAMS_IN_FLIGHT.dec()
+
+    async def _abandon_stream(self, conversation_id: str, stream, response_parts: List[str]):
+        """Cancel the upstream stream of a disconnected client and persist the partial reply"""
+        partial = "".join(response_parts)
+        generated_tokens = self.token_counter.count_text(partial)
+        self.abandoned_streams += 1
+        # Upper bound: the reply could have run to the max_tokens limit
+        self.tokens_saved += max(MAX_TOKENS - generated_tokens, 0)
+        print(f"Stream for conversation {conversation_id} abandoned after {generated_tokens} tokens")
+
+        close = getattr(stream, "aclose", None) or getattr(stream, "close", None)
+        try:
+            if close is not None:
+                await asyncio.shield(close())
+            if partial:
+                # Shielded so the write completes even though this task is being cancelled
+                await asyncio.shield(
+                    self._save_message(conversation_id, "assistant", partial, truncated=True)
+                )
+        except BaseException as error:
+            if not isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+                print(f"Error cleaning up abandoned stream: {error}")
+
+    def start_message_stream(self, create_message_dto: CreateMessageRequest):
+        """Start a resumable stream generation in the background and return its buffer
+
+        Under the coalesce policy an identical message already streaming in the
+        conversation gets that stream's buffer instead. Raises
+        ConversationBusyError when the lock policy turns the message away.
+        """
+        turn = self.locks.reserve(
+            create_message_dto.conversationId, ("stream", create_message_dto.message)
+        )
+        if turn.shared is not None:
+            return turn.shared.result()
+        buffer = self.streams.start(
+            create_message_dto.conversationId, self.process_message_stream(create_message_dto, turn)
+        )
+        turn.set_result(buffer)
+        return buffer
+
+    def stream_stats(self) -> Dict[str, int]:
+        """Get abandoned and resumable stream counters"""
+        return {
+            "abandoned": self.abandoned_streams,
+            "tokensSaved": self.tokens_saved,
+            **self.streams.stats(),
+        }
 
 # Create singleton instance lazily
 _chatbot_service = None
@@ -229,4 +679,11 @@ def get_chatbot_service():
     global _chatbot_service
     if _chatbot_service is None:
         _chatbot_service = ChatbotService()
-    return _chatbot_service
\ No newline at end of file
+    return _chatbot_service
+
+def _reset_after_fork():
+    # Caches, write batches and streams of the parent are not valid in a forked worker
+    global _chatbot_service
+    _chatbot_service = None
+
+os.register_at_fork(after_in_child=_reset_after_fork)
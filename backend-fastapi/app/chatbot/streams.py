@@ -0,0 +1,192 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Dict, Any, Optional, Tuple
+
+
+class StreamNotFoundError(LookupError):
+    """The stream is unknown or has been evicted"""
+
+
+class StreamExpiredError(LookupError):
+    """The events after the client's last event have been evicted from the buffer"""
+
+
+def format_event_id(stream_id: str, seq: int) -> str:
+    return f"{stream_id}:{seq}"
+
+
+def parse_event_id(event_id: str) -> Tuple[str, int]:
+    """Split a Last-Event-ID value into its stream ID and sequence number"""
+    stream_id, _, seq = event_id.strip().rpartition(":")
+    if not stream_id or not seq.isdigit():
+        raise ValueError("Invalid event ID")
+    return stream_id, int(seq)
+
+
+class StreamBuffer:
+    """The recent events of one generation, with their sequence numbers"""
+
+    def __init__(self, stream_id: str, conversation_id: str, max_events: int):
+        self.stream_id = stream_id
+        self.conversation_id = conversation_id
+        self.events: deque = deque(maxlen=max_events)
+        self.last_seq = 0
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.orphan_timer: Optional[asyncio.TimerHandle] = None
+        self._changed = asyncio.Event()
+
+    def append(self, event: Dict[str, Any]):
+        self.last_seq += 1
+        self.events.append((self.last_seq, {**event, "id": format_event_id(self.stream_id, self.last_seq)}))
+        self._notify()
+
+    def finish(self):
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def can_resume(self, after: int) -> bool:
+        """Whether every event after `after` is still buffered"""
+        first_seq = self.events[0][0] if self.events else self.last_seq + 1
+        return after + 1 >= first_seq
+
+
+class StreamRegistry:
+    """Runs stream generations in the background and lets clients reattach to them
+
+    Each generation gets a stream ID; its newest `max_events` events are kept
+    in a ring buffer so a client that reconnects with the ID of the last event
+    it saw gets the rest of the stream, and then follows the live generation
+    if it is still running, without another upstream request.
+
+    A generation nobody is following is cancelled after `grace` seconds.
+    Finished streams are kept for `ttl` seconds, and at most `max_streams`
+    are kept, oldest finished first.
+    """
+
+    def __init__(
+        self,
+        max_streams: int = 500,
+        max_events: int = 2000,
+        ttl: float = 300.0,
+        grace: float = 3.0,
+    ):
+        self.max_streams = max_streams
+        self.max_events = max_events
+        self.ttl = ttl
+        self.grace = grace
+        self._streams: "OrderedDict[str, StreamBuffer]" = OrderedDict()
+        self.started = 0
+        self.resumed = 0
+        self.evictions = 0
+
+    def start(self, conversation_id: str, source: AsyncIterator[Dict[str, Any]]) -> StreamBuffer:
+        """Start consuming `source` in the background and buffer its events"""
+        self._evict()
+        buffer = StreamBuffer(uuid.uuid4().hex, conversation_id, self.max_events)
+        self._streams[buffer.stream_id] = buffer
+        buffer.task = asyncio.ensure_future(self._produce(buffer, source))
+        self.started += 1
+        return buffer
+
+    async def _produce(self, buffer: StreamBuffer, source: AsyncIterator[Dict[str, Any]]):
+        try:
+            async for event in source:
+                if event.get("type") == "start":
+                    event = {**event, "streamId": buffer.stream_id}
+                buffer.append(event)
+        except asyncio.CancelledError:
+            pass
+        except Exception as error:
+            print(f"Error in stream {buffer.stream_id}: {error}")
+            buffer.append({"type": "error", "message": "Stream failed", "error": str(error)})
+        finally:
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            buffer.finish()
+
+    def get(self, stream_id: str) -> StreamBuffer:
+        self._evict()
+        buffer = self._streams.get(stream_id)
+        if buffer is None:
+            raise StreamNotFoundError(f"Stream {stream_id} not found")
+        return buffer
+
+    def resume(self, last_event_id: str) -> Tuple[StreamBuffer, int]:
+        """Look up the stream a Last-Event-ID belongs to and check it can be resumed"""
+        stream_id, after = parse_event_id(last_event_id)
+        buffer = self.get(stream_id)
+        if not buffer.can_resume(after):
+            raise StreamExpiredError(f"Events of stream {stream_id} after {after} were evicted")
+        self.resumed += 1
+        return buffer, after
+
+    async def follow(self, buffer: StreamBuffer, after: int = 0) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the buffered events after `after`, then the live ones until the stream ends"""
+        buffer.subscribers += 1
+        if buffer.orphan_timer is not None:
+            buffer.orphan_timer.cancel()
+            buffer.orphan_timer = None
+        try:
+            while True:
+                changed = buffer._changed
+                for seq, event in list(buffer.events):
+                    if seq > after:
+                        after = seq
+                        yield event
+                if buffer.done:
+                    return
+                await changed.wait()
+        finally:
+            buffer.subscribers -= 1
+            if buffer.subscribers == 0 and not buffer.done:
+                self._orphaned(buffer)
+
+    def _orphaned(self, buffer: StreamBuffer):
+        """Give the client `grace` seconds to reconnect before cancelling the generation"""
+        if self.grace <= 0:
+            buffer.task.cancel()
+            return
+        loop = asyncio.get_event_loop()
+        buffer.orphan_timer = loop.call_later(self.grace, self._cancel_if_orphaned, buffer)
+
+    def _cancel_if_orphaned(self, buffer: StreamBuffer):
+        buffer.orphan_timer = None
+        if buffer.subscribers == 0 and not buffer.done:
+            print(f"Stream {buffer.stream_id} has no listeners, cancelling it")
+            buffer.task.cancel()
+
+    def _evict(self):
+        now = time.monotonic()
+        for stream_id, buffer in list(self._streams.items()):
+            if buffer.done and now - buffer.finished_at >= self.ttl:
+                del self._streams[stream_id]
+                self.evictions += 1
+        if len(self._streams) < self.max_streams:
+            return
+        # Running generations are never evicted; their number is bounded by the upstream slots
+        for stream_id, buffer in list(self._streams.items()):
+            if len(self._streams) < self.max_streams:
+                break
+            if buffer.done:
+                del self._streams[stream_id]
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "streams": len(self._streams),
+            "live": sum(1 for buffer in self._streams.values() if not buffer.done),
+            "started": self.started,
+            "resumed": self.resumed,
+            "evictions": self.evictions,
+        }
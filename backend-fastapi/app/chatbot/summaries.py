@@ -0,0 +1,163 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+from pymongo import ReturnDocument
+
+# Materialized per-conversation summary, kept up to date as messages are written
+CONVERSATIONS_COLLECTION = "conversations"
+
+# Fields of a summary that are sent to clients
+SUMMARY_PROJECTION = {"_id": 0, "retentionClaimedAt": 0}
+
+# Same shape as the summary documents, computed from the messages collection
+REBUILD_PIPELINE = [
+    # _id breaks ties between messages written within the same millisecond
+    {"$sort": {"createdAt": -1, "_id": -1}},
+    {
+        "$group": {
+            "_id": "$conversationId",
+            "lastMessage": {"$first": "$content"},
+            "lastMessageRole": {"$first": "$role"},
+            "lastMessageTime": {"$first": "$createdAt"},
+            "messageCount": {"$sum": 1},
+            "firstMessage": {"$last": "$content"},
+            "updatedAt": {"$first": "$createdAt"}
+        }
+    },
+    {
+        "$project": {
+            "conversationId": "$_id",
+            "lastMessage": 1,
+            "lastMessageRole": 1,
+            "lastMessageTime": 1,
+            "messageCount": 1,
+            "firstMessage": 1,
+            "updatedAt": 1,
+            # Restarts the counter; updatedAt and messageCount keep old ETags from matching
+            "version": "$messageCount",
+            "_id": 0
+        }
+    },
+    {"$out": CONVERSATIONS_COLLECTION},
+]
+
+
+async def record_messages(conversations_collection, messages: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Fold newly written messages into their conversation summaries and return their new versions
+
+    Messages must be in write order. The messages of each conversation are
+    coalesced into a single upsert, and the upserts run concurrently. Each
+    upsert bumps the summary's `version` and `updatedAt`, the stamps behind
+    the ETags of the history and conversation list endpoints.
+
+    Batches of different workers can land out of order, so the update is a
+    pipeline that only moves lastMessageTime forward and only takes the last
+    message's content and role along with it.
+    """
+    now = datetime.utcnow()
+    by_conversation: Dict[str, List[Dict[str, Any]]] = {}
+    for message in messages:
+        by_conversation.setdefault(message["conversationId"], []).append(message)
+
+    updates = []
+    for conversation_id, conversation_messages in by_conversation.items():
+        first, last = conversation_messages[0], conversation_messages[-1]
+        # Content is user text and may start with "$", so it goes in as a literal
+        is_newest = {"$gte": [last["createdAt"], {"$ifNull": ["$lastMessageTime", last["createdAt"]]}]}
+        updates.append(conversations_collection.find_one_and_update(
+            {"conversationId": conversation_id},
+            [{
+                "$set": {
+                    "lastMessage": {"$cond": [is_newest, {"$literal": last["content"]}, "$lastMessage"]},
+                    "lastMessageRole": {"$cond": [is_newest, {"$literal": last["role"]}, "$lastMessageRole"]},
+                    "lastMessageTime": {"$max": ["$lastMessageTime", last["createdAt"]]},
+                    "updatedAt": now,
+                    "messageCount": {"$add": [{"$ifNull": ["$messageCount", 0]}, len(conversation_messages)]},
+                    "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+                    "firstMessage": {"$ifNull": ["$firstMessage", {"$literal": first["content"]}]},
+                },
+            }],
+            {"_id": 0, "version": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        ))
+    summaries = await asyncio.gather(*updates)
+    return {
+        conversation_id: summary["version"]
+        for conversation_id, summary in zip(by_conversation, summaries)
+    }
+
+
+async def touch_summary(conversations_collection, conversation_id: str, removed: int = 0):
+    """Bump a conversation's version after its messages changed without new ones being written
+
+    `removed` is the number of its messages that were deleted.
+    """
+    await conversations_collection.update_one(
+        {"conversationId": conversation_id},
+        {"$set": {"updatedAt": datetime.utcnow()}, "$inc": {"version": 1, "messageCount": -removed}},
+    )
+
+
+async def get_version_stamp(conversations_collection, conversation_id: str) -> Optional[Dict[str, Any]]:
+    """Get the stamp of one conversation with a single lookup on the unique index"""
+    return await conversations_collection.find_one(
+        {"conversationId": conversation_id},
+        {"_id": 0, "version": 1, "updatedAt": 1, "messageCount": 1},
+    )
+
+
+async def get_list_stamp(conversations_collection) -> Tuple[Optional[Dict[str, Any]], int]:
+    """Get the stamp of the conversation list: the most recently updated summary and the count
+
+    Every write moves its conversation to the top of the updatedAt index and
+    deletes change the count, so the pair changes whenever the list does. The
+    count comes from collection metadata rather than a scan.
+    """
+    newest = await conversations_collection.find_one(
+        {},
+        {"_id": 0, "conversationId": 1, "version": 1, "updatedAt": 1},
+        sort=[("updatedAt", -1)],
+    )
+    return newest, await conversations_collection.estimated_document_count()
+
+
+async def delete_summary(
+    conversations_collection, conversation_id: str, match: Optional[Dict[str, Any]] = None
+) -> bool:
+    """Remove the summary of a deleted conversation; returns whether there was one
+
+    `match` adds conditions the summary must meet to be removed.
+    """
+    result = await conversations_collection.delete_one({"conversationId": conversation_id, **(match or {})})
+    return result.deleted_count > 0
+
+
+async def rebuild_conversation_summaries(db) -> int:
+    """Recompute every conversation summary from the messages collection
+
+    $out atomically replaces the summary collection and keeps its indexes.
+    Returns the number of conversations. Run it with writes stopped: the
+    replacement overwrites summary upserts made while the aggregation runs,
+    which would leave those conversations with stale counts and last messages.
+    """
+    started = time.perf_counter()
+    await db["messages"].aggregate(REBUILD_PIPELINE, allowDiskUse=True).to_list(length=None)
+    count = await db[CONVERSATIONS_COLLECTION].count_documents({})
+    elapsed = time.perf_counter() - started
+    print(f"Rebuilt {count} conversation summaries in {elapsed * 1000:.1f} ms")
+    return count
+
+
+async def ensure_conversation_summaries(db):
+    """Backfill the summaries on first start after upgrading from the aggregation
+
+    Only safe while no worker is writing yet; with several workers run
+    `manage.py rebuild-conversations` before starting them.
+    """
+    if await db[CONVERSATIONS_COLLECTION].estimated_document_count() > 0:
+        return
+    if await db["messages"].estimated_document_count() == 0:
+        return
+    await rebuild_conversation_summaries(db)
@@ -0,0 +1,172 @@
+import asyncio
+import json
+from typing import Any, Dict, Optional
+from pydantic import ValidationError
+from starlette.websockets import WebSocket
+from app.schemas.message import CreateMessageRequest
+from app.chatbot.locks import ConversationBusyError, Turn
+from app.utils.serialization import dumps
+from app.utils.sse import coalesce_events
+from app.utils.metrics import WEBSOCKETS_OPEN
+
+
+class ChatSocket:
+    """One /chatbot/ws connection carrying the turns of many conversations at once
+
+    Client frames are JSON objects:
+    - {"type": "message", "conversationId": ..., "message": ..., "requestId": optional}
+    - {"type": "cancel", "conversationId": ...}
+    - {"type": "ping"}
+
+    Every turn streams the same start, content, end and error events as the SSE
+    endpoint, tagged with its conversationId (and requestId when given). A
+    cancelled turn ends with a "cancelled" frame; the partial reply is kept
+    as truncated, as for a dropped SSE client. Problems with a frame are
+    reported as {"type": "error", "code": ...} and leave the connection open.
+
+    Frames go through one bounded queue drained by a single sender task. A
+    client that reads slowly fills it, turns then wait to enqueue, and the
+    deltas that pile up meanwhile are merged into larger content frames, up
+    to `max_bytes` each. Each conversation has at most one turn per connection.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        chatbot_service,
+        window: float = 0.03,
+        max_bytes: int = 1024,
+        heartbeat_interval: float = 15.0,
+        max_turns: int = 16,
+        send_queue_size: int = 64,
+    ):
+        self.websocket = websocket
+        self.chatbot_service = chatbot_service
+        self.window = window
+        self.max_bytes = max_bytes
+        self.heartbeat_interval = heartbeat_interval
+        self.max_turns = max_turns
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=send_queue_size)
+        self._turns: Dict[str, asyncio.Task] = {}
+        self._cancelling = set()
+
+    async def run(self):
+        """Serve the connection until the client disconnects"""
+        WEBSOCKETS_OPEN.inc()
+        sender = asyncio.ensure_future(self._send_frames())
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                text = message.get("text")
+                if text is None and message.get("bytes") is not None:
+                    text = message["bytes"].decode("utf-8", errors="replace")
+                await self._handle(text or "")
+        finally:
+            # Generations of a closed connection stop like those of a dropped SSE client
+            turns = list(self._turns.values())
+            for task in turns:
+                task.cancel()
+            await asyncio.gather(*turns, return_exceptions=True)
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+            WEBSOCKETS_OPEN.dec()
+
+    async def _send_frames(self):
+        while True:
+            text = await self._outbox.get()
+            await self.websocket.send_text(text)
+
+    async def _send(self, event: Dict[str, Any]):
+        await self._outbox.put(dumps(event).decode("utf-8"))
+
+    async def _error(self, code: str, message: str, conversation_id: Optional[str] = None):
+        event = {"type": "error", "code": code, "message": message}
+        if conversation_id is not None:
+            event["conversationId"] = conversation_id
+        await self._send(event)
+
+    async def _handle(self, text: str):
+        try:
+            frame = json.loads(text)
+        except ValueError:
+            frame = None
+        if not isinstance(frame, dict):
+            await self._error("invalid_frame", "Frames must be JSON objects")
+            return
+
+        kind = frame.get("type")
+        if kind == "message":
+            await self._start_turn(frame)
+        elif kind == "cancel":
+            self._cancel(frame.get("conversationId"))
+        elif kind == "ping":
+            await self._send({"type": "pong"})
+        else:
+            await self._error("unknown_type", f"Unknown frame type: {kind}")
+
+    async def _start_turn(self, frame: Dict[str, Any]):
+        try:
+            dto = CreateMessageRequest(message=frame.get("message"), conversationId=frame.get("conversationId"))
+        except ValidationError:
+            await self._error("invalid_message", "A message frame needs string message and conversationId fields")
+            return
+        conversation_id = dto.conversationId
+        if conversation_id in self._turns:
+            await self._error("busy", "This conversation already has a turn running on this connection", conversation_id)
+            return
+        if len(self._turns) >= self.max_turns:
+            await self._error("too_many_turns", f"At most {self.max_turns} turns may run per connection", conversation_id)
+            return
+        try:
+            turn = self.chatbot_service.locks.reserve(conversation_id)
+        except ConversationBusyError as error:
+            await self._error("busy", str(error), conversation_id)
+            return
+
+        tags = {"conversationId": conversation_id}
+        if frame.get("requestId") is not None:
+            tags["requestId"] = frame["requestId"]
+        task = asyncio.ensure_future(self._run_turn(dto, turn, tags))
+        task.add_done_callback(lambda task: self._turn_done(task, turn, tags))
+        self._turns[conversation_id] = task
+
+    async def _run_turn(self, dto: CreateMessageRequest, turn: Turn, tags: Dict[str, Any]):
+        conversation_id = dto.conversationId
+        events = coalesce_events(
+            self.chatbot_service.process_message_stream(dto, turn),
+            self.window,
+            self.max_bytes,
+            self.heartbeat_interval,
+        )
+        try:
+            async for event in events:
+                # The WebSocket protocol has its own keep-alive pings
+                if event is not None:
+                    await self._send({**event, **tags})
+        except asyncio.CancelledError:
+            if conversation_id not in self._cancelling:
+                raise
+            await events.aclose()
+            await self._send({"type": "cancelled", **tags})
+        finally:
+            await events.aclose()
+
+    def _turn_done(self, task: asyncio.Task, turn: Turn, tags: Dict[str, Any]):
+        """Free a finished turn's conversation, including a turn cancelled before it started"""
+        conversation_id = tags["conversationId"]
+        turn.release()
+        if self._turns.get(conversation_id) is task:
+            del self._turns[conversation_id]
+        if conversation_id in self._cancelling:
+            self._cancelling.discard(conversation_id)
+            # A started turn catches its cancel and reports it itself
+            if task.cancelled():
+                asyncio.ensure_future(self._send({"type": "cancelled", **tags}))
+
+    def _cancel(self, conversation_id: Optional[str]):
+        task = self._turns.get(conversation_id)
+        if task is not None and conversation_id not in self._cancelling:
+            self._cancelling.add(conversation_id)
+            task.cancel()
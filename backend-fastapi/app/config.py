@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import List, Dict, Optional
 
 class Settings(BaseSettings):
     OPENAI_BASE_URL: str = "https://api.openai.com/v1"
@@ -7,7 +7,90 @@ class Settings(BaseSettings):
     MONGODB_URI: str = "mongodb://localhost:27017/chatbot"
     PORT: int = 3000
     DEBUG: bool = True
+    # "production" runs multiple workers without the reloader
+    ENVIRONMENT: str = "development"
+    # Production server tuning (0 workers means one per CPU)
+    WORKERS: int = 0
+    KEEPALIVE_SECONDS: int = 5
+    BACKLOG: int = 2048
+    LIMIT_CONCURRENCY: Optional[int] = None
+    ACCESS_LOG: bool = False
     MODEL: str = "gpt-3.5-turbo"
+    # Optional pool of OpenAI-compatible upstreams, as a JSON list of
+    # {"name", "baseUrl", "apiKey", "model"}; defaults to the single pair above
+    OPENAI_UPSTREAMS: List[Dict[str, str]] = []
+    OPENAI_ROUTING: str = "least_outstanding"
+    OPENAI_CIRCUIT_FAILURE_THRESHOLD: int = 5
+    OPENAI_CIRCUIT_COOLDOWN_SECONDS: float = 30
+    # Upstream request policy
+    OPENAI_TIMEOUT_SECONDS: float = 60
+    OPENAI_MAX_IN_FLIGHT: int = 32
+    OPENAI_RATE_LIMIT_PER_SECOND: float = 0
+    OPENAI_RATE_LIMIT_BURST: int = 10
+    OPENAI_MAX_RETRIES: int = 3
+    OPENAI_BACKOFF_BASE_MS: int = 250
+    OPENAI_BACKOFF_MAX_MS: int = 8000
+    OPENAI_HEDGE_AFTER_MS: int = 0
+    # Prompt context window
+    CONTEXT_MAX_TOKENS: int = 3000
+    # Startup gives up loading the tiktoken encoding after this long and estimates tokens
+    TOKENIZER_LOAD_TIMEOUT_SECONDS: float = 10
+    CONTEXT_MAX_MESSAGES: int = 50
+    # Documents fetched per cursor batch when exporting history
+    EXPORT_BATCH_SIZE: int = 500
+    # Matches of a search that are fetched and ranked (0 ranks all of them)
+    SEARCH_MAX_CANDIDATES: int = 2000
+    # SSE framing: token deltas are coalesced per frame by time window or size
+    SSE_COALESCE_MS: int = 30
+    SSE_COALESCE_BYTES: int = 1024
+    SSE_HEARTBEAT_SECONDS: float = 15
+    # /chatbot/ws: concurrent turns per connection and frames queued for a slow client
+    WS_MAX_TURNS: int = 16
+    WS_SEND_QUEUE_SIZE: int = 64
+    # Replay buffer for resuming dropped streams with Last-Event-ID
+    STREAM_BUFFER_MAX_STREAMS: int = 500
+    STREAM_BUFFER_EVENTS: int = 2000
+    STREAM_BUFFER_TTL_SECONDS: float = 300
+    # How long a generation keeps running with no client attached (0 cancels it at once);
+    # long enough for a reconnect, short enough to stop most replies of a dropped client
+    STREAM_RESUME_GRACE_SECONDS: float = 3
+    # Write-behind persistence of chat messages
+    WRITE_BEHIND_ENABLED: bool = True
+    WRITE_BATCH_SIZE: int = 100
+    WRITE_FLUSH_INTERVAL_MS: int = 50
+    # Flushes a rejected message is retried on before it moves to messages_dead_letter
+    WRITE_MAX_ATTEMPTS: int = 5
+    # In-memory cache of recent conversation tails (0 disables it)
+    HISTORY_CACHE_SIZE: int = 1000
+    HISTORY_CACHE_TTL_SECONDS: float = 600
+    # Opt-in cache of LLM completions for identical prompts
+    COMPLETION_CACHE_ENABLED: bool = False
+    COMPLETION_CACHE_SIZE: int = 1000
+    COMPLETION_CACHE_TTL_SECONDS: float = 3600
+    COMPLETION_CACHE_DIR: Optional[str] = None
+    COMPLETION_CACHE_DIR_MAX_MB: float = 100
+    # Concurrent messages to one conversation: "queue", "reject" (409) or "coalesce"
+    # (identical messages share one reply); at most CONVERSATION_MAX_QUEUED turns wait
+    CONVERSATION_LOCK_POLICY: str = "queue"
+    CONVERSATION_MAX_QUEUED: int = 8
+    # Rolling summarization of long conversations (calls the model, so opt-in)
+    COMPACTION_ENABLED: bool = False
+    COMPACTION_THRESHOLD_MESSAGES: int = 100
+    COMPACTION_KEEP_RECENT: int = 20
+    # Keep summarized messages in Mongo so /history still returns them
+    COMPACTION_KEEP_ORIGINALS: bool = True
+    COMPACTION_QUEUE_SIZE: int = 100
+    COMPACTION_WORKERS: int = 1
+    # Conversations idle for RETENTION_DAYS are archived (or just deleted) by a background
+    # sweeper; 0 keeps everything
+    RETENTION_DAYS: int = 0
+    RETENTION_ARCHIVE: bool = True
+    ARCHIVE_DIR: str = "archive"
+    RETENTION_SWEEP_INTERVAL_SECONDS: float = 3600
+    RETENTION_SWEEP_BATCH: int = 100
+    # Messages of deleted conversations are removed in background batches
+    DELETE_BATCH_SIZE: int = 1000
+    DELETE_BATCH_PAUSE_MS: int = 10
 
     class Config:
         env_file = ".env"
@@ -1,4 +1,6 @@
+import os
 from motor.motor_asyncio import AsyncIOMotorClient
+from app.database.monitoring import CommandMetricsListener
 from typing import Optional
 
 # Global MongoDB client
@@ -8,7 +10,7 @@ database = None
 async def connect_to_mongo(mongodb_uri: str):
     """Connect to MongoDB"""
     global mongo_client, database
-    mongo_client = AsyncIOMotorClient(mongodb_uri)
+    mongo_client = AsyncIOMotorClient(mongodb_uri, event_listeners=[CommandMetricsListener()])
     database = mongo_client.get_default_database()
     print(f"Connected to MongoDB at {mongodb_uri}")
 
@@ -31,4 +33,12 @@ def get_collection(collection_name: str):
         # Return None instead of raising an exception
         # This allows the application to import modules without database connection
         return None
-    return db[collection_name]
\ No newline at end of file
+    return db[collection_name]
+
+def _reset_after_fork():
+    """A forked worker must open its own connection pool on startup"""
+    global mongo_client, database
+    mongo_client = None
+    database = None
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,105 @@
+import time
+from typing import List, Dict, Any
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+
+# Indexes backing the hot queries in ChatbotService
+MESSAGE_INDEXES = [
+    # History reads, tail reads, history pages and deletes: filter on conversationId,
+    # sort on createdAt with _id as the keyset tiebreaker
+    IndexModel(
+        [("conversationId", ASCENDING), ("createdAt", ASCENDING), ("_id", ASCENDING)],
+        name="conversationId_createdAt_id",
+    ),
+    # /chatbot/search: stemmed full-text search over message content
+    IndexModel([("content", TEXT)], name="content_text", default_language="english"),
+]
+
+# Indexes of earlier versions that no query uses any more; every write paid to maintain them
+OBSOLETE_MESSAGE_INDEXES = [
+    # Backed the conversation listing before it moved to the summaries collection
+    "createdAt_desc",
+]
+
+# Indexes backing the materialized conversation summaries
+CONVERSATION_INDEXES = [
+    # Summary upserts and deletes
+    IndexModel([("conversationId", ASCENDING)], name="conversationId_unique", unique=True),
+    # Conversation listing and pages, newest first
+    IndexModel(
+        [("lastMessageTime", DESCENDING), ("conversationId", DESCENDING)],
+        name="lastMessageTime_conversationId",
+    ),
+    # ETag of the conversation list: the most recently updated summary
+    IndexModel([("updatedAt", DESCENDING)], name="updatedAt_desc"),
+]
+
+
+async def ensure_indexes(db) -> float:
+    """Create the indexes the service relies on and return the build time in seconds
+
+    createIndexes is a no-op for indexes that already exist with the same
+    definition, so this is safe to run on every startup. Obsolete indexes
+    left by earlier versions are dropped.
+    """
+    started = time.perf_counter()
+    existing = await db["messages"].index_information()
+    for name in OBSOLETE_MESSAGE_INDEXES:
+        if name in existing:
+            await db["messages"].drop_index(name)
+            print(f"Dropped obsolete index {name}")
+    names = await db["messages"].create_indexes(MESSAGE_INDEXES)
+    names += await db["conversations"].create_indexes(CONVERSATION_INDEXES)
+    elapsed = time.perf_counter() - started
+    print(f"Ensured indexes ({', '.join(names)}) in {elapsed * 1000:.1f} ms")
+    return elapsed
+
+
+def _collect_plan_stages(node: Any, stages: List[Dict[str, Any]]):
+    """Walk an explain document and collect every plan stage with its index"""
+    if isinstance(node, dict):
+        if "stage" in node:
+            stages.append({"stage": node["stage"], "indexName": node.get("indexName")})
+        for key, value in node.items():
+            # Only the winning plan matters, skip the alternatives the planner tried
+            if key not in ("rejectedPlans", "allPlansExecution"):
+                _collect_plan_stages(value, stages)
+    elif isinstance(node, list):
+        for item in node:
+            _collect_plan_stages(item, stages)
+
+
+def _summarize_plan(explain_result: Dict[str, Any]) -> Dict[str, Any]:
+    stages = []
+    _collect_plan_stages(explain_result, stages)
+    stage_names = [s["stage"] for s in stages]
+    return {
+        "stages": stage_names,
+        "indexes": sorted({s["indexName"] for s in stages if s["indexName"]}),
+        "usesIndex": "IXSCAN" in stage_names or "DISTINCT_SCAN" in stage_names,
+        "collectionScan": "COLLSCAN" in stage_names,
+    }
+
+
+async def explain_queries(db, conversation_id: str) -> Dict[str, Dict[str, Any]]:
+    """Explain the history and listing queries and report which indexes they use"""
+    messages = db["messages"]
+
+    history = await (
+        messages.find({"conversationId": conversation_id})
+        .sort([("createdAt", 1), ("_id", 1)])
+        .explain()
+    )
+    listing = await (
+        db["conversations"].find({}, {"_id": 0})
+        .sort([("lastMessageTime", -1), ("conversationId", -1)])
+        .explain()
+    )
+    # ETag checks: one summary by conversationId, the newest summary by updatedAt
+    history_stamp = await db["conversations"].find({"conversationId": conversation_id}).limit(1).explain()
+    listing_stamp = await db["conversations"].find({}).sort([("updatedAt", -1)]).limit(1).explain()
+    return {
+        "history": _summarize_plan(history),
+        "listing": _summarize_plan(listing),
+        "historyStamp": _summarize_plan(history_stamp),
+        "listingStamp": _summarize_plan(listing_stamp),
+    }
@@ -0,0 +1,19 @@
+from pymongo import monitoring
+from app.utils.metrics import MONGO_COMMAND_SECONDS
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """Records the duration of every MongoDB command the driver runs
+
+    Motor runs the driver, and so these callbacks, on its executor threads;
+    the histogram they feed is thread-safe.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_SECONDS.labels(event.command_name, "success").observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_COMMAND_SECONDS.labels(event.command_name, "failure").observe(event.duration_micros / 1e6)
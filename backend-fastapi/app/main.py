@@ -1,12 +1,16 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
-import os
 from dotenv import load_dotenv
 
 from app.config import Settings
-from app.database.connection import connect_to_mongo, close_mongo_connection
+from app.database.connection import connect_to_mongo, close_mongo_connection, get_database
+from app.database.indexes import ensure_indexes
+from app.chatbot.summaries import ensure_conversation_summaries
 from app.chatbot.router import router as chatbot_router
+from app.chatbot.service import get_chatbot_service
+from app.utils.metrics import REGISTRY, MetricsMiddleware, stats_samples
+from app.utils.openai_client import openai_client
 
 load_dotenv()
 
@@ -30,25 +34,96 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Record request latency per route
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(chatbot_router, prefix="/chatbot", tags=["chatbot"])
 
 @app.on_event("startup")
 async def startup_event():
     await connect_to_mongo(settings.MONGODB_URI)
+    try:
+        await ensure_indexes(get_database())
+        await ensure_conversation_summaries(get_database())
+        # Resumes message purges left by the last run and starts the retention sweeper
+        await get_chatbot_service().start_background_jobs()
+    except Exception as error:
+        print(f"Error preparing database: {error}")
+    # Off the event loop, since the encoding may have to be downloaded
+    await get_chatbot_service().token_counter.load(settings.TOKENIZER_LOAD_TIMEOUT_SECONDS)
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    # Flush write-behind message batches while the connection is still open
+    await get_chatbot_service().close()
     await close_mongo_connection()
 
+def collect_component_metrics():
+    """Export the counters the caches, scheduler, upstreams and streams already keep"""
+    chatbot_service = get_chatbot_service()
+    samples = stats_samples(
+        "chatbot_history_cache", "History cache", chatbot_service.history_cache.stats(),
+        counters=["hits", "misses", "evictions", "stale"],
+    )
+    samples += stats_samples(
+        "chatbot_streams", "Streams", chatbot_service.stream_stats(),
+        counters=["abandoned", "tokensSaved", "started", "resumed", "evictions"],
+    )
+    samples += stats_samples(
+        "chatbot_scheduler", "Upstream scheduler", openai_client.scheduler.stats(),
+        counters=["requests", "retries", "failures", "hedges", "hedgeWins"],
+    )
+    samples += stats_samples(
+        "chatbot_conversation_locks", "Conversation locks", chatbot_service.locks.stats(),
+        counters=["rejected", "coalesced", "waited"],
+    )
+    if chatbot_service.compactor is not None:
+        samples += stats_samples(
+            "chatbot_compaction", "Compaction", chatbot_service.compactor.stats(),
+            counters=["scheduled", "dropped", "compactions", "chunks", "conflicts", "failures"],
+        )
+    if chatbot_service.purger is not None:
+        samples += stats_samples(
+            "chatbot_purges", "Message purges", chatbot_service.purger.stats(),
+            counters=["scheduled", "purgedMessages", "failures"],
+        )
+    if chatbot_service.retention is not None:
+        samples += stats_samples(
+            "chatbot_retention", "Retention sweeper", chatbot_service.retention.stats(),
+            counters=["expired", "archivedMessages", "failures"],
+        )
+    if openai_client.cache is not None:
+        samples += stats_samples(
+            "chatbot_completion_cache", "Completion cache", openai_client.cache.stats(),
+            counters=["hits", "misses", "evictedFiles"],
+        )
+    upstreams = openai_client.upstream_stats()
+    for key, kind, help in (
+        ("outstanding", "gauge", "Requests outstanding per upstream"),
+        ("ewmaLatencyMs", "gauge", "Moving average latency per upstream in milliseconds"),
+        ("requests", "counter", "Requests sent per upstream"),
+        ("errors", "counter", "Failed requests per upstream"),
+        ("circuitOpen", "gauge", "Whether the upstream's circuit is open"),
+    ):
+        name = {"ewmaLatencyMs": "ewma_latency_ms", "circuitOpen": "circuit_open"}.get(key, key)
+        if kind == "counter":
+            name += "_total"
+        values = [({"upstream": u["name"]}, float(u[key])) for u in upstreams]
+        samples.append((f"chatbot_upstream_{name}", kind, help, values))
+    return samples
+
+REGISTRY.register_collector(collect_component_metrics)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Metrics of this worker in the Prometheus text format"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Chatbot Backend - FastAPI"}
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "app.main:app",
-        host="0.0.0.0",
-        port=int(os.getenv("PORT", 3000)),
-        reload=settings.DEBUG
-    )
\ No newline at end of file
+    from app.server import run
+    run(settings, production=settings.ENVIRONMENT == "production")
@@ -27,6 +27,8 @@ class Message(BaseModel):
     content: str
     created_at: Optional[datetime] = Field(default=None, alias="createdAt")
     updated_at: Optional[datetime] = Field(default=None, alias="updatedAt")
+    # Set on assistant replies cut short by a client disconnect
+    truncated: bool = False
 
     class Config:
         populate_by_name = True
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 class CreateMessageRequest(BaseModel):
@@ -19,6 +19,27 @@ class ConversationInfo(BaseModel):
     messageCount: int
     firstMessage: str
 
+class ConversationPage(BaseModel):
+    items: List[ConversationInfo]
+    nextCursor: Optional[str] = None
+
+class HistoryPage(BaseModel):
+    # Raw message documents, same shape as the unpaginated history response
+    items: List[dict]
+    nextCursor: Optional[str] = None
+
+class SearchHit(BaseModel):
+    conversationId: str
+    messageId: str
+    role: str
+    createdAt: datetime
+    score: float
+    snippet: str
+
+class SearchPage(BaseModel):
+    items: List[SearchHit]
+    nextCursor: Optional[str] = None
+
 class DeleteConversationResponse(BaseModel):
     success: bool
     message: str
@@ -0,0 +1,46 @@
+import importlib.util
+import os
+from typing import Any, Dict
+import uvicorn
+from app.config import Settings
+
+
+def default_workers() -> int:
+    """One worker per CPU: the app is async, so each process saturates a core on its own"""
+    return os.cpu_count() or 1
+
+
+def uvicorn_options(settings: Settings, production: bool, host: str = "0.0.0.0") -> Dict[str, Any]:
+    """Build uvicorn.run() options for development (reloader) or production (workers)"""
+    options: Dict[str, Any] = {
+        "host": host,
+        "port": settings.PORT,
+        "timeout_keep_alive": settings.KEEPALIVE_SECONDS,
+        "backlog": settings.BACKLOG,
+    }
+    if not production:
+        options["reload"] = settings.DEBUG
+        return options
+
+    options.update({
+        "workers": settings.WORKERS or default_workers(),
+        "reload": False,
+        "access_log": settings.ACCESS_LOG,
+        "proxy_headers": True,
+    })
+    # Both ship with uvicorn[standard]; fall back to the pure-Python implementations without them
+    if importlib.util.find_spec("uvloop") is not None:
+        options["loop"] = "uvloop"
+    if importlib.util.find_spec("httptools") is not None:
+        options["http"] = "httptools"
+    if settings.LIMIT_CONCURRENCY:
+        options["limit_concurrency"] = settings.LIMIT_CONCURRENCY
+    return options
+
+
+def run(settings: Settings, production: bool, host: str = "0.0.0.0"):
+    """Start the server; in production each worker is a separate process that builds its own state"""
+    options = uvicorn_options(settings, production, host)
+    mode = f"production, {options['workers']} workers" if production else f"development, reload={options['reload']}"
+    print(f"Starting FastAPI server on {host}:{settings.PORT} ({mode})")
+    uvicorn.run("app.main:app", **options)
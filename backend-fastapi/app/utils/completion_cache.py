@@ -0,0 +1,231 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, AsyncIterator
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+# Seconds between sweeps of the cache directory
+SWEEP_INTERVAL = 60.0
+
+
+def make_cache_key(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+    """Hash everything that determines a completion into a cache key"""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """LRU/TTL cache of completions, optionally backed by a directory on disk
+
+    Entries are stored as `{"model", "deltas", "finishReason"}`, where `deltas`
+    are the content pieces as they were streamed (a single piece for
+    non-streaming completions). Both the streaming and the non-streaming path
+    can be answered from the same entry.
+
+    Writes sweep the directory at most every SWEEP_INTERVAL seconds: expired
+    files are removed, then the oldest ones until it holds at most
+    `max_bytes`. Several processes may share the directory.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl: float = 3600.0,
+        directory: Optional[str] = None,
+        max_bytes: int = 100 * 1024 * 1024,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._last_sweep = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evicted_files = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read_file(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl <= time.time():
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_file(self, key: str, entry: Dict[str, Any]):
+        # Write to a temporary file first so readers never see a partial entry
+        tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(entry, file, ensure_ascii=False)
+        os.replace(tmp_path, self._path(key))
+
+    def _sweep_directory(self) -> int:
+        """Remove expired and, past `max_bytes`, the oldest files; returns how many were removed"""
+        now = time.time()
+        files = []
+        removed = 0
+        for item in os.scandir(self.directory):
+            try:
+                stat = item.stat()
+                if stat.st_mtime + self.ttl <= now:
+                    # Expired entries and temporary files left by crashed writers
+                    os.remove(item.path)
+                    removed += 1
+                elif item.name.endswith(".json"):
+                    files.append((stat.st_mtime, stat.st_size, item.path))
+            except OSError:
+                # Removed by another process meanwhile
+                continue
+        total = sum(size for _, size, _ in files)
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+            total -= size
+        return removed
+
+    def _remember(self, key: str, entry: Dict[str, Any]):
+        self._entries[key] = (entry, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get a cached completion, checking memory first and then disk"""
+        cached = self._entries.get(key)
+        if cached is not None:
+            entry, expires_at = cached
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            del self._entries[key]
+        if self.directory:
+            loop = asyncio.get_running_loop()
+            entry = await loop.run_in_executor(None, self._read_file, key)
+            if entry is not None:
+                self._remember(key, entry)
+                self.hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, entry: Dict[str, Any]):
+        """Store a completion in memory and, if configured, on disk"""
+        self._remember(key, entry)
+        if self.directory:
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self._write_file, key, entry)
+            except OSError as error:
+                print(f"Error writing completion cache entry: {error}")
+            if time.monotonic() - self._last_sweep >= SWEEP_INTERVAL:
+                self._last_sweep = time.monotonic()
+                try:
+                    self.evicted_files += await loop.run_in_executor(None, self._sweep_directory)
+                except OSError as error:
+                    print(f"Error sweeping completion cache directory: {error}")
+
+    def stats(self) -> Dict[str, int]:
+        """Get the size, hit/miss and disk eviction counters"""
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictedFiles": self.evicted_files,
+        }
+
+
+class StreamRecording:
+    """Records one upstream stream so any number of consumers can follow it
+
+    A consumer that attaches late first replays what was recorded so far and
+    then follows the live stream.
+    """
+
+    def __init__(self):
+        self.deltas: List[str] = []
+        # The model the upstream reported, once its first chunk arrived
+        self.model: Optional[str] = None
+        self.finish_reason: Optional[str] = None
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, delta: str):
+        self.deltas.append(delta)
+        self._notify()
+
+    def finish(self, finish_reason: Optional[str] = None, error: Optional[BaseException] = None):
+        self.finish_reason = finish_reason
+        self.error = error
+        self.done = True
+        self._notify()
+
+    def to_entry(self, model: str) -> Dict[str, Any]:
+        return {"model": model, "deltas": self.deltas, "finishReason": self.finish_reason}
+
+    async def follow(self) -> AsyncIterator[str]:
+        """Yield every recorded delta, waiting for new ones until the stream ends"""
+        position = 0
+        while True:
+            while position < len(self.deltas):
+                yield self.deltas[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+def completion_from_entry(key: str, entry: Dict[str, Any]) -> ChatCompletion:
+    """Rebuild a non-streaming completion from a cache entry"""
+    return ChatCompletion.model_validate({
+        "id": f"cache-{key[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": entry["model"],
+        "choices": [{
+            "index": 0,
+            "finish_reason": entry.get("finishReason") or "stop",
+            "message": {"role": "assistant", "content": "".join(entry["deltas"])},
+        }],
+    })
+
+
+def chunk_from_delta(key: str, model: str, content: Optional[str], finish_reason: Optional[str] = None) -> ChatCompletionChunk:
+    """Build a streaming chunk carrying one recorded content delta"""
+    delta = {"content": content} if content is not None else {}
+    return ChatCompletionChunk.model_validate({
+        "id": f"cache-{key[:24]}",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": finish_reason, "delta": delta}],
+    })
@@ -0,0 +1,29 @@
+import hashlib
+from typing import Any, Optional
+
+# Responses must be revalidated on every use, but may be kept for that
+REVALIDATE_HEADERS = {"Cache-Control": "no-cache"}
+
+
+def make_etag(*parts: Any) -> str:
+    """Build a strong ETag from the parts that determine a response's bytes"""
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag
+
+    If-None-Match uses the weak comparison, so a W/ prefix is ignored.
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
@@ -0,0 +1,328 @@
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Latency buckets in seconds, from sub-millisecond Mongo commands to long generations
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+)
+
+# A sample produced at scrape time: metric name, type, help text and (labels, value) pairs
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        # Set by metrics that are also updated off the event loop thread
+        self._lock: Optional[threading.Lock] = None
+
+    def labels(self, *values: str):
+        """Get the child for one combination of label values"""
+        child = self._children.get(values)
+        if child is None:
+            if self._lock is None:
+                child = self._children[values] = self._new_child()
+            else:
+                with self._lock:
+                    child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if self._lock is None:
+            children = list(self._children.items())
+        else:
+            with self._lock:
+                children = list(self._children.items())
+        for values, child in children:
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    """A monotonically increasing count"""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class Gauge(Counter):
+    """A value that goes up and down"""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count", "lock")
+
+    def __init__(self, buckets: Tuple[float, ...], lock: Optional[threading.Lock] = None):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = lock
+
+    def observe(self, value: float):
+        # Counts are per bucket; they are made cumulative when rendered
+        index = bisect.bisect_left(self.buckets, value)
+        if self.lock is None:
+            self._add(index, value)
+        else:
+            with self.lock:
+                self._add(index, value)
+
+    def _add(self, index: int, value: float):
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        if self.lock is None:
+            return self.counts, self.sum, self.count
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+
+class Histogram(_Metric):
+    """Observations counted into fixed buckets, with their sum and count
+
+    With `thread_safe` every update and scrape takes a lock, for histograms
+    observed from threads other than the event loop's.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS, thread_safe: bool = False
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        if thread_safe:
+            self._lock = threading.Lock()
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets, self._lock)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_child(self, values, child):
+        lines = []
+        cumulative = 0
+        counts, total, count_all = child.snapshot()
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            le = _format_labels(self.labelnames, values, f'le="{_format_value(float(bound))}"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        le_inf = _format_labels(self.labelnames, values, 'le="+Inf"')
+        lines.append(f"{self.name}_bucket{le_inf} {count_all}")
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count_all}")
+        return lines
+
+
+class Registry:
+    """Metrics of this process, rendered in the Prometheus text format
+
+    Most updates are plain attribute arithmetic on the event loop thread, so
+    recording costs well under a microsecond. Metrics fed from other threads,
+    such as the Mongo command histogram whose driver callbacks run on Motor's
+    executor threads, are created thread-safe and take a lock instead.
+    Collectors are called at scrape time to export counters that other
+    components already keep.
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception as error:
+                print(f"Error collecting metrics: {error}")
+                continue
+            for name, kind, help, values in samples:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in values:
+                    label_text = _format_labels(tuple(labels), tuple(labels.values()))
+                    lines.append(f"{name}{label_text} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "chatbot_http_request_duration_seconds",
+    "HTTP request latency by route, until the last byte of the response",
+    ["method", "route", "status"],
+))
+CHAT_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "chatbot_stage_duration_seconds",
+    "Duration of each stage of handling a chat message",
+    ["stage"],
+))
+MONGO_COMMAND_SECONDS = REGISTRY.register(Histogram(
+    "chatbot_mongo_command_duration_seconds",
+    "MongoDB command durations reported by the driver",
+    ["command", "outcome"],
+    thread_safe=True,
+))
+STREAMS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "chatbot_streams_in_flight",
+    "Streamed generations currently running",
+))
+STREAMS_IN_FLIGHT.set(0)
+WEBSOCKETS_OPEN = REGISTRY.register(Gauge(
+    "chatbot_websocket_connections",
+    "Open /chatbot/ws connections",
+))
+WEBSOCKETS_OPEN.set(0)
+COMPLETION_TOKENS = REGISTRY.register(Counter(
+    "chatbot_completion_tokens_total",
+    "Completion tokens received from the model",
+    ["mode"],
+))
+TOKENS_PER_SECOND = REGISTRY.register(Histogram(
+    "chatbot_generation_tokens_per_second",
+    "Completion tokens per second of generation time",
+    ["mode"],
+    buckets=(1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500),
+))
+
+
+def observe_stage(stage: str, started: float) -> float:
+    """Record the time since `started` (a perf_counter value) for a stage and return now"""
+    now = time.perf_counter()
+    CHAT_STAGE_SECONDS.labels(stage).observe(now - started)
+    return now
+
+
+def record_generation(mode: str, tokens: int, seconds: float):
+    """Record completion tokens and the generation throughput"""
+    COMPLETION_TOKENS.labels(mode).inc(tokens)
+    if tokens and seconds > 0:
+        TOKENS_PER_SECOND.labels(mode).observe(tokens / seconds)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency per route template
+
+    The route label is the path template (e.g. /chatbot/history/{conversation_id})
+    so label cardinality stays bounded; unmatched paths share one label.
+    """
+
+    def __init__(self, app, histogram: Histogram = HTTP_REQUEST_SECONDS):
+        self.app = app
+        self.histogram = histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = "500"
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            self.histogram.labels(scope["method"], path, status).observe(time.perf_counter() - started)
+
+
+def _snake_case(name: str) -> str:
+    return "".join(f"_{c.lower()}" if c.isupper() else c for c in name)
+
+
+def stats_samples(prefix: str, component: str, stats: Dict[str, float], counters: Iterable[str] = ()) -> List[Sample]:
+    """Turn a component's stats() dict into samples, e.g. {"hits": 3} -> chatbot_history_cache_hits_total"""
+    counters = set(counters)
+    samples = []
+    for key, value in stats.items():
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            continue
+        name = f"{prefix}_{_snake_case(key)}"
+        if key in counters:
+            samples.append((f"{name}_total", "counter", f"{component} {key}", [({}, value)]))
+        else:
+            samples.append((name, "gauge", f"{component} {key}", [({}, value)]))
+    return samples
@@ -1,22 +1,179 @@
+import asyncio
+import os
+from typing import List, Dict, Optional
 from openai import AsyncOpenAI
 from app.config import settings
+from app.utils.scheduler import RequestScheduler
+from app.utils.upstreams import Upstream, UpstreamPool, build_upstream_pool
+from app.utils.completion_cache import (
+    CompletionCache,
+    StreamRecording,
+    make_cache_key,
+    completion_from_entry,
+    chunk_from_delta,
+)
+
+TEMPERATURE = 0.7
+MAX_TOKENS = 500
 
 class OpenAIClient:
-    def __init__(self):
-        self.client = AsyncOpenAI(
-            base_url=settings.OPENAI_BASE_URL,
-            api_key=settings.OPENAI_API_KEY
+    def __init__(
+        self,
+        client: Optional[AsyncOpenAI] = None,
+        scheduler: Optional[RequestScheduler] = None,
+        pool: Optional[UpstreamPool] = None,
+    ):
+        if client is not None:
+            pool = UpstreamPool([Upstream("default", client, settings.MODEL)])
+        # Built from settings here, so they can be rebuilt in a forked worker
+        self._owns_pool = pool is None
+        self._owns_scheduler = scheduler is None
+        self.pool = pool or build_upstream_pool(settings)
+        self.model = self.pool.upstreams[0].model
+        self.scheduler = scheduler or self._build_scheduler()
+        self.cache: Optional[CompletionCache] = None
+        models = {upstream.model for upstream in self.pool.upstreams}
+        if settings.COMPLETION_CACHE_ENABLED and len(models) > 1:
+            # The key cannot say which upstream, and so which model, will answer
+            print(f"Completion cache disabled: the upstream pool mixes models ({', '.join(sorted(models))})")
+        elif settings.COMPLETION_CACHE_ENABLED:
+            self.cache = CompletionCache(
+                max_entries=settings.COMPLETION_CACHE_SIZE,
+                ttl=settings.COMPLETION_CACHE_TTL_SECONDS,
+                directory=settings.COMPLETION_CACHE_DIR,
+                max_bytes=int(settings.COMPLETION_CACHE_DIR_MAX_MB * 1024 * 1024),
+            )
+        # Upstream calls in progress, shared by identical concurrent requests
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._inflight_streams: Dict[str, StreamRecording] = {}
+        self._recorders = set()
+
+    def _build_scheduler(self) -> RequestScheduler:
+        return RequestScheduler(
+            max_in_flight=settings.OPENAI_MAX_IN_FLIGHT,
+            rate_per_second=settings.OPENAI_RATE_LIMIT_PER_SECOND,
+            burst=settings.OPENAI_RATE_LIMIT_BURST,
+            max_retries=settings.OPENAI_MAX_RETRIES,
+            backoff_base=settings.OPENAI_BACKOFF_BASE_MS / 1000,
+            backoff_max=settings.OPENAI_BACKOFF_MAX_MS / 1000,
+            hedge_after=settings.OPENAI_HEDGE_AFTER_MS / 1000,
         )
-        self.model = settings.MODEL
+
+    def reset_after_fork(self):
+        """Drop state inherited from the parent process
+
+        HTTP connection pools, in-flight tasks and load counters belong to the
+        parent's event loop and sockets, so a forked worker starts fresh.
+        Cached completions are plain data and are kept.
+        """
+        if self._owns_pool:
+            self.pool = build_upstream_pool(settings)
+        if self._owns_scheduler:
+            self.scheduler = self._build_scheduler()
+        self._inflight = {}
+        self._inflight_streams = {}
+        self._recorders = set()
+
+    async def _create(self, messages, stream=False):
+        def call():
+            return self.pool.create(
+                messages=messages,
+                temperature=TEMPERATURE,
+                max_tokens=MAX_TOKENS,
+                stream=stream
+            )
+
+        if stream:
+            return await self.scheduler.run_stream(call)
+        return await self.scheduler.run(call)
 
     async def create_chat_completion(self, messages, stream=False):
-        """Create a chat completion using the OpenAI API"""
-        return await self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=0.7,
-            max_tokens=500,
-            stream=stream
-        )
+        """Create a chat completion using the OpenAI API
+
+        With the completion cache enabled, identical requests are answered from
+        the cache, and concurrent identical requests share one upstream call.
+        """
+        if self.cache is None:
+            return await self._create(messages, stream=stream)
+
+        key = make_cache_key(self.model, messages, TEMPERATURE, MAX_TOKENS)
+        entry = await self.cache.get(key)
+        if entry is not None:
+            if stream:
+                return self._replay_entry(key, entry)
+            return completion_from_entry(key, entry)
+
+        if stream:
+            recording = self._inflight_streams.get(key)
+            if recording is None:
+                # Registered before the upstream call so concurrent requests attach to it
+                recording = StreamRecording()
+                self._inflight_streams[key] = recording
+                recorder = asyncio.create_task(self._record_stream(key, messages, recording))
+                self._recorders.add(recorder)
+                recorder.add_done_callback(self._recorders.discard)
+            return self._follow_recording(key, recording)
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._complete_and_store(key, messages))
+            self._inflight[key] = task
+        # Shield so one caller going away does not cancel the call for the others
+        return await asyncio.shield(task)
+
+    async def _complete_and_store(self, key: str, messages: List[Dict[str, str]]):
+        try:
+            completion = await self._create(messages)
+            choice = completion.choices[0]
+            if choice.message.content:
+                await self.cache.set(key, {
+                    "model": completion.model,
+                    "deltas": [choice.message.content],
+                    "finishReason": choice.finish_reason,
+                })
+            return completion
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _record_stream(self, key: str, messages: List[Dict[str, str]], recording: StreamRecording):
+        """Drain an upstream stream into a recording and cache it once complete"""
+        finish_reason = None
+        try:
+            upstream = await self._create(messages, stream=True)
+            async for chunk in upstream:
+                if not chunk.choices:
+                    continue
+                if getattr(chunk, "model", None):
+                    recording.model = chunk.model
+                choice = chunk.choices[0]
+                if choice.delta.content:
+                    recording.append(choice.delta.content)
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+        except Exception as error:
+            recording.finish(error=error)
+        else:
+            recording.finish(finish_reason)
+            if recording.deltas:
+                await self.cache.set(key, recording.to_entry(recording.model or self.model))
+        finally:
+            self._inflight_streams.pop(key, None)
+
+    def upstream_stats(self):
+        """Get per-upstream load, latency and error statistics"""
+        return self.pool.stats()
+
+    async def _follow_recording(self, key: str, recording: StreamRecording):
+        async for delta in recording.follow():
+            yield chunk_from_delta(key, recording.model or self.model, delta)
+        yield chunk_from_delta(key, recording.model or self.model, None, recording.finish_reason or "stop")
+
+    async def _replay_entry(self, key: str, entry):
+        for delta in entry["deltas"]:
+            yield chunk_from_delta(key, entry["model"], delta)
+        yield chunk_from_delta(key, entry["model"], None, entry.get("finishReason") or "stop")
+
+openai_client = OpenAIClient()
 
-openai_client = OpenAIClient()
\ No newline at end of file
+# Workers forked from a process that imported this module (e.g. gunicorn --preload)
+os.register_at_fork(after_in_child=openai_client.reset_after_fork)
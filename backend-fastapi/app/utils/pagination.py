@@ -0,0 +1,39 @@
+import base64
+import json
+from datetime import datetime
+from typing import Tuple
+
+# Upper bound for the `limit` query parameter of paginated endpoints
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(sort_value: datetime, tiebreaker: str) -> str:
+    """Encode the keyset position of the last item of a page as an opaque cursor"""
+    payload = json.dumps({"t": sort_value.isoformat(), "id": tiebreaker}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode a cursor produced by encode_cursor, raising ValueError if it is malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(payload["t"]), str(payload["id"])
+    except (ValueError, KeyError, TypeError) as error:
+        raise ValueError("Invalid cursor") from error
+
+
+def encode_score_cursor(score: float, tiebreaker: str) -> str:
+    """Encode the position of the last item of a page ranked by a relevance score"""
+    payload = json.dumps({"s": score, "id": tiebreaker}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_score_cursor(cursor: str) -> Tuple[float, str]:
+    """Decode a cursor produced by encode_score_cursor, raising ValueError if it is malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return float(payload["s"]), str(payload["id"])
+    except (ValueError, KeyError, TypeError) as error:
+        raise ValueError("Invalid cursor") from error
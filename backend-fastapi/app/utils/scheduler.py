@@ -0,0 +1,244 @@
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional
+import openai
+
+
+class TokenBucket:
+    """Token-bucket rate limiter: `rate` requests per second with bursts up to `burst`"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self):
+        """Wait until a request may be sent"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Waiters queue on the lock so tokens are handed out in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """429s, 5xx responses, timeouts and connection errors are worth retrying"""
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """Get the server's Retry-After hint in seconds, if it sent one"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class ReleasingStream:
+    """Wraps an upstream stream and calls `release` exactly once when it ends"""
+
+    def __init__(self, stream, release: Callable[[], None]):
+        self._stream = stream
+        self._iterator = stream.__aiter__()
+        self._release = release
+        self._released = False
+
+    def _free(self):
+        if not self._released:
+            self._released = True
+            self._release()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._iterator.__anext__()
+        except BaseException:
+            # End of stream, upstream error or cancellation
+            self._free()
+            raise
+
+    async def close(self):
+        """Close the upstream stream and release"""
+        self._free()
+        close = getattr(self._stream, "aclose", None) or getattr(self._stream, "close", None)
+        if close is not None:
+            result = close()
+            if asyncio.iscoroutine(result):
+                await result
+
+    aclose = close
+
+    def __del__(self):
+        # A consumer that never finished iterating must not leak what it holds
+        self._free()
+
+
+class RequestScheduler:
+    """Client-side admission control for upstream LLM requests
+
+    Requests wait for the rate limiter and for one of `max_in_flight` slots,
+    are retried with exponential backoff and full jitter on retryable errors,
+    and, when `hedge_after` is set, non-streaming requests that have not
+    answered within that many seconds get a second, competing attempt.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 32,
+        rate_per_second: float = 0,
+        burst: int = 10,
+        max_retries: int = 3,
+        backoff_base: float = 0.25,
+        backoff_max: float = 8.0,
+        hedge_after: float = 0,
+    ):
+        self.max_in_flight = max_in_flight
+        self.rate_limiter = TokenBucket(rate_per_second, burst) if rate_per_second > 0 else None
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.admissions = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    async def _acquire(self):
+        """Wait for the rate limiter and a free slot, recording the queue wait"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        started = time.monotonic()
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
+        await self._slots.acquire()
+        waited = time.monotonic() - started
+        self.admissions += 1
+        self.queue_wait_total += waited
+        self.queue_wait_max = max(self.queue_wait_max, waited)
+        self.in_flight += 1
+
+    def _release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    def _backoff(self, attempt: int, error: BaseException) -> float:
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _attempt(self, call: Callable[[], Awaitable]):
+        """Run one attempt inside a slot"""
+        await self._acquire()
+        try:
+            return await call()
+        finally:
+            self._release()
+
+    async def _hedged_attempt(self, call: Callable[[], Awaitable]):
+        """Run an attempt and race it against a second one if it is slow"""
+        tasks = {asyncio.ensure_future(self._attempt(call))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if done:
+                return done.pop().result()
+
+            self.hedges += 1
+            hedge = asyncio.ensure_future(self._attempt(call))
+            tasks.add(hedge)
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The losing attempt, or every attempt if the caller went away
+            for task in tasks:
+                task.cancel()
+
+    async def run(self, call: Callable[[], Awaitable], hedge: bool = True):
+        """Run an upstream call under the concurrency, rate and retry policy"""
+        self.requests += 1
+        attempt = 0
+        while True:
+            try:
+                if hedge and self.hedge_after > 0:
+                    return await self._hedged_attempt(call)
+                return await self._attempt(call)
+            except Exception as error:
+                if attempt >= self.max_retries or not is_retryable(error):
+                    self.failures += 1
+                    raise
+                delay = self._backoff(attempt, error)
+                attempt += 1
+                self.retries += 1
+                print(f"Upstream request failed ({error}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def run_stream(self, call: Callable[[], Awaitable]):
+        """Open an upstream stream under the policy and hold its slot until the stream ends
+
+        Only opening the stream is retried; errors after the first chunk are
+        passed through to the consumer.
+        """
+        self.requests += 1
+        attempt = 0
+        while True:
+            await self._acquire()
+            try:
+                stream = await call()
+                break
+            except Exception as error:
+                self._release()
+                if attempt >= self.max_retries or not is_retryable(error):
+                    self.failures += 1
+                    raise
+                delay = self._backoff(attempt, error)
+                attempt += 1
+                self.retries += 1
+                print(f"Upstream stream failed to open ({error}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+        return ReleasingStream(stream, self._release)
+
+    def stats(self) -> Dict[str, float]:
+        """Get queueing and retry metrics"""
+        return {
+            "inFlight": self.in_flight,
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "hedges": self.hedges,
+            "hedgeWins": self.hedge_wins,
+            "queueWaitAvgMs": self.queue_wait_total * 1000 / self.admissions if self.admissions else 0.0,
+            "queueWaitMaxMs": self.queue_wait_max * 1000,
+        }
@@ -0,0 +1,30 @@
+import json
+from datetime import datetime
+from typing import Any, Dict
+from bson import ObjectId
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the standard library
+    orjson = None
+
+
+def json_default(value: Any) -> Any:
+    """Serialize the BSON types found in Mongo documents"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value: Any) -> bytes:
+    """Serialize a value to compact UTF-8 JSON, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(value, default=json_default)
+    return json.dumps(value, default=json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def to_ndjson_line(document: Dict[str, Any]) -> bytes:
+    """Serialize a Mongo document as one NDJSON line"""
+    return dumps(document) + b"\n"
@@ -0,0 +1,157 @@
+import asyncio
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, Any, Optional
+from app.utils.serialization import dumps
+
+HEARTBEAT_FRAME = b": keep-alive\n\n"
+
+# Marks the end of the source stream on the pump queue
+_END = object()
+
+
+def encode_event(event: Dict[str, Any], event_id: Optional[str] = None) -> bytes:
+    """Encode an event as one SSE frame
+
+    The JSON encoder escapes quotes and newlines inside strings, so the
+    payload always fits on a single `data:` line.
+    """
+    frame = b"data: " + dumps(event) + b"\n\n"
+    if event_id is not None:
+        frame = b"id: " + event_id.encode("utf-8") + b"\n" + frame
+    return frame
+
+
+async def _pump(source: AsyncIterator[Dict[str, Any]], queue: asyncio.Queue):
+    try:
+        async for event in source:
+            await queue.put(event)
+    except Exception as error:
+        await queue.put(error)
+    else:
+        await queue.put(_END)
+    finally:
+        # If cancelled while the source is parked at a yield, close it explicitly
+        aclose = getattr(source, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+async def coalesce_events(
+    source: AsyncIterator[Dict[str, Any]],
+    window: float = 0.03,
+    max_bytes: int = 1024,
+    heartbeat_interval: float = 15.0,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    disconnect_poll_interval: float = 0.25,
+) -> AsyncIterator[Optional[Dict[str, Any]]]:
+    """Merge consecutive content events into larger ones and interleave heartbeats
+
+    Content is held back until `max_bytes` of it are buffered, `window`
+    seconds have passed since the first buffered delta, or another event type
+    arrives. With `window` 0 every content event is passed through as is.
+    Yields None when the stream has been idle for `heartbeat_interval`.
+
+    When `is_disconnected` is given it is polled every
+    `disconnect_poll_interval` seconds; once it returns True the stream ends
+    and the source is cancelled, even if it is waiting for its next event.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=256)
+    pump = asyncio.ensure_future(_pump(source, queue))
+    buffered = []
+    buffered_bytes = 0
+    buffered_id = None
+    flush_at = None
+    last_sent = time.monotonic()
+    next_poll = last_sent + disconnect_poll_interval if is_disconnected else float("inf")
+
+    def take_buffer() -> Dict[str, Any]:
+        nonlocal buffered, buffered_bytes, buffered_id, flush_at
+        event = {"type": "content", "content": "".join(buffered)}
+        if buffered_id is not None:
+            # A merged frame carries the ID of its newest delta
+            event["id"] = buffered_id
+        buffered, buffered_bytes, buffered_id, flush_at = [], 0, None, None
+        return event
+
+    try:
+        while True:
+            now = time.monotonic()
+            if now >= next_poll:
+                if await is_disconnected():
+                    return
+                next_poll = now + disconnect_poll_interval
+            deadline = flush_at if flush_at is not None else last_sent + heartbeat_interval
+            if not queue.empty() and now < deadline:
+                item = queue.get_nowait()
+            else:
+                try:
+                    item = await asyncio.wait_for(
+                        queue.get(), timeout=max(min(deadline, next_poll) - now, 0)
+                    )
+                except asyncio.TimeoutError:
+                    if time.monotonic() < deadline:
+                        # Woken up only to poll for a disconnect
+                        continue
+                    if buffered:
+                        yield take_buffer()
+                    else:
+                        yield None
+                    last_sent = time.monotonic()
+                    continue
+
+            if item is _END:
+                if buffered:
+                    yield take_buffer()
+                return
+            if isinstance(item, Exception):
+                if buffered:
+                    yield take_buffer()
+                raise item
+
+            if item.get("type") == "content" and window > 0:
+                content = item["content"]
+                buffered.append(content)
+                buffered_bytes += len(content.encode("utf-8"))
+                buffered_id = item.get("id", buffered_id)
+                if flush_at is None:
+                    flush_at = time.monotonic() + window
+                if buffered_bytes >= max_bytes:
+                    yield take_buffer()
+                    last_sent = time.monotonic()
+                continue
+
+            if buffered:
+                yield take_buffer()
+            yield item
+            last_sent = time.monotonic()
+    finally:
+        # Stops the source as well when the consumer goes away
+        pump.cancel()
+        try:
+            await pump
+        except asyncio.CancelledError:
+            pass
+
+
+async def sse_stream(
+    source: AsyncIterator[Dict[str, Any]],
+    window: float = 0.03,
+    max_bytes: int = 1024,
+    heartbeat_interval: float = 15.0,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+) -> AsyncIterator[bytes]:
+    """Encode an event stream as coalesced SSE frames with heartbeat comments
+
+    An event's `id` key, if any, is sent as the frame's `id:` field.
+    """
+    events = coalesce_events(
+        source, window, max_bytes, heartbeat_interval, is_disconnected=is_disconnected
+    )
+    async for event in events:
+        if event is None:
+            yield HEARTBEAT_FRAME
+        elif "id" in event:
+            event_id = event["id"]
+            yield encode_event({k: v for k, v in event.items() if k != "id"}, event_id)
+        else:
+            yield encode_event(event)
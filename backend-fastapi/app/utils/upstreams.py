@@ -0,0 +1,183 @@
+import random
+import time
+from typing import List, Dict, Any, Optional
+from openai import AsyncOpenAI
+from app.utils.scheduler import ReleasingStream, is_retryable
+
+ROUTING_LEAST_OUTSTANDING = "least_outstanding"
+ROUTING_EWMA = "ewma"
+
+# Weight of the newest latency sample in the moving average
+EWMA_ALPHA = 0.3
+
+
+class Upstream:
+    """One OpenAI-compatible backend with its load, latency and health state"""
+
+    def __init__(self, name: str, client: AsyncOpenAI, model: str):
+        self.name = name
+        self.client = client
+        self.model = model
+        self.outstanding = 0
+        self.ewma_latency = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    def available(self, cooldown: float) -> bool:
+        """Closed circuits take traffic; open ones allow a single probe after the cooldown"""
+        if self.opened_at is None:
+            return True
+        return not self.probing and time.monotonic() - self.opened_at >= cooldown
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "outstanding": self.outstanding,
+            "ewmaLatencyMs": round(self.ewma_latency * 1000, 2),
+            "requests": self.requests,
+            "errors": self.errors,
+            "circuitOpen": self.opened_at is not None,
+        }
+
+
+class UpstreamPool:
+    """Routes requests across upstreams and fails over between them
+
+    Routing is by fewest outstanding requests or by EWMA latency scaled by
+    load. After `failure_threshold` consecutive retryable failures an
+    upstream's circuit opens and it is skipped for `cooldown` seconds, after
+    which a single probe request decides whether it closes again.
+    """
+
+    def __init__(
+        self,
+        upstreams: List[Upstream],
+        routing: str = ROUTING_LEAST_OUTSTANDING,
+        failure_threshold: int = 5,
+        cooldown: float = 30.0,
+    ):
+        if not upstreams:
+            raise ValueError("At least one upstream is required")
+        self.upstreams = upstreams
+        self.routing = routing
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+    def _score(self, upstream: Upstream) -> float:
+        if self.routing == ROUTING_EWMA:
+            return upstream.ewma_latency * (upstream.outstanding + 1)
+        return upstream.outstanding
+
+    def pick(self, exclude: List[Upstream]) -> Optional[Upstream]:
+        """Pick the best upstream not yet tried for this request"""
+        candidates = [u for u in self.upstreams if u not in exclude]
+        if not candidates:
+            return None
+        healthy = [u for u in candidates if u.available(self.cooldown)]
+        if healthy:
+            candidates = healthy
+        else:
+            # Every circuit is open: try the one that has been resting longest
+            candidates = [min(candidates, key=lambda u: u.opened_at)]
+        best = min(self._score(u) for u in candidates)
+        upstream = random.choice([u for u in candidates if self._score(u) == best])
+        if upstream.opened_at is not None:
+            upstream.probing = True
+        return upstream
+
+    def _record_success(self, upstream: Upstream, latency: float):
+        upstream.requests += 1
+        if upstream.ewma_latency == 0:
+            upstream.ewma_latency = latency
+        else:
+            upstream.ewma_latency += EWMA_ALPHA * (latency - upstream.ewma_latency)
+        upstream.consecutive_failures = 0
+        upstream.opened_at = None
+        upstream.probing = False
+
+    def _record_failure(self, upstream: Upstream, error: BaseException):
+        upstream.requests += 1
+        upstream.errors += 1
+        upstream.probing = False
+        if not is_retryable(error):
+            # The request was bad, not the upstream
+            return
+        upstream.consecutive_failures += 1
+        if upstream.opened_at is not None or upstream.consecutive_failures >= self.failure_threshold:
+            if upstream.opened_at is None:
+                print(f"Upstream {upstream.name} failed {upstream.consecutive_failures} times, opening circuit")
+            upstream.opened_at = time.monotonic()
+
+    async def create(self, stream: bool = False, **params):
+        """Create a chat completion, failing over to the next upstream on retryable errors
+
+        For streams only opening the stream fails over; the upstream's
+        outstanding count is held until the stream ends.
+        """
+        tried: List[Upstream] = []
+        last_error: Optional[BaseException] = None
+        while True:
+            upstream = self.pick(tried)
+            if upstream is None:
+                raise last_error
+            tried.append(upstream)
+            upstream.outstanding += 1
+            started = time.monotonic()
+            try:
+                result = await upstream.client.chat.completions.create(
+                    model=upstream.model, stream=stream, **params
+                )
+            except BaseException as error:
+                upstream.outstanding -= 1
+                if not isinstance(error, Exception):
+                    # Cancelled: says nothing about the upstream's health
+                    upstream.probing = False
+                    raise
+                self._record_failure(upstream, error)
+                if not is_retryable(error):
+                    raise
+                last_error = error
+                continue
+            self._record_success(upstream, time.monotonic() - started)
+            if stream:
+                return ReleasingStream(result, lambda: self._finish(upstream))
+            upstream.outstanding -= 1
+            return result
+
+    def _finish(self, upstream: Upstream):
+        upstream.outstanding -= 1
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Get per-upstream load, latency and error statistics"""
+        return [upstream.stats() for upstream in self.upstreams]
+
+
+def build_upstream_pool(settings) -> UpstreamPool:
+    """Build the pool from OPENAI_UPSTREAMS, or from the single OPENAI_BASE_URL/MODEL pair"""
+    configs = settings.OPENAI_UPSTREAMS or [{
+        "baseUrl": settings.OPENAI_BASE_URL,
+        "apiKey": settings.OPENAI_API_KEY,
+        "model": settings.MODEL,
+    }]
+    upstreams = []
+    for index, config in enumerate(configs):
+        base_url = config.get("baseUrl", settings.OPENAI_BASE_URL)
+        # Retries are handled by the scheduler and the pool, not by the SDK
+        client = AsyncOpenAI(
+            base_url=base_url,
+            api_key=config.get("apiKey", settings.OPENAI_API_KEY),
+            timeout=settings.OPENAI_TIMEOUT_SECONDS,
+            max_retries=0,
+        )
+        name = config.get("name", f"upstream-{index}")
+        upstreams.append(Upstream(name, client, config.get("model", settings.MODEL)))
+    return UpstreamPool(
+        upstreams,
+        routing=settings.OPENAI_ROUTING,
+        failure_threshold=settings.OPENAI_CIRCUIT_FAILURE_THRESHOLD,
+        cooldown=settings.OPENAI_CIRCUIT_COOLDOWN_SECONDS,
+    )
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark prompt size and prompt-build latency as conversations grow.
+
+Compares the bounded context window (`ChatbotService.build_prompt`) with the
+previous behaviour of loading and sending the full history every turn.
+Requires mongomock-motor: pip install mongomock-motor
+
+mongomock has no indexes and scans the collection for every query, so the
+bounded mode's latency still grows slowly here; against mongod with the
+conversationId/createdAt index it stays flat. The history cache is turned
+off so every bounded turn runs that indexed tail query.
+"""
+
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from mongomock_motor import AsyncMongoMockClient
+
+from app.chatbot.context import SYSTEM_PROMPT
+from app.chatbot.service import ChatbotService
+from app.config import settings
+
+LENGTHS = [10, 100, 1000, 5000]
+ROUNDS = 20
+
+
+async def seed(collection, conversation_id: str, count: int):
+    start = datetime.utcnow()
+    await collection.insert_many([
+        {
+            "conversationId": conversation_id,
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"This is message {i} of a long running conversation. " * 4,
+            "createdAt": start + timedelta(seconds=i),
+            "updatedAt": start + timedelta(seconds=i),
+        }
+        for i in range(count)
+    ])
+
+
+async def full_history_prompt(service: ChatbotService, conversation_id: str):
+    history = await service.get_conversation_history(conversation_id)
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    for msg in history:
+        messages.append({"role": msg["role"], "content": msg["content"]})
+    return messages
+
+
+async def measure(build, service, conversation_id):
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        messages = await build(service, conversation_id)
+    elapsed_ms = (time.perf_counter() - started) * 1000 / ROUNDS
+    tokens = sum(service.token_counter.count_message(m) for m in messages)
+    return len(messages), tokens, elapsed_ms
+
+
+async def main():
+    db = AsyncMongoMockClient()["benchmark"]
+    collection = db["messages"]
+    # Measure the tail query, not cache hits
+    settings.HISTORY_CACHE_SIZE = 0
+    service = ChatbotService()
+    service.messages_collection = collection
+    service.conversations_collection = db["conversations"]
+    service.compactions_collection = db["conversation_compactions"]
+    await service.token_counter.load()
+
+    print(f"{'messages':>9} | {'mode':<8} | {'prompt msgs':>11} | {'tokens':>7} | {'ms/turn':>8}")
+    print("-" * 56)
+    for length in LENGTHS:
+        conversation_id = f"bench-{length}"
+        await seed(collection, conversation_id, length)
+        for mode, build in (
+            ("bounded", lambda s, c: s.build_prompt(c)),
+            ("full", full_history_prompt),
+        ):
+            count, tokens, elapsed_ms = await measure(build, service, conversation_id)
+            print(f"{length:>9} | {mode:<8} | {count:>11} | {tokens:>7} | {elapsed_ms:>8.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
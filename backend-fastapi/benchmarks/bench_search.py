@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Benchmark /chatbot/search queries over a generated corpus.
+
+Generates --messages messages (one million by default) spread over
+conversations of 50 messages, with words drawn from a Zipf-like distribution
+over a synthetic vocabulary plus a few planted terms of known frequency.
+Then runs each query --runs times through ChatbotService.search_messages and
+reports p50/p95 latency of the first and second page.
+
+    python benchmarks/bench_search.py --mongo-uri mongodb://localhost:27017/chatbot_search_bench
+
+Needs a real mongod (mongomock has no $text support). The corpus is written
+to the database in the URI, replacing its messages; pass --reuse to query an
+existing corpus again without regenerating it. Compare --candidates 0
+(rank every match) with the default cap to see what it costs and saves.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from bson import ObjectId
+
+from app.database import connection
+from app.database.indexes import ensure_indexes
+from app.chatbot.service import ChatbotService
+from app.config import settings
+
+VOCABULARY = 50_000
+WORDS_PER_MESSAGE = (8, 40)
+BATCH = 10_000
+MESSAGES_PER_CONVERSATION = 50
+# Planted terms and the fraction of messages that contain them
+PLANTED = {"zephyrine": 0.0001, "quarkonium": 0.001, "marmalade": 0.01, "telescope": 0.05}
+QUERIES = [
+    ("rare word", "zephyrine"),
+    ("uncommon word", "quarkonium"),
+    ("common word", "marmalade"),
+    ("very common word", "telescope"),
+    ("two words", "quarkonium marmalade"),
+    ("phrase", '"quarkonium marmalade"'),
+]
+
+
+def vocabulary(rng: random.Random):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(VOCABULARY)]
+
+
+def generate(count: int, rng: random.Random):
+    words = vocabulary(rng)
+    # Zipf-like: weight 1/rank
+    cumulative, total = [], 0.0
+    for rank in range(1, len(words) + 1):
+        total += 1 / rank
+        cumulative.append(total)
+    start = datetime.utcnow() - timedelta(days=365)
+    for index in range(count):
+        length = rng.randint(*WORDS_PER_MESSAGE)
+        text = rng.choices(words, cum_weights=cumulative, k=length)
+        for term, frequency in PLANTED.items():
+            if rng.random() < frequency:
+                text.insert(rng.randrange(len(text) + 1), term)
+        if rng.random() < PLANTED["quarkonium"]:
+            text.insert(rng.randrange(len(text) + 1), "quarkonium marmalade")
+        created = start + timedelta(seconds=index * 30)
+        yield {
+            "_id": ObjectId(),
+            "conversationId": f"corpus-{index // MESSAGES_PER_CONVERSATION}",
+            "role": "user" if index % 2 == 0 else "assistant",
+            "content": " ".join(text),
+            "createdAt": created,
+            "updatedAt": created,
+        }
+
+
+async def load_corpus(db, count: int):
+    await db["messages"].drop()
+    started = time.perf_counter()
+    batch = []
+    for document in generate(count, random.Random(42)):
+        batch.append(document)
+        if len(batch) >= BATCH:
+            await db["messages"].insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await db["messages"].insert_many(batch, ordered=False)
+    print(f"Inserted {count} messages in {time.perf_counter() - started:.1f}s")
+    index_time = await ensure_indexes(db)
+    print(f"Built indexes in {index_time:.1f}s")
+
+
+def percentiles(samples):
+    ms = sorted(sample * 1000 for sample in samples)
+    cuts = statistics.quantiles(ms, n=100, method="inclusive") if len(ms) > 1 else ms * 99
+    return cuts[49], cuts[94]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", required=True)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--reuse", action="store_true", help="query the existing corpus")
+    parser.add_argument(
+        "--candidates", type=int, default=settings.SEARCH_MAX_CANDIDATES,
+        help="matches ranked per page (SEARCH_MAX_CANDIDATES, 0 for all)",
+    )
+    args = parser.parse_args()
+    settings.SEARCH_MAX_CANDIDATES = args.candidates
+
+    await connection.connect_to_mongo(args.mongo_uri)
+    db = connection.get_database()
+    if not args.reuse:
+        await load_corpus(db, args.messages)
+    total = await db["messages"].estimated_document_count()
+    chatbot_service = ChatbotService()
+
+    print(f"\n{total} messages, page size {args.limit}, {args.candidates or 'all'} candidates, {args.runs} runs per query")
+    print(f"{'query':<18} | {'hits':>8} | {'p1 p50 ms':>9} | {'p1 p95 ms':>9} | {'p2 p50 ms':>9} | {'p2 p95 ms':>9}")
+    print("-" * 78)
+    for name, query in QUERIES:
+        hits = await db["messages"].count_documents({"$text": {"$search": query}})
+        first_pages, second_pages = [], []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            page = await chatbot_service.search_messages(query, args.limit)
+            first_pages.append(time.perf_counter() - started)
+            if page["nextCursor"]:
+                started = time.perf_counter()
+                await chatbot_service.search_messages(query, args.limit, page["nextCursor"])
+                second_pages.append(time.perf_counter() - started)
+        p1 = percentiles(first_pages)
+        p2 = percentiles(second_pages) if second_pages else (0, 0)
+        print(f"{name:<18} | {hits:>8} | {p1[0]:>9.1f} | {p1[1]:>9.1f} | {p2[0]:>9.1f} | {p2[1]:>9.1f}")
+
+    await chatbot_service.close()
+    await connection.close_mongo_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark the per-message cost of serializing history responses and of
+building message documents on the write path.
+
+Read path, for a 10k-message history:
+  legacy  - str(_id) in the service, a key-by-key copy in the router, then
+            FastAPI's response_model validation, jsonable_encoder and json.dumps
+  lean    - the raw documents encoded once by app.utils.serialization.dumps
+
+Write path: a `Message` pydantic model unpacked into a dict, versus building
+the dict directly.
+"""
+
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from starlette.responses import JSONResponse
+
+from app.models.message import Message
+from app.utils import serialization
+from app.utils.serialization import dumps
+
+MESSAGES = 10_000
+ROUNDS = 5
+
+
+def history(count: int):
+    start = datetime(2024, 1, 1)
+    return [
+        {
+            "_id": ObjectId(),
+            "conversationId": "bench",
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"Message {i} of a long conversation, with a sentence or two of text.",
+            "createdAt": start + timedelta(seconds=i),
+            "updatedAt": start + timedelta(seconds=i),
+        }
+        for i in range(count)
+    ]
+
+
+history_adapter = TypeAdapter(List[dict])
+
+
+def legacy_read(messages) -> bytes:
+    for message in messages:
+        message["_id"] = str(message["_id"])
+    serialized = []
+    for message in messages:
+        copy = {}
+        for key, value in message.items():
+            copy[key] = str(value) if isinstance(value, ObjectId) else value
+        serialized.append(copy)
+    validated = history_adapter.validate_python(serialized)
+    return JSONResponse(jsonable_encoder(validated)).body
+
+
+def lean_read(documents) -> bytes:
+    return dumps(documents)
+
+
+def legacy_write(i: int):
+    message = Message(
+        conversation_id="bench",
+        role="user",
+        content=f"message {i}",
+        created_at=datetime.utcnow(),
+        updated_at=datetime.utcnow(),
+    )
+    return {
+        "_id": ObjectId(),
+        "conversationId": message.conversation_id,
+        "role": message.role,
+        "content": message.content,
+        "createdAt": message.created_at,
+        "updatedAt": message.updated_at,
+    }
+
+
+def lean_write(i: int):
+    now = datetime.utcnow()
+    return {
+        "_id": ObjectId(),
+        "conversationId": "bench",
+        "role": "user",
+        "content": f"message {i}",
+        "createdAt": now,
+        "updatedAt": now,
+    }
+
+
+def per_message_us(fn, *args) -> float:
+    best = float("inf")
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - started)
+    return best * 1e6 / MESSAGES
+
+
+def main():
+    encoder = "orjson" if serialization.orjson is not None else "json"
+    print(f"{MESSAGES} messages, best of {ROUNDS} rounds, encoder {encoder}")
+    print(f"{'path':<22} | {'us/message':>10} | {'total ms':>9}")
+    print("-" * 48)
+    for name, fn, args in (
+        ("read: legacy", legacy_read, (history(MESSAGES),)),
+        ("read: lean", lean_read, (history(MESSAGES),)),
+        ("write: pydantic model", lambda: [legacy_write(i) for i in range(MESSAGES)], ()),
+        ("write: dict", lambda: [lean_write(i) for i in range(MESSAGES)], ()),
+    ):
+        us = per_message_us(fn, *args)
+        print(f"{name:<22} | {us:>10.3f} | {us * MESSAGES / 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
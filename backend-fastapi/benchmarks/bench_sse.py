@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark SSE framing of streamed chat responses.
+
+Reports encoder throughput (frames/sec) and, for a response streamed at a
+realistic token rate, the number of frames and bytes sent per response with
+and without coalescing.
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.utils.sse import encode_event, sse_stream
+
+TOKENS = 300
+TOKEN_INTERVAL = 0.005  # ~200 tokens/sec, a typical hosted model
+THROUGHPUT_FRAMES = 200_000
+
+
+def token(i: int) -> str:
+    return f" word{i % 97}"
+
+
+async def token_events(delay: float):
+    yield {"type": "start", "conversationId": "bench"}
+    for i in range(TOKENS):
+        if delay:
+            await asyncio.sleep(delay)
+        yield {"type": "content", "content": token(i)}
+    yield {"type": "end", "conversationId": "bench", "timestamp": "2024-01-01T00:00:00"}
+
+
+def bench_encoder():
+    print("Encoder throughput")
+    started = time.perf_counter()
+    for i in range(THROUGHPUT_FRAMES):
+        # Previous f-string framing, which did not escape content
+        f"data: {{\"type\": \"content\", \"content\": \"{token(i)}\"}}\n\n".encode("utf-8")
+    legacy = THROUGHPUT_FRAMES / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for i in range(THROUGHPUT_FRAMES):
+        encode_event({"type": "content", "content": token(i)})
+    current = THROUGHPUT_FRAMES / (time.perf_counter() - started)
+
+    print(f"  f-string (unescaped): {legacy:>12,.0f} frames/sec")
+    print(f"  encode_event:         {current:>12,.0f} frames/sec")
+
+
+async def bench_response(window_ms: int):
+    frames = 0
+    size = 0
+    started = time.perf_counter()
+    async for frame in sse_stream(token_events(TOKEN_INTERVAL), window=window_ms / 1000):
+        frames += 1
+        size += len(frame)
+    elapsed = time.perf_counter() - started
+    return frames, size, elapsed
+
+
+async def main():
+    bench_encoder()
+    print()
+    print(f"One response of {TOKENS} tokens at {1 / TOKEN_INTERVAL:.0f} tokens/sec")
+    print(f"{'window':>8} | {'frames':>6} | {'bytes':>7} | {'bytes/frame':>11} | {'seconds':>7}")
+    print("-" * 52)
+    for window_ms in (0, 20, 50):
+        frames, size, elapsed = await bench_response(window_ms)
+        print(f"{window_ms:>6}ms | {frames:>6} | {size:>7} | {size / frames:>11.1f} | {elapsed:>7.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
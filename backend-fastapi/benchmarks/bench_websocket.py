@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Compare per-turn overhead and time to first token of the SSE and WebSocket
+chat endpoints.
+
+Serves the app and the fake OpenAI server on local ports (see loadtest.py),
+with an instant fake model so the numbers are dominated by the transport:
+
+  sse            - one POST /chatbot/message/stream per turn on a keep-alive connection
+  sse+preflight  - the same, preceded by the CORS preflight a cross-origin browser sends
+  ws             - every turn as frames on one /chatbot/ws connection
+
+Turns run one at a time (per-turn latency), then --concurrency conversations
+at once over one connection per client (the SSE client pools connections).
+
+    python benchmarks/bench_websocket.py --turns 300 --concurrency 16
+
+Requires mongomock-motor unless --mongo-uri is given.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import httpx
+from websockets.asyncio.client import connect
+
+from app.config import settings
+from app.main import app
+from app.utils.openai_client import openai_client
+from app.utils.upstreams import build_upstream_pool
+from benchmarks.loadtest import serve, setup_database, summarize
+from tests.fake_openai import FakeOpenAI
+
+ORIGIN = "http://localhost:5173"
+PREFLIGHT_HEADERS = {
+    "Origin": ORIGIN,
+    "Access-Control-Request-Method": "POST",
+    "Access-Control-Request-Headers": "content-type",
+}
+
+
+class SSEClient:
+    def __init__(self, client: httpx.AsyncClient, preflight: bool):
+        self.client = client
+        self.preflight = preflight
+
+    async def turn(self, conversation_id: str, message: str):
+        """Run one turn; returns (time to first token, total time)"""
+        started = time.perf_counter()
+        first_token = None
+        if self.preflight:
+            await self.client.options("/chatbot/message/stream", headers=PREFLIGHT_HEADERS)
+        payload = {"conversationId": conversation_id, "message": message}
+        async with self.client.stream(
+            "POST", "/chatbot/message/stream", json=payload,
+            params={"coalesce_ms": 0}, headers={"Origin": ORIGIN},
+        ) as response:
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                event_type = json.loads(line[5:]).get("type")
+                if event_type == "content" and first_token is None:
+                    first_token = time.perf_counter() - started
+                elif event_type in ("end", "error"):
+                    break
+        return first_token, time.perf_counter() - started
+
+
+class WebSocketClient:
+    """Turns multiplexed on one connection; a reader task routes frames by conversation"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.waiting = {}
+        self.reader = asyncio.ensure_future(self._read())
+
+    async def _read(self):
+        async for text in self.connection:
+            frame = json.loads(text)
+            queue = self.waiting.get(frame.get("conversationId"))
+            if queue is not None:
+                queue.put_nowait(frame)
+
+    async def turn(self, conversation_id: str, message: str):
+        queue = self.waiting[conversation_id] = asyncio.Queue()
+        started = time.perf_counter()
+        first_token = None
+        await self.connection.send(json.dumps(
+            {"type": "message", "conversationId": conversation_id, "message": message}
+        ))
+        try:
+            while True:
+                frame = await queue.get()
+                if frame["type"] == "content" and first_token is None:
+                    first_token = time.perf_counter() - started
+                elif frame["type"] in ("end", "error"):
+                    break
+        finally:
+            del self.waiting[conversation_id]
+        return first_token, time.perf_counter() - started
+
+    async def close(self):
+        self.reader.cancel()
+        await self.connection.close()
+
+
+async def run_turns(client, turns: int, concurrency: int, prefix: str):
+    first_tokens, totals = [], []
+    counter = itertools.count()
+
+    async def worker(slot: int):
+        # One conversation per worker, so its turns never queue behind each other
+        while True:
+            index = next(counter)
+            if index >= turns:
+                return
+            first_token, total = await client.turn(f"{prefix}-{slot}", f"question {index}")
+            if first_token is not None:
+                first_tokens.append(first_token)
+            totals.append(total)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(slot) for slot in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "turnsPerSecond": round(turns / elapsed, 1),
+        "ttftMs": summarize(first_tokens),
+        "turnMs": summarize(totals),
+    }
+
+
+def print_row(name: str, result):
+    ttft, turn = result["ttftMs"], result["turnMs"]
+    print(
+        f"{name:<15} | {result['turnsPerSecond']:>8.1f} | {ttft['p50'] or 0:>9.2f} | {ttft['p95'] or 0:>9.2f} | "
+        f"{turn['p50'] or 0:>9.2f} | {turn['p95'] or 0:>9.2f}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200, help="turns per transport and mode")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mongo-uri", help="use this MongoDB instead of mongomock-motor")
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(reply="A short deterministic answer from the fake model.")
+    fake_server, fake_task, fake_url = await serve(fake.app)
+    settings.OPENAI_BASE_URL = f"{fake_url}/v1"
+    settings.OPENAI_UPSTREAMS = []
+    openai_client.pool = build_upstream_pool(settings)
+    await setup_database(args.mongo_uri, 0, 0)
+    app_server, app_task, app_url = await serve(app)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=60) as http_client:
+            connection = await connect(app_url.replace("http://", "ws://") + "/chatbot/ws?coalesce_ms=0")
+            ws_client = WebSocketClient(connection)
+            clients = {
+                "sse": SSEClient(http_client, preflight=False),
+                "sse+preflight": SSEClient(http_client, preflight=True),
+                "ws": ws_client,
+            }
+            for concurrency in (1, args.concurrency):
+                print(f"\n{args.turns} turns, {concurrency} at a time")
+                print(f"{'transport':<15} | {'turns/s':>8} | {'ttft p50':>9} | {'ttft p95':>9} | {'turn p50':>9} | {'turn p95':>9}")
+                print("-" * 73)
+                for name, client in clients.items():
+                    # Warm up connections and code paths first
+                    await run_turns(client, concurrency, concurrency, f"warmup-{name}")
+                    print_row(name, await run_turns(client, args.turns, concurrency, f"{name}-{concurrency}"))
+            await ws_client.close()
+    finally:
+        for server, task in ((app_server, app_task), (fake_server, fake_task)):
+            server.should_exit = True
+            await task
+    print("\nLatencies in ms. The client shares the event loop with both servers; compare rows, not absolutes.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Load test of the production server at increasing worker counts.
+
+Starts `start.py --prod --workers N` for each N, drives it with a fixed number
+of concurrent clients for a fixed time, and reports requests/sec, latency
+percentiles and the speedup over one worker.
+
+    python benchmarks/bench_workers.py --workers 1 2 4 --concurrency 64
+    python benchmarks/bench_workers.py --endpoint message   # needs MongoDB at MONGODB_URI
+
+The `message` endpoint is served against the fake OpenAI server from
+tests/fake_openai.py, started on its own port, so no API key is spent.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+
+def start_process(args, env):
+    return subprocess.Popen(
+        args, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+async def wait_until_ready(url: str, timeout: float = 90.0):
+    # Startup waits for MongoDB server selection before it accepts requests
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+async def load(base_url: str, endpoint: str, concurrency: int, duration: float):
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async def client_loop(client: httpx.AsyncClient, index: int):
+        nonlocal errors
+        turn = 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                if endpoint == "message":
+                    response = await client.post(
+                        "/chatbot/message",
+                        json={"message": f"hello {turn}", "conversationId": f"load-{index}"},
+                    )
+                else:
+                    response = await client.get("/chatbot/health")
+                if response.status_code != 200:
+                    errors += 1
+                    continue
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            turn += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        started = time.monotonic()
+        await asyncio.gather(*(client_loop(client, i) for i in range(concurrency)))
+        elapsed = time.monotonic() - started
+    return latencies, errors, elapsed
+
+
+def percentile(values, q: float) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100)[int(q) - 1]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--endpoint", choices=["health", "message"], default="health")
+    parser.add_argument("--port", type=int, default=8300)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "bench")
+    fake = None
+    if args.endpoint == "message":
+        fake_port = args.port + 1
+        fake = start_process(
+            [sys.executable, "-m", "uvicorn", "tests.fake_openai:app", "--port", str(fake_port),
+             "--no-access-log"],
+            env,
+        )
+        env["OPENAI_BASE_URL"] = f"http://127.0.0.1:{fake_port}/v1"
+
+    print(f"{os.cpu_count()} CPUs, {args.concurrency} concurrent clients, "
+          f"{args.duration:.0f}s per run, endpoint {args.endpoint}")
+    print(f"{'workers':>7} | {'req/s':>9} | {'p50 ms':>7} | {'p95 ms':>7} | {'p99 ms':>7} | {'errors':>6} | {'speedup':>7}")
+    print("-" * 66)
+    baseline = None
+    try:
+        for workers in args.workers:
+            server = start_process(
+                [sys.executable, "start.py", "--prod", "--workers", str(workers)],
+                {**env, "PORT": str(args.port), "HOST": "127.0.0.1"},
+            )
+            try:
+                base_url = f"http://127.0.0.1:{args.port}"
+                await wait_until_ready(base_url + "/chatbot/health")
+                latencies, errors, elapsed = await load(base_url, args.endpoint, args.concurrency, args.duration)
+            finally:
+                server.terminate()
+                server.wait()
+            rps = len(latencies) / elapsed
+            baseline = baseline or rps
+            ms = [latency * 1000 for latency in latencies]
+            print(f"{workers:>7} | {rps:>9,.0f} | {percentile(ms, 50):>7.1f} | {percentile(ms, 95):>7.1f} | "
+                  f"{percentile(ms, 99):>7.1f} | {errors:>6} | {rps / baseline:>6.2f}x")
+    finally:
+        if fake is not None:
+            fake.terminate()
+            fake.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
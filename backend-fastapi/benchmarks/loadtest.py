@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Load test of the chatbot API against a fake LLM and an in-memory MongoDB.
+
+Serves the FastAPI app and the deterministic fake OpenAI server from
+tests/fake_openai.py on local ports inside this process, seeds a
+mongomock-motor database (or a real mongod with --mongo-uri), and drives each
+endpoint at the given concurrency ("revalidate" repeats history reads with
+If-None-Match, so it measures 304 responses). For every endpoint it reports requests/sec
+and p50/p95/p99 latency, plus time to first token for the streaming endpoint.
+
+    python benchmarks/loadtest.py --concurrency 32 --requests 500
+    python benchmarks/loadtest.py --mongo-uri mongodb://localhost:27017/chatbot_bench
+    python benchmarks/loadtest.py --compare benchmarks/results/loadtest-abc1234.json
+
+Results are written as JSON (by default to benchmarks/results/loadtest-<commit>.json)
+so runs on different commits can be compared with --compare.
+
+The load generator shares the event loop with both servers, so absolute
+numbers include client overhead; compare runs made with the same options.
+Requires mongomock-motor unless --mongo-uri is given.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import httpx
+import uvicorn
+
+from app.config import settings
+from app.database import connection
+from app.database.indexes import ensure_indexes
+from app.chatbot.summaries import rebuild_conversation_summaries
+from app.main import app
+from app.utils.openai_client import openai_client
+from app.utils.upstreams import build_upstream_pool
+from tests.fake_openai import FakeOpenAI
+
+ENDPOINTS = ["message", "stream", "history", "revalidate", "conversations"]
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(__file__), text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def summarize(values):
+    """Percentiles in milliseconds"""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    ms = sorted(value * 1000 for value in values)
+    if len(ms) == 1:
+        cuts = ms * 99
+    else:
+        cuts = statistics.quantiles(ms, n=100, method="inclusive")
+    return {
+        "p50": round(cuts[49], 3),
+        "p95": round(cuts[94], 3),
+        "p99": round(cuts[98], 3),
+        "mean": round(statistics.fmean(ms), 3),
+    }
+
+
+async def serve(asgi_app):
+    """Start an ASGI app on a free local port in this event loop; returns the server, its task and URL"""
+    config = uvicorn.Config(asgi_app, host="127.0.0.1", port=0, lifespan="off", log_level="warning")
+    server = uvicorn.Server(config)
+    task = asyncio.ensure_future(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, f"http://127.0.0.1:{port}"
+
+
+async def setup_database(mongo_uri, conversations: int, messages: int):
+    """Point the app at the database and seed conversations with history"""
+    if mongo_uri:
+        await connection.connect_to_mongo(mongo_uri)
+        db = connection.get_database()
+        await db["messages"].delete_many({})
+        await ensure_indexes(db)
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        db = AsyncMongoMockClient()["chatbot_bench"]
+        connection.database = db
+
+    start = datetime.utcnow() - timedelta(days=1)
+    documents = [
+        {
+            "conversationId": f"seed-{c}",
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"Seeded message {i} of conversation {c}. " * 3,
+            "createdAt": start + timedelta(seconds=c * messages + i),
+            "updatedAt": start + timedelta(seconds=c * messages + i),
+        }
+        for c in range(conversations)
+        for i in range(messages)
+    ]
+    if documents:
+        await db["messages"].insert_many(documents)
+    await rebuild_conversation_summaries(db)
+    return db
+
+
+async def run_endpoint(client: httpx.AsyncClient, endpoint: str, concurrency: int, total: int, conversations: int):
+    latencies, first_tokens = [], []
+    first_tokens_seen = [False] * total
+    errors = 0
+    issued = 0
+    etags = {}
+
+    async def one(index: int):
+        nonlocal errors
+        payload = {"message": f"benchmark question {index}", "conversationId": f"load-{index % concurrency}"}
+        started = time.perf_counter()
+        try:
+            if endpoint == "message":
+                response = await client.post("/chatbot/message", json=payload)
+                ok = response.status_code == 200
+            elif endpoint == "stream":
+                ok = False
+                async with client.stream(
+                    "POST", "/chatbot/message/stream", json=payload, params={"coalesce_ms": 0}
+                ) as response:
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        event_type = json.loads(line[5:]).get("type")
+                        if event_type == "content" and not first_tokens_seen[index]:
+                            first_tokens_seen[index] = True
+                            first_tokens.append(time.perf_counter() - started)
+                        elif event_type == "end":
+                            ok = True
+            elif endpoint == "history":
+                response = await client.get(f"/chatbot/history/seed-{index % max(conversations, 1)}")
+                ok = response.status_code == 200
+            elif endpoint == "revalidate":
+                # Conditional history reads; all but the first per conversation should be 304s
+                path = f"/chatbot/history/seed-{index % max(conversations, 1)}"
+                headers = {"If-None-Match": etags[path]} if path in etags else {}
+                response = await client.get(path, headers=headers)
+                ok = response.status_code in (200, 304)
+                etags[path] = response.headers.get("etag", "")
+            else:
+                response = await client.get("/chatbot/conversations", params={"limit": 50})
+                ok = response.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - started)
+        else:
+            errors += 1
+
+    async def worker():
+        nonlocal issued
+        while issued < total:
+            index = issued
+            issued += 1
+            await one(index)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    result = {
+        "requests": total,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2),
+        "latencyMs": summarize(latencies),
+    }
+    if endpoint == "stream":
+        result["ttftMs"] = summarize(first_tokens)
+    return result
+
+
+def print_results(results, baseline=None):
+    print(f"{'endpoint':<14} | {'req/s':>8} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'ttft p50':>8} | {'errors':>6}")
+    print("-" * 78)
+    for endpoint, result in results.items():
+        latency = result["latencyMs"]
+        ttft = result.get("ttftMs", {}).get("p50")
+        print(
+            f"{endpoint:<14} | {result['rps']:>8.1f} | {latency['p50'] or 0:>8.2f} | {latency['p95'] or 0:>8.2f} | "
+            f"{latency['p99'] or 0:>8.2f} | {ttft if ttft is not None else '-':>8} | {result['errors']:>6}"
+        )
+        if baseline and endpoint in baseline:
+            before = baseline[endpoint]
+            change = lambda new, old: f"{(new - old) / old * 100:+.1f}%" if new and old else "n/a"
+            print(
+                f"{'  vs baseline':<14} | {change(result['rps'], before['rps']):>8} | "
+                f"{change(latency['p50'], before['latencyMs']['p50']):>8} | "
+                f"{change(latency['p95'], before['latencyMs']['p95']):>8} | "
+                f"{change(latency['p99'], before['latencyMs']['p99']):>8} |"
+            )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--conversations", type=int, default=50, help="seeded conversations")
+    parser.add_argument("--messages", type=int, default=40, help="seeded messages per conversation")
+    parser.add_argument("--llm-latency-ms", type=float, default=50, help="fake LLM delay before the first token")
+    parser.add_argument("--token-delay-ms", type=float, default=5, help="fake LLM delay between tokens")
+    parser.add_argument("--mongo-uri", help="use this MongoDB instead of mongomock-motor")
+    parser.add_argument("--output", help="where to write the JSON results")
+    parser.add_argument("--compare", help="a previous JSON result to compare against")
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(
+        reply="Here is a deterministic answer from the fake model with a few dozen tokens " * 2,
+        latency=args.llm_latency_ms / 1000,
+        token_delay=args.token_delay_ms / 1000,
+    )
+    fake_server, fake_task, fake_url = await serve(fake.app)
+    settings.OPENAI_BASE_URL = f"{fake_url}/v1"
+    settings.OPENAI_UPSTREAMS = []
+    openai_client.pool = build_upstream_pool(settings)
+
+    await setup_database(args.mongo_uri, args.conversations, args.messages)
+    app_server, app_task, app_url = await serve(app)
+
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=60) as client:
+            for endpoint in args.endpoints:
+                results[endpoint] = await run_endpoint(
+                    client, endpoint, args.concurrency, args.requests, args.conversations
+                )
+    finally:
+        for server, task in ((app_server, app_task), (fake_server, fake_task)):
+            server.should_exit = True
+            await task
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "mongo": "mongod" if args.mongo_uri else "mongomock",
+        "upstreamRequests": fake.requests,
+        "results": results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print(f"commit {commit}, concurrency {args.concurrency}, {args.requests} requests per endpoint, {report['mongo']}")
+    print_results(results, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"loadtest-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
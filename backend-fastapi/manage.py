@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Maintenance commands for the FastAPI chatbot backend.
+
+Usage:
+    python manage.py ensure-indexes
+    python manage.py explain <conversation_id>
+    python manage.py rebuild-conversations
+    python manage.py compact <conversation_id>
+"""
+
+import argparse
+import asyncio
+import json
+from dotenv import load_dotenv
+
+
+async def run(args):
+    from app.config import settings
+    from app.database.connection import connect_to_mongo, close_mongo_connection, get_database
+    from app.database.indexes import ensure_indexes, explain_queries
+    from app.chatbot.summaries import rebuild_conversation_summaries
+    from app.chatbot.service import get_chatbot_service
+
+    await connect_to_mongo(settings.MONGODB_URI)
+    try:
+        db = get_database()
+        if args.command == "ensure-indexes":
+            await ensure_indexes(db)
+        elif args.command == "explain":
+            report = await explain_queries(db, args.conversation_id)
+            print(json.dumps(report, indent=2))
+        elif args.command == "rebuild-conversations":
+            await rebuild_conversation_summaries(db)
+        elif args.command == "compact":
+            chatbot_service = get_chatbot_service()
+            chatbot_service._ensure_collection()
+            compacted = await chatbot_service.compactor.compact(args.conversation_id)
+            print("Compacted" if compacted else "Below the compaction threshold, nothing to do")
+    finally:
+        await close_mongo_connection()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chatbot backend maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("ensure-indexes", help="Create the messages indexes")
+
+    explain_parser = subparsers.add_parser(
+        "explain", help="Show which indexes the history and listing queries use"
+    )
+    explain_parser.add_argument("conversation_id")
+
+    subparsers.add_parser(
+        "rebuild-conversations",
+        help="Recompute the conversation summaries from all messages (stop the app first)",
+    )
+
+    compact_parser = subparsers.add_parser(
+        "compact", help="Summarize a conversation's old turns now if it is over the threshold"
+    )
+    compact_parser.add_argument("conversation_id")
+
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    # Load environment variables before settings are imported
+    load_dotenv()
+    main()
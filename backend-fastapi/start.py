@@ -1,28 +1,32 @@
 #!/usr/bin/env python3
 """
 Startup script for the FastAPI chatbot backend.
+
+    python start.py           development server, reloads when DEBUG is true
+    python start.py --prod    production server, one worker per CPU
 """
 
-import uvicorn
+import argparse
 import os
 from dotenv import load_dotenv
 
 if __name__ == "__main__":
     # Load environment variables
     load_dotenv()
-    
-    # Get configuration from environment
-    host = os.getenv("HOST", "0.0.0.0")
-    port = int(os.getenv("PORT", 3000))
-    debug = os.getenv("DEBUG", "True").lower() == "true"
-    
-    print(f"Starting FastAPI server on {host}:{port}")
-    print(f"Debug mode: {debug}")
-    
+
+    parser = argparse.ArgumentParser(description="Start the chatbot backend")
+    parser.add_argument("--prod", action="store_true", help="run in production mode")
+    parser.add_argument("--workers", type=int, help="worker processes in production mode")
+    args = parser.parse_args()
+
+    from app.config import Settings
+    from app.server import run
+
+    settings = Settings()
+    if args.workers:
+        settings.WORKERS = args.workers
+    production = args.prod or settings.ENVIRONMENT == "production"
+    print(f"Debug mode: {settings.DEBUG}")
+
     # Run the application
-    uvicorn.run(
-        "app.main:app",
-        host=host,
-        port=port,
-        reload=debug
-    )
\ No newline at end of file
+    run(settings, production, host=os.getenv("HOST", "0.0.0.0"))
@@ -0,0 +1,51 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+
+from app.chatbot import service as service_module
+from app.chatbot.service import ChatbotService
+
+
+class FakeOpenAIClient:
+    def __init__(self):
+        self.calls = 0
+        self.closed_streams = 0
+
+    async def create_chat_completion(self, messages, stream=False):
+        self.calls += 1
+        reply = f"reply to {messages[-1]['content']}"
+        if stream:
+            return self._stream(reply.split(" "))
+        await asyncio.sleep(0.01)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+
+    async def _stream(self, words):
+        try:
+            for i, word in enumerate(words):
+                delta = SimpleNamespace(content=word if i == 0 else f" {word}")
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+                await asyncio.sleep(0.01)
+        finally:
+            self.closed_streams += 1
+
+
+@pytest.fixture
+def db():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return mongomock_motor.AsyncMongoMockClient()["chatbot_test"]
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    fake = FakeOpenAIClient()
+    monkeypatch.setattr(service_module, "openai_client", fake)
+    return fake
+
+
+@pytest.fixture
+def chatbot_service(db, fake_openai):
+    chatbot_service = ChatbotService()
+    chatbot_service.messages_collection = db["messages"]
+    chatbot_service.conversations_collection = db["conversations"]
+    chatbot_service.compactions_collection = db["conversation_compactions"]
+    return chatbot_service
@@ -0,0 +1,113 @@
+"""
+Deterministic OpenAI-compatible chat completions server for tests and benchmarks.
+
+Serve it in-process with httpx.ASGITransport, or on a port with uvicorn:
+
+    uvicorn tests.fake_openai:app --port 9000
+"""
+
+import asyncio
+import json
+import time
+from typing import List, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class FakeOpenAI:
+    def __init__(
+        self,
+        reply: str = "Hello from the fake model, happy to help with that.",
+        latency: float = 0.0,
+        token_delay: float = 0.0,
+        fail_statuses: Optional[List[int]] = None,
+        retry_after: Optional[float] = None,
+    ):
+        self.reply = reply
+        # Delay before the first byte, and between streamed tokens
+        self.latency = latency
+        self.token_delay = token_delay
+        # Statuses returned by the first requests, one per request, before succeeding
+        self.fail_statuses = list(fail_statuses or [])
+        self.retry_after = retry_after
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.app = self._build_app()
+
+    def tokens(self) -> List[str]:
+        words = self.reply.split(" ")
+        return [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.post("/v1/chat/completions")
+        async def chat_completions(request: Request):
+            body = await request.json()
+            self.requests += 1
+            if self.fail_statuses:
+                status = self.fail_statuses.pop(0)
+                headers = {"retry-after": str(self.retry_after)} if self.retry_after is not None else {}
+                return JSONResponse(
+                    {"error": {"message": f"injected {status}", "type": "fake_error"}},
+                    status_code=status,
+                    headers=headers,
+                )
+
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+            finally:
+                if not body.get("stream"):
+                    self.in_flight -= 1
+
+            model = body.get("model", "fake-model")
+            created = int(time.time())
+            if not body.get("stream"):
+                return {
+                    "id": f"chatcmpl-fake-{self.requests}",
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": self.reply},
+                    }],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": len(self.tokens()), "total_tokens": 0},
+                }
+
+            async def events():
+                try:
+                    for token in self.tokens():
+                        if self.token_delay:
+                            await asyncio.sleep(self.token_delay)
+                        chunk = {
+                            "id": f"chatcmpl-fake-{self.requests}",
+                            "object": "chat.completion.chunk",
+                            "created": created,
+                            "model": model,
+                            "choices": [{"index": 0, "finish_reason": None, "delta": {"content": token}}],
+                        }
+                        yield f"data: {json.dumps(chunk)}\n\n"
+                    final = {
+                        "id": f"chatcmpl-fake-{self.requests}",
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}],
+                    }
+                    yield f"data: {json.dumps(final)}\n\n"
+                    yield "data: [DONE]\n\n"
+                finally:
+                    self.in_flight -= 1
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        return app
+
+
+app = FakeOpenAI(token_delay=0.01).app
@@ -26,4 +26,16 @@ def test_conversation_endpoints_validation():
 
     # Test delete with invalid conversation ID
     response = client.post("/chatbot/conversations//delete")
-    assert response.status_code == 404  # Not found
\ No newline at end of file
+    assert response.status_code == 404  # Not found
+
+
+def test_pagination_validation():
+    """Test pagination parameter validation"""
+    response = client.get("/chatbot/conversations?limit=0")
+    assert response.status_code == 422
+
+    response = client.get("/chatbot/conversations?limit=10&cursor=not-a-cursor")
+    assert response.status_code == 400
+
+    response = client.get("/chatbot/history/abc?cursor=not-a-cursor")
+    assert response.status_code == 400
@@ -0,0 +1,144 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from bson import ObjectId
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from app.chatbot.compaction import Compactor
+from app.chatbot.summaries import rebuild_conversation_summaries
+from app.chatbot.service import ChatbotService
+
+
+def seed(db, conversation_id, count):
+    start = datetime(2024, 1, 1)
+    documents = [
+        {
+            "_id": ObjectId(),
+            "conversationId": conversation_id,
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"message {i}",
+            "createdAt": start + timedelta(seconds=i),
+        }
+        for i in range(count)
+    ]
+    asyncio.run(db["messages"].insert_many(documents))
+    return documents
+
+
+def make_compactor(db, keep_originals=True, max_tokens=3000):
+    prompts = []
+
+    async def summarize(prompt):
+        prompts.append(prompt)
+        return f"summary {len(prompts)}"
+
+    compactor = Compactor(
+        db["messages"], db["conversation_compactions"], summarize,
+        threshold=10, keep_recent=4, keep_originals=keep_originals,
+        conversations_collection=db["conversations"], max_tokens=max_tokens,
+    )
+    return compactor, prompts
+
+
+@pytest.fixture
+def db():
+    return mongomock_motor.AsyncMongoMockClient()["compaction_test"]
+
+
+def test_compaction_summarizes_old_turns_once(db):
+    """Test that compaction covers all but the recent tail and is idempotent"""
+    documents = seed(db, "long", 30)
+    compactor, prompts = make_compactor(db)
+
+    assert asyncio.run(compactor.compact("long")) is True
+    compaction = asyncio.run(compactor.get_compaction("long"))
+    assert compaction["summary"] == "summary 1"
+    assert compaction["throughId"] == documents[25]["_id"]
+    assert compaction["compactedCount"] == 26
+    assert "message 25" in prompts[0][-1]["content"]
+    assert "message 26" not in prompts[0][-1]["content"]
+
+    # Nothing new past the threshold: running again changes nothing
+    assert asyncio.run(compactor.compact("long")) is False
+    assert len(prompts) == 1
+    assert asyncio.run(db["messages"].count_documents({"conversationId": "long"})) == 30
+
+    # The next round folds the previous summary in
+    seed_more = [
+        {"_id": ObjectId(), "conversationId": "long", "role": "user", "content": f"later {i}",
+         "createdAt": datetime(2024, 1, 2) + timedelta(seconds=i)}
+        for i in range(10)
+    ]
+    asyncio.run(db["messages"].insert_many(seed_more))
+    assert asyncio.run(compactor.compact("long")) is True
+    assert "summary 1" in prompts[1][1]["content"]
+    assert asyncio.run(compactor.get_compaction("long"))["compactedCount"] == 36
+
+
+def test_compaction_can_delete_originals(db):
+    """Test that summarized messages are removed when originals are not kept"""
+    seed(db, "short-lived", 12)
+    asyncio.run(rebuild_conversation_summaries(db))
+    compactor, _ = make_compactor(db, keep_originals=False)
+    assert asyncio.run(compactor.compact("short-lived")) is True
+    remaining = asyncio.run(db["messages"].find({}).sort("createdAt", 1).to_list(None))
+    assert [m["content"] for m in remaining] == [f"message {i}" for i in range(8, 12)]
+    # The history changed, so its version did too
+    summary = asyncio.run(db["conversations"].find_one({"conversationId": "short-lived"}))
+    assert summary["version"] == 13
+    assert summary["messageCount"] == 4
+
+
+def test_compaction_folds_long_backlogs_in_chunks(db):
+    """Test that old turns beyond one prompt's budget are folded chunk by chunk"""
+    documents = seed(db, "backlog", 40)
+    asyncio.run(rebuild_conversation_summaries(db))
+    compactor, prompts = make_compactor(db, keep_originals=False, max_tokens=150)
+    counter = compactor.token_counter
+
+    assert asyncio.run(compactor.compact("backlog")) is True
+    assert len(prompts) > 1
+    for prompt in prompts:
+        assert sum(counter.count_message(message) for message in prompt) <= 150
+    # Each chunk builds on the summary of the one before
+    for i, prompt in enumerate(prompts[1:], start=1):
+        assert f"summary {i}" in prompt[1]["content"]
+
+    compaction = asyncio.run(compactor.get_compaction("backlog"))
+    assert compaction["summary"] == f"summary {len(prompts)}"
+    assert compaction["throughId"] == documents[35]["_id"]
+    assert compaction["compactedCount"] == 36
+    assert compactor.stats()["chunks"] == len(prompts)
+    summary = asyncio.run(db["conversations"].find_one({"conversationId": "backlog"}))
+    assert summary["messageCount"] == 4
+    assert asyncio.run(db["messages"].count_documents({"conversationId": "backlog"})) == 4
+
+
+def test_queue_is_bounded_and_prompt_uses_summary(db, monkeypatch):
+    """Test that jobs run off the request path and prompts use summary plus tail"""
+    from app.config import settings
+
+    seed(db, "chatty", 30)
+    service = ChatbotService()
+    service.messages_collection = db["messages"]
+    service.conversations_collection = db["conversations"]
+    service.compactions_collection = db["conversation_compactions"]
+    service._ensure_collection()
+    service.compactor, _ = make_compactor(db)
+    service.compactor.queue_size = 1
+    monkeypatch.setattr(settings, "COMPACTION_ENABLED", True)
+
+    async def scenario():
+        service._schedule_compaction("chatty")
+        service._schedule_compaction("chatty")  # already queued
+        service._schedule_compaction("other")  # queue full, dropped
+        await service.compactor.join()
+        prompt = await service.build_prompt("chatty")
+        await service.close()
+        return prompt
+
+    prompt = asyncio.run(scenario())
+    assert service.compactor.stats()["dropped"] == 1
+    assert prompt[1] == {"role": "system", "content": "Summary of the earlier conversation: summary 1"}
+    assert [m["content"] for m in prompt[2:]] == [f"message {i}" for i in range(26, 30)]
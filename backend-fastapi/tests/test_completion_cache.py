@@ -0,0 +1,119 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+from app.utils.openai_client import OpenAIClient
+from app.utils.completion_cache import CompletionCache
+
+
+def make_chunk(content, finish_reason=None):
+    delta = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=finish_reason)])
+
+
+class CountingUpstream:
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, messages, stream=False):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if stream:
+            async def chunks():
+                for piece in ["Hel", "lo", "!"]:
+                    await asyncio.sleep(0.001)
+                    yield make_chunk(piece)
+                yield make_chunk(None, "stop")
+            return chunks()
+        message = SimpleNamespace(content="Hello!")
+        return SimpleNamespace(model="fake", choices=[SimpleNamespace(message=message, finish_reason="stop")])
+
+
+def make_client(directory=None):
+    client = OpenAIClient()
+    client.cache = CompletionCache(max_entries=10, ttl=60, directory=directory)
+    client._create = CountingUpstream()
+    return client
+
+
+async def collect(stream):
+    return "".join([chunk.choices[0].delta.content or "" async for chunk in stream])
+
+
+def test_identical_requests_share_one_upstream_call():
+    """Test that concurrent identical completions are coalesced and then cached"""
+    client = make_client()
+    messages = [{"role": "user", "content": "hi"}]
+
+    async def scenario():
+        results = await asyncio.gather(*[client.create_chat_completion(messages) for _ in range(5)])
+        assert {r.choices[0].message.content for r in results} == {"Hello!"}
+        cached = await client.create_chat_completion(messages)
+        assert cached.choices[0].message.content == "Hello!"
+
+    asyncio.run(scenario())
+    assert client._create.calls == 1
+
+
+def test_streams_are_coalesced_and_replayed():
+    """Test that concurrent identical streams share one upstream stream and later ones replay it"""
+    client = make_client()
+    messages = [{"role": "user", "content": "stream"}]
+
+    async def scenario():
+        streams = [await client.create_chat_completion(messages, stream=True) for _ in range(3)]
+        outputs = await asyncio.gather(*[collect(stream) for stream in streams])
+        assert outputs == ["Hello!"] * 3
+        await asyncio.sleep(0)
+        replayed = await collect(await client.create_chat_completion(messages, stream=True))
+        assert replayed == "Hello!"
+        # A streamed completion also answers the non-streaming path
+        completion = await client.create_chat_completion(messages)
+        assert completion.choices[0].message.content == "Hello!"
+
+    asyncio.run(scenario())
+    assert client._create.calls == 1
+
+
+def test_disk_backend_survives_restart(tmp_path):
+    """Test that completions are served from the on-disk cache by a new client"""
+    messages = [{"role": "user", "content": "persist"}]
+    first = make_client(str(tmp_path))
+    asyncio.run(first.create_chat_completion(messages))
+
+    second = make_client(str(tmp_path))
+    completion = asyncio.run(second.create_chat_completion(messages))
+    assert completion.choices[0].message.content == "Hello!"
+    assert second._create.calls == 0
+
+
+def test_disk_backend_evicts_expired_and_oldest_files(tmp_path):
+    """Test that writes sweep expired files and keep the directory under its size cap"""
+    cache = CompletionCache(max_entries=10, ttl=60, directory=str(tmp_path), max_bytes=300)
+    entry = {"model": "fake", "deltas": ["x" * 50], "finishReason": "stop"}
+    now = time.time()
+    for i, age in enumerate([120, 30, 20, 10]):
+        path = os.path.join(str(tmp_path), f"old{i}.json")
+        with open(path, "w") as file:
+            file.write('{"model": "fake", "deltas": ["' + "x" * 50 + '"]}')
+        os.utime(path, (now - age, now - age))
+    stray = os.path.join(str(tmp_path), "stray.json.1.tmp")
+    open(stray, "w").close()
+    os.utime(stray, (now - 120, now - 120))
+
+    asyncio.run(cache.set("new", entry))
+    # old0 and the temporary file expired; old1 is the oldest of what is left over the cap
+    assert sorted(os.listdir(str(tmp_path))) == ["new.json", "old2.json", "old3.json"]
+    assert cache.stats()["evictedFiles"] == 3
+
+
+def test_cache_is_off_for_a_pool_of_different_models(monkeypatch):
+    """Test that replies are not cached when the answering model depends on routing"""
+    from app.config import settings
+    from app.utils.upstreams import Upstream, UpstreamPool
+
+    monkeypatch.setattr(settings, "COMPLETION_CACHE_ENABLED", True)
+    mixed = UpstreamPool([Upstream("a", None, "model-a"), Upstream("b", None, "model-b")])
+    assert OpenAIClient(pool=mixed).cache is None
+    same = UpstreamPool([Upstream("a", None, "model-a"), Upstream("b", None, "model-a")])
+    assert OpenAIClient(pool=same).cache is not None
@@ -0,0 +1,44 @@
+from app.chatbot.context import TokenCounter, build_context, SYSTEM_PROMPT
+
+counter = TokenCounter("gpt-3.5-turbo")
+
+def make_history(count):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"message number {i} " * 10}
+        for i in range(count)
+    ]
+
+def test_build_context_keeps_newest_messages_within_budget():
+    """Test that only the newest messages that fit the budget are kept"""
+    history = make_history(200)
+    messages = build_context(history, max_tokens=500, counter=counter)
+    assert messages[0] == {"role": "system", "content": SYSTEM_PROMPT}
+    assert messages[-1]["content"] == history[-1]["content"]
+    assert 1 < len(messages) < len(history)
+    assert sum(counter.count_message(m) for m in messages) <= 500
+    # Kept messages are the contiguous tail, in chronological order
+    tail = history[-(len(messages) - 1):]
+    assert [m["content"] for m in messages[1:]] == [m["content"] for m in tail]
+
+def test_build_context_always_keeps_latest_message():
+    """Test that the latest message is kept even when it exceeds the budget"""
+    history = [{"role": "user", "content": "word " * 2000}]
+    messages = build_context(history, max_tokens=100, counter=counter)
+    assert len(messages) == 2
+    assert messages[1]["content"] == history[0]["content"]
+
+def test_slow_encoding_load_falls_back_to_estimates(monkeypatch):
+    """Test that a tokenizer download that hangs does not block startup"""
+    import asyncio
+    import time
+    from app.chatbot import context
+
+    def slow_encoder(model):
+        time.sleep(1)
+        return lambda text: [0]
+
+    monkeypatch.setattr(context, "tiktoken", object())
+    monkeypatch.setattr(context, "_get_encoder", slow_encoder)
+    slow = TokenCounter("gpt-3.5-turbo")
+    assert asyncio.run(slow.load(timeout=0.05)) is False
+    assert slow.count_text("x" * 40) == 10
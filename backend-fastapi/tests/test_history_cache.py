@@ -0,0 +1,68 @@
+from app.chatbot.history_cache import HistoryCache
+
+def message(i):
+    return {"_id": i, "role": "user", "content": f"message {i}"}
+
+def test_history_cache_hits_after_fill_and_appends():
+    """Test that a filled entry serves reads and follows writes"""
+    cache = HistoryCache(max_conversations=10, ttl=60)
+    assert cache.get("a", 3) is None
+
+    token = cache.begin_load("a")
+    cache.put("a", [message(0), message(1)], 3, token)
+    cache.append("a", message(2))
+    cache.append("a", message(3))
+
+    assert [m["_id"] for m in cache.get("a", 3)] == [1, 2, 3]
+    # Requests for more than the entry holds are misses
+    assert cache.get("a", 4) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+def test_history_cache_discards_stale_fill():
+    """Test that a fill racing with a write or an invalidation is not stored"""
+    cache = HistoryCache(max_conversations=10, ttl=60)
+    token = cache.begin_load("a")
+    cache.append("a", message(1))
+    cache.put("a", [message(0)], 5, token)
+    assert cache.get("a", 1) is None
+
+    token = cache.begin_load("a")
+    cache.invalidate("a")
+    cache.put("a", [message(0)], 5, token)
+    assert cache.get("a", 1) is None
+
+def test_history_cache_evicts_least_recently_used():
+    """Test LRU eviction and TTL expiry"""
+    cache = HistoryCache(max_conversations=2, ttl=60)
+    for conversation_id in ("a", "b"):
+        cache.put(conversation_id, [message(0)], 5, cache.begin_load(conversation_id))
+    cache.get("a", 1)
+    cache.put("c", [message(0)], 5, cache.begin_load("c"))
+    assert cache.get("b", 1) is None
+    assert cache.get("a", 1) is not None
+    assert cache.stats()["evictions"] == 1
+
+    expired = HistoryCache(max_conversations=2, ttl=0)
+    expired.put("a", [message(0)], 5, expired.begin_load("a"))
+    assert expired.get("a", 1) is None
+
+def test_history_cache_follows_summary_versions():
+    """Test that entries are stale once the version moves without this process"""
+    cache = HistoryCache(max_conversations=10, ttl=60)
+    cache.put("a", [message(0)], 5, cache.begin_load("a"), version=3)
+    assert cache.get("a", 1, version=3) is not None
+
+    # Our own flush
+    cache.append("a", message(1))
+    cache.recorded("a", 4)
+    assert [m["_id"] for m in cache.get("a", 2, version=4)] == [0, 1]
+
+    # Another worker's write
+    assert cache.get("a", 1, version=5) is None
+    assert cache.stats()["stale"] == 1
+
+    # A flush that jumped over someone else's write
+    cache.put("a", [message(0)], 5, cache.begin_load("a"), version=5)
+    cache.recorded("a", 7)
+    assert cache.get("a", 1, version=7) is None
@@ -0,0 +1,41 @@
+from app.database.indexes import _summarize_plan
+
+def test_summarize_plan_reports_winning_index():
+    """Test that the explain summary only reflects the winning plan"""
+    explain = {
+        "queryPlanner": {
+            "winningPlan": {
+                "stage": "FETCH",
+                "inputStage": {"stage": "IXSCAN", "indexName": "conversationId_createdAt"},
+            },
+            "rejectedPlans": [{"stage": "COLLSCAN"}],
+        }
+    }
+    summary = _summarize_plan(explain)
+    assert summary["usesIndex"] is True
+    assert summary["collectionScan"] is False
+    assert summary["indexes"] == ["conversationId_createdAt"]
+
+def test_summarize_plan_detects_collection_scan():
+    """Test that a collection scan is reported"""
+    summary = _summarize_plan({"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}})
+    assert summary["usesIndex"] is False
+    assert summary["collectionScan"] is True
+
+def test_ensure_indexes_drops_obsolete_ones():
+    """Test that indexes no query uses any more are removed on startup"""
+    import asyncio
+    import pytest
+    from app.database.indexes import ensure_indexes
+
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    db = mongomock_motor.AsyncMongoMockClient()["index_test"]
+
+    async def scenario():
+        await db["messages"].create_index([("createdAt", -1)], name="createdAt_desc")
+        await ensure_indexes(db)
+        return await db["messages"].index_information()
+
+    names = asyncio.run(scenario())
+    assert "createdAt_desc" not in names
+    assert "conversationId_createdAt_id" in names
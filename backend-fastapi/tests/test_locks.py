@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+from app.chatbot.locks import ConversationLocks, ConversationBusyError
+
+
+def test_reject_policy_refuses_a_busy_conversation_only():
+    """Test that rejection is per conversation"""
+    async def scenario():
+        locks = ConversationLocks(policy="reject")
+        turn = locks.reserve("a")
+        async with turn:
+            with pytest.raises(ConversationBusyError):
+                locks.reserve("a")
+            other = locks.reserve("b")
+            other.release()
+        return locks
+
+    locks = asyncio.run(scenario())
+    assert locks.stats() == {"busyConversations": 0, "rejected": 1, "coalesced": 0, "waited": 0}
+
+
+def test_queue_policy_orders_turns_and_bounds_waiters():
+    """Test that queued turns run one at a time, in order, up to max_queued"""
+    order = []
+
+    async def scenario():
+        locks = ConversationLocks(policy="queue", max_queued=3)
+
+        async def turn(name):
+            order.append(f"start {name}")
+            await asyncio.sleep(0.01)
+            order.append(f"end {name}")
+            return name
+
+        tasks = [asyncio.ensure_future(locks.run("a", None, lambda n=n: turn(n))) for n in range(3)]
+        await asyncio.sleep(0)
+        with pytest.raises(ConversationBusyError):
+            locks.reserve("a")
+        results = await asyncio.gather(*tasks)
+        return locks, results
+
+    locks, results = asyncio.run(scenario())
+    assert results == [0, 1, 2]
+    assert order == ["start 0", "end 0", "start 1", "end 1", "start 2", "end 2"]
+    assert locks.stats()["busyConversations"] == 0
+
+
+def test_coalesced_followers_rerun_when_the_leader_fails():
+    """Test that a failed turn does not fail the identical requests following it"""
+    calls = []
+
+    async def scenario():
+        locks = ConversationLocks(policy="coalesce")
+
+        async def turn():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            if len(calls) == 1:
+                raise RuntimeError("upstream failed")
+            return "ok"
+
+        return await asyncio.gather(
+            locks.run("a", "same", turn), locks.run("a", "same", turn), return_exceptions=True
+        )
+
+    first, second = asyncio.run(scenario())
+    assert isinstance(first, RuntimeError)
+    assert second == "ok"
+    assert len(calls) == 2
+
+
+def test_lock_table_is_emptied_when_turns_are_cancelled():
+    """Test that a turn cancelled while waiting gives up its reservation"""
+    async def scenario():
+        locks = ConversationLocks()
+        holder = locks.reserve("a")
+        await holder.__aenter__()
+        waiter = asyncio.ensure_future(locks.run("a", None, lambda: asyncio.sleep(0)))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        await holder.__aexit__(None, None, None)
+        return locks
+
+    assert asyncio.run(scenario()).stats()["busyConversations"] == 0
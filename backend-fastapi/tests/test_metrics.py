@@ -0,0 +1,61 @@
+import threading
+from fastapi.testclient import TestClient
+from app.main import app
+from app.utils.metrics import Counter, Histogram, Registry
+
+
+def test_histogram_renders_cumulative_buckets():
+    """Test the Prometheus text rendering of a labelled histogram"""
+    registry = Registry()
+    histogram = registry.register(Histogram("latency_seconds", "Latency", ["route"], buckets=(0.1, 1)))
+    counter = registry.register(Counter("requests_total", "Requests"))
+    histogram.labels("/a").observe(0.05)
+    histogram.labels("/a").observe(0.5)
+    histogram.labels("/a").observe(5)
+    counter.inc(2)
+
+    lines = registry.render().splitlines()
+    assert '# TYPE latency_seconds histogram' in lines
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="/a",le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{route="/a"} 3' in lines
+    assert 'requests_total 2.0' in lines
+
+
+def test_metrics_endpoint_records_route_templates():
+    """Test that request latency is labelled by route template, not raw path"""
+    client = TestClient(app)
+    client.get("/chatbot/health")
+    client.get("/no-such-path")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'chatbot_http_request_duration_seconds_count{method="GET",route="/chatbot/health",status="200"}' in body
+    assert 'route="unmatched",status="404"' in body
+    assert "chatbot_streams_in_flight 0" in body
+    assert "chatbot_scheduler_in_flight" in body
+    assert 'chatbot_upstream_outstanding{upstream=' in body
+    # Monotonic component stats are exported as counters
+    assert "# TYPE chatbot_history_cache_stale_total counter" in body
+
+
+def test_thread_safe_histogram_counts_every_observation():
+    """Test that observations from many threads are all counted"""
+    histogram = Histogram("command_seconds", "Commands", ["command"], buckets=(0.1,), thread_safe=True)
+
+    def observe():
+        for i in range(2000):
+            histogram.labels(f"command{i % 3}").observe(0.05)
+
+    threads = [threading.Thread(target=observe) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    rendered = "\n".join(histogram.render())
+    counts = [histogram.labels(f"command{i}").count for i in range(3)]
+    assert sum(counts) == 16000
+    assert 'command_seconds_count{command="command0"}' in rendered
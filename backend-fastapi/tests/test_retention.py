@@ -0,0 +1,201 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+import pytest
+from datetime import datetime, timedelta
+from bson import ObjectId
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from app.chatbot import retention as retention_module
+from app.chatbot import service as service_module
+from app.chatbot.retention import Purger, archive_path
+from app.chatbot.service import ChatbotService
+from app.chatbot.summaries import rebuild_conversation_summaries, record_messages
+from app.config import settings
+
+
+def messages(conversation_id, count, start):
+    # Mongo keeps milliseconds
+    start = start.replace(microsecond=0)
+    return [
+        {
+            "_id": ObjectId(),
+            "conversationId": conversation_id,
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"{conversation_id} message {i}",
+            "createdAt": start + timedelta(seconds=i),
+            "updatedAt": start + timedelta(seconds=i),
+        }
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def db():
+    return mongomock_motor.AsyncMongoMockClient()["retention_test"]
+
+
+@pytest.fixture
+def retention_service(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "RETENTION_DAYS", 30)
+    monkeypatch.setattr(settings, "ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "DELETE_BATCH_SIZE", 4)
+    monkeypatch.setattr(settings, "DELETE_BATCH_PAUSE_MS", 0)
+    chatbot_service = ChatbotService()
+    chatbot_service.messages_collection = db["messages"]
+    chatbot_service.conversations_collection = db["conversations"]
+    chatbot_service.compactions_collection = db["conversation_compactions"]
+    chatbot_service.purges_collection = db["conversation_purges"]
+    chatbot_service._ensure_collection()
+    return chatbot_service
+
+
+def seed(db):
+    old = messages("old", 10, datetime.utcnow() - timedelta(days=40))
+    fresh = messages("fresh", 3, datetime.utcnow() - timedelta(days=1))
+
+    async def insert():
+        await db["messages"].insert_many(old + fresh)
+        await rebuild_conversation_summaries(db)
+
+    asyncio.run(insert())
+    return old
+
+
+def test_archive_path_is_per_month_and_escapes_the_id():
+    """Test that archives are grouped by month and ids cannot escape the directory"""
+    path = archive_path("archive", "../a b", datetime(2024, 3, 5, 6, 7, 8))
+    assert path == os.path.join("archive", "2024", "03", "..%2Fa%20b-20240305T060708.ndjson.gz")
+
+
+def test_sweep_archives_and_purges_expired_conversations(retention_service, db, tmp_path):
+    """Test that idle conversations are archived as gzipped NDJSON, then removed in batches"""
+    old = seed(db)
+
+    async def sweep():
+        expired = await retention_service.retention.sweep()
+        await retention_service.purger.join()
+        return expired
+
+    assert asyncio.run(sweep()) == ["old"]
+
+    path = archive_path(str(tmp_path), "old", old[-1]["createdAt"])
+    with gzip.open(path, "rt") as archive:
+        archived = [json.loads(line) for line in archive]
+    assert [m["content"] for m in archived] == [m["content"] for m in old]
+    assert archived[0]["_id"] == str(old[0]["_id"])
+
+    remaining = asyncio.run(db["messages"].distinct("conversationId"))
+    assert remaining == ["fresh"]
+    summaries = asyncio.run(db["conversations"].distinct("conversationId"))
+    assert summaries == ["fresh"]
+    assert retention_service.retention.stats() == {"expired": 1, "archivedMessages": 10, "failures": 0}
+    assert retention_service.purger.stats()["purgedMessages"] == 10
+    assert asyncio.run(db["conversation_purges"].count_documents({})) == 0
+
+
+def test_conversation_written_during_archive_is_kept(retention_service, db, tmp_path, monkeypatch):
+    """Test that a message arriving while a conversation is archived keeps it alive"""
+    seed(db)
+    write_archive = retention_module.write_archive
+
+    async def write_archive_then_message(collection, conversation_id, before, path, batch_size):
+        count = await write_archive(collection, conversation_id, before, path, batch_size)
+        new = messages(conversation_id, 1, datetime.utcnow())
+        new[0]["content"] = "new"
+        await db["messages"].insert_many(new)
+        await record_messages(db["conversations"], new)
+        return count
+
+    monkeypatch.setattr(retention_module, "write_archive", write_archive_then_message)
+
+    async def sweep():
+        expired = await retention_service.retention.sweep()
+        await retention_service.purger.join()
+        return expired
+
+    assert asyncio.run(sweep()) == []
+    assert asyncio.run(db["messages"].count_documents({"conversationId": "old"})) == 11
+    summary = asyncio.run(db["conversations"].find_one({"conversationId": "old"}))
+    assert summary["messageCount"] == 11
+    assert "retentionClaimedAt" not in summary
+    assert not any(files for _, _, files in os.walk(tmp_path))
+
+
+def test_deleted_conversation_is_hidden_at_once_and_purged_in_batches(retention_service, db, monkeypatch):
+    """Test that delete returns before the purge and readers never see a half-deleted conversation"""
+    seed(db)
+    batches = []
+    delete_many = db["messages"].delete_many
+
+    async def counting_delete_many(query, *args, **kwargs):
+        batches.append(len(query["_id"]["$in"]))
+        return await delete_many(query, *args, **kwargs)
+
+    monkeypatch.setattr(retention_service.messages_collection, "delete_many", counting_delete_many)
+
+    async def scenario():
+        assert await retention_service.delete_conversation("old") is True
+        assert await retention_service.get_conversation_history("old") == []
+        assert await retention_service.get_recent_history("old", 50) == []
+        await retention_service.purger.join()
+        assert await retention_service.delete_conversation("old") is False
+
+    asyncio.run(scenario())
+    assert batches == [4, 4, 2]
+    assert asyncio.run(db["messages"].count_documents({"conversationId": "old"})) == 0
+
+
+def test_unfinished_purges_resume(db):
+    """Test that stored purge jobs are picked up again and keep newer messages"""
+    before = datetime.utcnow().replace(microsecond=0)
+    kept = messages("gone", 1, before + timedelta(seconds=5))
+
+    async def scenario():
+        await db["messages"].insert_many(messages("gone", 7, before - timedelta(minutes=1)) + kept)
+        await db["conversation_purges"].insert_one(
+            {"_id": ObjectId(), "conversationId": "gone", "before": before, "createdAt": before}
+        )
+        purger = Purger(db["messages"], db["conversation_purges"], batch_size=3, pause=0)
+        assert await purger.resume() == 1
+        assert purger.cutoff("gone") == before
+        await purger.join()
+        assert purger.cutoff("gone") is None
+        return await db["messages"].find({}).to_list(None)
+
+    remaining = asyncio.run(scenario())
+    assert [m["_id"] for m in remaining] == [kept[0]["_id"]]
+    assert asyncio.run(db["conversation_purges"].count_documents({})) == 0
+
+
+def test_startup_resumes_purges(db, monkeypatch):
+    """Test that the app's startup resumes stored purges, which then run in the background"""
+    from fastapi.testclient import TestClient
+    from app import main
+    from app.database import connection
+
+    async def connect_to_mongo(uri):
+        connection.database = db
+
+    monkeypatch.setattr(main, "connect_to_mongo", connect_to_mongo)
+    monkeypatch.setattr(connection, "database", None)
+    monkeypatch.setattr(service_module, "_chatbot_service", None)
+
+    before = datetime.utcnow()
+    asyncio.run(db["messages"].insert_many(messages("gone", 5, before - timedelta(minutes=1))))
+    asyncio.run(db["conversation_purges"].insert_one(
+        {"_id": ObjectId(), "conversationId": "gone", "before": before, "createdAt": before}
+    ))
+
+    with TestClient(main.app) as client:
+        assert client.get("/chatbot/history/gone").json() == []
+        for _ in range(100):
+            if "chatbot_purges_pending 0" in client.get("/metrics").text:
+                break
+            time.sleep(0.02)
+        assert "chatbot_purges_purged_messages_total 5" in client.get("/metrics").text
+
+    assert asyncio.run(db["messages"].count_documents({})) == 0
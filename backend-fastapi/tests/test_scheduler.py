@@ -0,0 +1,86 @@
+import asyncio
+import httpx
+import openai
+import pytest
+from openai import AsyncOpenAI
+from app.utils.openai_client import OpenAIClient
+from app.utils.scheduler import RequestScheduler
+from tests.fake_openai import FakeOpenAI
+
+
+def make_client(fake, scheduler):
+    http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=fake.app))
+    client = AsyncOpenAI(base_url="http://fake/v1", api_key="test", max_retries=0, http_client=http_client)
+    return OpenAIClient(client=client, scheduler=scheduler)
+
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def test_retries_rate_limits_and_server_errors():
+    """Test that 429 and 5xx responses are retried with backoff"""
+    fake = FakeOpenAI(fail_statuses=[429, 503])
+    scheduler = RequestScheduler(max_retries=3, backoff_base=0.001, backoff_max=0.01)
+
+    async def scenario():
+        client = make_client(fake, scheduler)
+        return await client.create_chat_completion(MESSAGES)
+
+    completion = asyncio.run(scenario())
+    assert completion.choices[0].message.content == fake.reply
+    assert fake.requests == 3
+    assert scheduler.stats()["retries"] == 2
+
+
+def test_client_errors_are_not_retried():
+    """Test that a 400 fails without retrying"""
+    fake = FakeOpenAI(fail_statuses=[400])
+    scheduler = RequestScheduler(max_retries=3, backoff_base=0.001)
+
+    async def scenario():
+        client = make_client(fake, scheduler)
+        await client.create_chat_completion(MESSAGES)
+
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(scenario())
+    assert fake.requests == 1
+    assert scheduler.stats()["failures"] == 1
+
+
+def test_max_in_flight_limits_concurrency():
+    """Test that requests beyond max_in_flight wait for a slot, streams included"""
+    fake = FakeOpenAI(latency=0.02)
+    scheduler = RequestScheduler(max_in_flight=2)
+
+    async def consume_stream(client):
+        stream = await client.create_chat_completion(MESSAGES, stream=True)
+        return "".join([chunk.choices[0].delta.content or "" async for chunk in stream])
+
+    async def scenario():
+        client = make_client(fake, scheduler)
+        await asyncio.gather(*[client.create_chat_completion(MESSAGES) for _ in range(6)])
+        replies = await asyncio.gather(*[consume_stream(client) for _ in range(4)])
+        assert replies == [fake.reply] * 4
+
+    asyncio.run(scenario())
+    assert fake.max_in_flight <= 2
+    stats = scheduler.stats()
+    assert stats["inFlight"] == 0
+    assert stats["queueWaitMaxMs"] > 0
+
+
+def test_hedged_request_wins_over_slow_attempt():
+    """Test that a slow request is hedged and the faster attempt is used"""
+    scheduler = RequestScheduler(hedge_after=0.01)
+    delays = [1.0, 0.0]
+
+    async def call():
+        delay = delays.pop(0)
+        await asyncio.sleep(delay)
+        return delay
+
+    result = asyncio.run(scheduler.run(call))
+    assert result == 0.0
+    assert scheduler.stats()["hedges"] == 1
+    assert scheduler.stats()["hedgeWins"] == 1
+    assert scheduler.stats()["inFlight"] == 0
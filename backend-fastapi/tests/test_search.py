@@ -0,0 +1,109 @@
+import asyncio
+import os
+import pytest
+from datetime import datetime, timedelta
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from app.chatbot.search import make_snippet, search_pipeline, search_terms
+from app.chatbot.service import ChatbotService
+from app.database.indexes import ensure_indexes
+from app.main import app
+from app.utils.pagination import decode_score_cursor, encode_score_cursor
+
+
+def test_search_terms_skip_negated_words_and_split_phrases():
+    """Test that snippet terms follow $text query syntax"""
+    assert search_terms('Deploy "blue green" -staging k8s') == ["deploy", "blue", "green", "k8s"]
+    assert search_terms('-"not this" -that') == []
+
+
+def test_snippet_is_cut_around_the_first_match():
+    """Test that long content is windowed around a stemmed match with ellipses"""
+    content = "filler " * 40 + "we were Running the migration overnight " + "tail " * 40
+    snippet = make_snippet(content, ["running"], width=60)
+    assert snippet.startswith("…") and snippet.endswith("…")
+    assert "Running the migration" in snippet
+    assert len(snippet) <= 62
+
+    assert make_snippet("short   message\nhere", ["nothing"]) == "short message here"
+    assert make_snippet("x" * 300, ["absent"], width=50) == "x" * 50 + "…"
+
+
+def test_pipeline_pages_on_score_then_id():
+    """Test that later pages resume strictly after the previous page's last hit"""
+    last_id = ObjectId()
+    pipeline = search_pipeline("deploy", 20, (1.5, last_id))
+    assert pipeline[0] == {"$match": {"$text": {"$search": "deploy"}}}
+    assert pipeline[2] == {"$match": {"$or": [
+        {"score": {"$lt": 1.5}},
+        {"score": 1.5, "_id": {"$lt": last_id}},
+    ]}}
+    assert pipeline[-2:] == [{"$sort": {"score": -1, "_id": -1}}, {"$limit": 21}]
+    # A candidate cap limits the matches fetched before anything is scored
+    assert search_pipeline("deploy", 20, max_candidates=500)[1] == {"$limit": 500}
+    assert decode_score_cursor(encode_score_cursor(1.5, str(last_id))) == (1.5, str(last_id))
+
+
+def test_search_endpoint_validation():
+    """Test search parameter validation"""
+    client = TestClient(app)
+    assert client.get("/chatbot/search").status_code == 422
+    assert client.get("/chatbot/search?q=").status_code == 422
+    assert client.get("/chatbot/search?q=-excluded").status_code == 400
+    assert client.get("/chatbot/search?q=deploy&cursor=not-a-cursor").status_code == 400
+
+
+@pytest.fixture
+def mongo_db():
+    """A scratch database on the mongod in MONGODB_TEST_URI; mongomock has no $text support"""
+    uri = os.environ.get("MONGODB_TEST_URI")
+    if not uri:
+        pytest.skip("set MONGODB_TEST_URI to run queries against a real mongod")
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(uri, serverSelectionTimeoutMS=2000)
+    name = f"chatbot_search_test_{ObjectId()}"
+    yield client[name]
+    asyncio.run(client.drop_database(name))
+    client.close()
+
+
+def test_search_ranks_and_pages_real_matches(mongo_db, monkeypatch):
+    """Test that a $text query ranks the best matches first and pages without gaps or repeats"""
+    from app.config import settings
+
+    start = datetime(2024, 1, 1)
+    contents = ["deploy"] * 3 + ["deploy deploy deploy the deployment"] + ["something else"] * 5
+    contents += [f"deploying release {i}" for i in range(6)]
+    documents = [
+        {"_id": ObjectId(), "conversationId": f"c{i % 3}", "role": "user", "content": content,
+         "createdAt": start + timedelta(seconds=i)}
+        for i, content in enumerate(contents)
+    ]
+
+    async def scenario():
+        await mongo_db["messages"].insert_many(documents)
+        await ensure_indexes(mongo_db)
+        chatbot_service = ChatbotService()
+        chatbot_service.messages_collection = mongo_db["messages"]
+        chatbot_service.conversations_collection = mongo_db["conversations"]
+        chatbot_service.compactions_collection = mongo_db["conversation_compactions"]
+        chatbot_service.purges_collection = mongo_db["conversation_purges"]
+        pages, cursor = [], None
+        while True:
+            page = await chatbot_service.search_messages("deploy", 4, cursor)
+            pages.append(page["items"])
+            cursor = page["nextCursor"]
+            if cursor is None:
+                return pages
+
+    monkeypatch.setattr(settings, "SEARCH_MAX_CANDIDATES", 0)
+    pages = asyncio.run(scenario())
+    hits = [hit for page in pages for hit in page]
+    assert [len(page) for page in pages] == [4, 4, 2]
+    assert len({hit["messageId"] for hit in hits}) == 10
+    # Exact short matches outrank the longer "deploying release" messages
+    assert {hit["messageId"] for hit in hits[-6:]} == {str(d["_id"]) for d in documents[-6:]}
+    assert [hit["score"] for hit in hits] == sorted((hit["score"] for hit in hits), reverse=True)
+    assert all("deploy" in hit["snippet"] for hit in hits)
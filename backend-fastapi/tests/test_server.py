@@ -0,0 +1,44 @@
+import os
+import pytest
+from app.config import Settings
+from app.server import uvicorn_options, default_workers
+
+
+def test_development_options_use_the_reloader():
+    """Test that development mode keeps the single reloading process"""
+    options = uvicorn_options(Settings(OPENAI_API_KEY="x", DEBUG=True), production=False)
+    assert options["reload"] is True
+    assert "workers" not in options
+
+
+def test_production_options_scale_workers_and_disable_reload():
+    """Test that production mode runs one worker per CPU without the reloader"""
+    settings = Settings(OPENAI_API_KEY="x", DEBUG=True, KEEPALIVE_SECONDS=20, BACKLOG=4096)
+    options = uvicorn_options(settings, production=True)
+    assert options["reload"] is False
+    assert options["workers"] == default_workers()
+    assert options["timeout_keep_alive"] == 20
+    assert options["backlog"] == 4096
+
+    settings.WORKERS = 3
+    assert uvicorn_options(settings, production=True)["workers"] == 3
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+def test_singletons_are_rebuilt_in_forked_workers():
+    """Test that a forked worker does not reuse the parent's clients and service"""
+    from app.chatbot import service as service_module
+    from app.utils.openai_client import openai_client
+
+    service = service_module.get_chatbot_service()
+    pool = openai_client.pool
+    pid = os.fork()
+    if pid == 0:
+        ok = (
+            service_module.get_chatbot_service() is not service
+            and openai_client.pool is not pool
+            and openai_client.scheduler.in_flight == 0
+        )
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
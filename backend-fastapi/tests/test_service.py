@@ -0,0 +1,411 @@
+import asyncio
+import json
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from app.chatbot import service as service_module
+from app.chatbot.service import ChatbotService
+from app.chatbot.summaries import rebuild_conversation_summaries
+from app.schemas.message import CreateMessageRequest
+from app.utils.sse import coalesce_events
+
+
+def send(chatbot_service, conversation_id, message):
+    request = CreateMessageRequest(message=message, conversationId=conversation_id)
+
+    async def turn():
+        result = await chatbot_service.process_message(request)
+        await chatbot_service.message_writer.flush()
+        return result
+
+    return asyncio.run(turn())
+
+
+def test_conversation_summary_tracks_writes(chatbot_service, db):
+    """Test that the summary collection is updated as messages are written"""
+    send(chatbot_service, "a", "first")
+    send(chatbot_service, "a", "second")
+    send(chatbot_service, "b", "other")
+
+    conversations = asyncio.run(chatbot_service.get_all_conversations())
+    assert [c["conversationId"] for c in conversations] == ["b", "a"]
+    summary = conversations[1]
+    assert summary["messageCount"] == 4
+    assert summary["firstMessage"] == "first"
+    assert summary["lastMessage"] == "reply to second"
+    assert summary["lastMessageRole"] == "assistant"
+
+    # A rebuild from the messages collection yields the same summaries
+    asyncio.run(rebuild_conversation_summaries(db))
+    rebuilt = asyncio.run(chatbot_service.get_all_conversations())
+    assert {c["conversationId"]: c["messageCount"] for c in rebuilt} == {"a": 4, "b": 2}
+    assert {c["conversationId"]: c["firstMessage"] for c in rebuilt} == {"a": "first", "b": "other"}
+
+    assert asyncio.run(chatbot_service.delete_conversation("b")) is True
+    remaining = asyncio.run(chatbot_service.get_all_conversations())
+    assert [c["conversationId"] for c in remaining] == ["a"]
+
+
+def test_keyset_pagination(chatbot_service):
+    """Test that conversation and history pages cover every item exactly once"""
+    for i in range(5):
+        send(chatbot_service, f"conversation-{i}", f"hello {i}")
+    for i in range(3):
+        send(chatbot_service, "long", f"turn {i}")
+
+    seen, cursor = [], None
+    while True:
+        page = asyncio.run(chatbot_service.get_conversations_page(2, cursor))
+        seen += [c["conversationId"] for c in page["items"]]
+        cursor = page["nextCursor"]
+        if cursor is None:
+            break
+    all_conversations = asyncio.run(chatbot_service.get_all_conversations())
+    assert seen == [c["conversationId"] for c in all_conversations]
+
+    contents, cursor = [], None
+    while True:
+        page = asyncio.run(chatbot_service.get_conversation_history_page("long", 4, cursor))
+        contents += [m["content"] for m in page["items"]]
+        cursor = page["nextCursor"]
+        if cursor is None:
+            break
+    history = asyncio.run(chatbot_service.get_conversation_history("long"))
+    assert contents == [m["content"] for m in history]
+    assert len(contents) == 6
+
+
+def test_export_streams_ndjson_in_batches(chatbot_service):
+    """Test that the export yields every message as one NDJSON line, in batches"""
+    for i in range(3):
+        send(chatbot_service, "export", f"turn {i}")
+
+    async def collect():
+        return [chunk async for chunk in chatbot_service.export_conversation_history("export", 4)]
+
+    chunks = asyncio.run(collect())
+    assert len(chunks) == 2
+    lines = b"".join(chunks).decode("utf-8").splitlines()
+    messages = [json.loads(line) for line in lines]
+    assert [m["content"] for m in messages] == [
+        "turn 0", "reply to turn 0", "turn 1", "reply to turn 1", "turn 2", "reply to turn 2"
+    ]
+    assert all(isinstance(m["_id"], str) for m in messages)
+
+
+def test_write_behind_batches_and_reads_own_writes(chatbot_service, db):
+    """Test that queued messages are visible before they are flushed in one batch"""
+    chatbot_service.message_writer = None
+    chatbot_service._ensure_collection()
+    chatbot_service.message_writer.flush_interval = 60
+
+    async def scenario():
+        for i in range(3):
+            request = CreateMessageRequest(message=f"turn {i}", conversationId="batched")
+            result = await chatbot_service.process_message(request)
+            # The prompt saw every earlier turn even though nothing is flushed yet
+            assert result["message"] == f"reply to turn {i}"
+        assert await db["messages"].count_documents({}) == 0
+        history = await chatbot_service.get_conversation_history("batched")
+        assert len(history) == 6
+
+        await chatbot_service.close()
+        assert await db["messages"].count_documents({"conversationId": "batched"}) == 6
+        history = await chatbot_service.get_conversation_history("batched")
+        assert [m["content"] for m in history][:2] == ["turn 0", "reply to turn 0"]
+        conversations = await chatbot_service.get_all_conversations()
+        assert conversations[0]["messageCount"] == 6
+
+    asyncio.run(scenario())
+
+
+def test_multi_turn_chat_reads_history_once(chatbot_service, db):
+    """Test that only the first turn of a conversation reads its history from Mongo"""
+    for i in range(4):
+        send(chatbot_service, "cached", f"turn {i}")
+    stats = chatbot_service.history_cache.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 3
+
+    asyncio.run(chatbot_service.delete_conversation("cached"))
+    send(chatbot_service, "cached", "again")
+    assert chatbot_service.history_cache.stats()["misses"] == 2
+
+
+def test_history_cache_sees_writes_of_other_workers(chatbot_service, db):
+    """Test that a cached tail is dropped once another process wrote to the conversation"""
+    other = ChatbotService()
+    other.messages_collection = db["messages"]
+    other.conversations_collection = db["conversations"]
+    other.compactions_collection = db["conversation_compactions"]
+
+    send(chatbot_service, "shared", "first")
+    send(other, "shared", "second")
+    send(chatbot_service, "shared", "third")
+
+    prompt = asyncio.run(chatbot_service.build_prompt("shared"))
+    assert [m["content"] for m in prompt if m["role"] == "user"] == ["first", "second", "third"]
+    assert chatbot_service.history_cache.stats()["stale"] == 1
+
+
+def test_recent_history_without_summaries(chatbot_service):
+    """Test that the tail is still cached when there is no summary collection to check it against"""
+    chatbot_service.conversations_collection = None
+    chatbot_service.message_writer = None
+    send(chatbot_service, "bare", "hello")
+    history = asyncio.run(chatbot_service.get_recent_history("bare", 10))
+    assert [m["content"] for m in history] == ["hello", "reply to hello"]
+
+
+def test_abandoned_stream_is_cancelled_and_persisted_as_truncated(chatbot_service, fake_openai, db):
+    """Test that a client disconnect stops the upstream and keeps the partial reply"""
+    request = CreateMessageRequest(message="tell me a long story", conversationId="gone")
+
+    async def scenario():
+        disconnected = False
+
+        async def is_disconnected():
+            return disconnected
+
+        events = coalesce_events(
+            chatbot_service.process_message_stream(request),
+            window=0,
+            is_disconnected=is_disconnected,
+            disconnect_poll_interval=0.005,
+        )
+        received = []
+        async for event in events:
+            received.append(event)
+            if len(received) == 3:
+                disconnected = True
+        await chatbot_service.message_writer.flush()
+        return received
+
+    received = asyncio.run(scenario())
+    assert [e["type"] for e in received] == ["start", "content", "content"]
+    assert fake_openai.closed_streams == 1
+    assert chatbot_service.stream_stats()["abandoned"] == 1
+    assert chatbot_service.stream_stats()["tokensSaved"] > 0
+
+    history = asyncio.run(chatbot_service.get_conversation_history("gone"))
+    assert history[-1]["role"] == "assistant"
+    assert history[-1]["truncated"] is True
+    assert "reply to tell".startswith(history[-1]["content"])
+
+
+def test_resumed_stream_does_not_call_the_model_again(chatbot_service, fake_openai):
+    """Test that reconnecting with Last-Event-ID replays the same generation"""
+    request = CreateMessageRequest(message="one two three four", conversationId="resume")
+
+    async def scenario():
+        buffer = chatbot_service.start_message_stream(request)
+        first = []
+        source = chatbot_service.streams.follow(buffer)
+        async for event in source:
+            first.append(event)
+            if len(first) == 2:
+                break
+        await source.aclose()
+        resumed, after = chatbot_service.streams.resume(first[-1]["id"])
+        rest = [event async for event in chatbot_service.streams.follow(resumed, after)]
+        await chatbot_service.message_writer.flush()
+        return first, rest
+
+    first, rest = asyncio.run(scenario())
+    text = "".join(e["content"] for e in first + rest if e["type"] == "content")
+    assert text == "reply to one two three four"
+    assert rest[-1]["type"] == "end"
+    assert fake_openai.calls == 1
+    history = asyncio.run(chatbot_service.get_conversation_history("resume"))
+    assert [m["role"] for m in history] == ["user", "assistant"]
+    assert history[-1]["content"] == text
+
+
+def test_message_stages_are_timed(chatbot_service):
+    """Test that each stage of handling a message is recorded"""
+    from app.utils.metrics import CHAT_STAGE_SECONDS
+
+    before = {stage: CHAT_STAGE_SECONDS.labels(stage).count for stage in
+              ("user_insert", "history_fetch", "prompt_build", "generation", "assistant_insert")}
+    send(chatbot_service, "timed", "hello")
+    for stage, count in before.items():
+        assert CHAT_STAGE_SECONDS.labels(stage).count == count + 1
+
+
+def test_history_json_matches_history(chatbot_service):
+    """Test that the pre-serialized history has the same content as the dict path"""
+    send(chatbot_service, "json", "hello")
+    raw = asyncio.run(chatbot_service.get_conversation_history_json("json"))
+    history = asyncio.run(chatbot_service.get_conversation_history("json"))
+    assert json.loads(raw) == [
+        {**message, "createdAt": message["createdAt"].isoformat(), "updatedAt": message["updatedAt"].isoformat()}
+        for message in history
+    ]
+
+
+def test_concurrent_turns_of_a_conversation_are_serialized(chatbot_service, fake_openai):
+    """Test that the second turn sees the first turn's reply in its prompt"""
+    prompts = []
+    create = fake_openai.create_chat_completion
+
+    async def recording_create(messages, stream=False):
+        prompts.append([m["content"] for m in messages])
+        return await create(messages, stream)
+
+    fake_openai.create_chat_completion = recording_create
+
+    async def scenario():
+        await asyncio.gather(
+            chatbot_service.process_message(CreateMessageRequest(message="first", conversationId="busy")),
+            chatbot_service.process_message(CreateMessageRequest(message="second", conversationId="busy")),
+        )
+        await chatbot_service.message_writer.flush()
+
+    asyncio.run(scenario())
+    assert prompts[1][-3:] == ["first", "reply to first", "second"]
+    assert chatbot_service.locks.stats()["busyConversations"] == 0
+
+
+def test_identical_concurrent_messages_are_coalesced(chatbot_service, fake_openai):
+    """Test that a double-submitted message makes one upstream call under coalesce"""
+    from app.chatbot.locks import ConversationLocks
+
+    chatbot_service.locks = ConversationLocks(policy="coalesce")
+    request = CreateMessageRequest(message="same", conversationId="double")
+
+    async def scenario():
+        results = await asyncio.gather(
+            chatbot_service.process_message(request), chatbot_service.process_message(request)
+        )
+        await chatbot_service.message_writer.flush()
+        return results
+
+    first, second = asyncio.run(scenario())
+    assert first == second
+    assert fake_openai.calls == 1
+    history = asyncio.run(chatbot_service.get_conversation_history("double"))
+    assert [m["role"] for m in history] == ["user", "assistant"]
+
+
+def test_history_and_list_etags_revalidate_with_one_lookup(chatbot_service, monkeypatch):
+    """Test that unchanged history and lists answer 304 and any write changes their ETags"""
+    httpx = pytest.importorskip("httpx")
+    from app.main import app
+
+    monkeypatch.setattr(service_module, "_chatbot_service", chatbot_service)
+    send(chatbot_service, "a", "first")
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            history = await client.get("/chatbot/history/a")
+            listing = await client.get("/chatbot/conversations")
+            page = await client.get("/chatbot/conversations", params={"limit": 1})
+            assert history.headers["cache-control"] == "no-cache"
+            assert len({history.headers["etag"], listing.headers["etag"], page.headers["etag"]}) == 3
+
+            for path, response in (("/chatbot/history/a", history), ("/chatbot/conversations", listing)):
+                again = await client.get(path, headers={"If-None-Match": response.headers["etag"]})
+                assert again.status_code == 304
+                assert again.content == b""
+                assert again.headers["etag"] == response.headers["etag"]
+
+            # A queued write changes the history tag before it is flushed
+            await chatbot_service.process_message(CreateMessageRequest(message="second", conversationId="a"))
+            pending = await client.get("/chatbot/history/a", headers={"If-None-Match": history.headers["etag"]})
+            assert pending.status_code == 200
+            assert len(pending.json()) == 4
+
+            await chatbot_service.message_writer.flush()
+            flushed = await client.get("/chatbot/history/a", headers={"If-None-Match": pending.headers["etag"]})
+            assert flushed.status_code == 200
+            relisted = await client.get("/chatbot/conversations", headers={"If-None-Match": listing.headers["etag"]})
+            assert relisted.status_code == 200
+            assert relisted.json()[0]["messageCount"] == 4
+
+            await chatbot_service.delete_conversation("a")
+            deleted = await client.get("/chatbot/conversations", headers={"If-None-Match": relisted.headers["etag"]})
+            assert deleted.status_code == 200
+            assert deleted.json() == []
+
+    asyncio.run(scenario())
+
+
+def test_summary_keeps_the_newest_message_when_batches_land_out_of_order(db):
+    """Test that a late batch from another worker does not move the summary backwards"""
+    from datetime import datetime, timedelta
+    from bson import ObjectId
+    from app.chatbot.summaries import record_messages
+
+    start = datetime(2024, 1, 1)
+
+    def message(content, seconds):
+        return {"_id": ObjectId(), "conversationId": "raced", "role": "user", "content": content,
+                "createdAt": start + timedelta(seconds=seconds)}
+
+    async def scenario():
+        await record_messages(db["conversations"], [message("first", 0)])
+        await record_messages(db["conversations"], [message("$newest", 20)])
+        await record_messages(db["conversations"], [message("late", 10)])
+        return await db["conversations"].find_one({"conversationId": "raced"})
+
+    summary = asyncio.run(scenario())
+    assert summary["lastMessage"] == "$newest"
+    assert summary["lastMessageTime"] == start + timedelta(seconds=20)
+    assert summary["firstMessage"] == "first"
+    assert summary["messageCount"] == 3
+    assert summary["version"] == 3
+
+
+def test_rejected_message_is_dead_lettered_and_does_not_block_later_writes(db):
+    """Test that a message the database keeps rejecting stops being retried after max_attempts"""
+    from datetime import datetime
+    from bson import ObjectId
+    from pymongo.errors import BulkWriteError
+    from app.chatbot.persistence import DEAD_LETTER_COLLECTION, MessageWriter
+
+    messages = db["messages"]
+    insert_many = messages.insert_many
+
+    async def rejecting_insert_many(documents, ordered=True):
+        for index, document in enumerate(documents):
+            if document["content"] == "bad":
+                if index:
+                    await insert_many(documents[:index], ordered=ordered)
+                raise BulkWriteError({
+                    "nInserted": index,
+                    "writeErrors": [{"index": index, "code": 121, "errmsg": "Document failed validation"}],
+                })
+        return await insert_many(documents, ordered=ordered)
+
+    messages.insert_many = rejecting_insert_many
+    writer = MessageWriter(messages, db["conversations"], flush_interval=60,
+                           dead_letters_collection=db[DEAD_LETTER_COLLECTION], max_attempts=3)
+
+    def message(content):
+        return {"_id": ObjectId(), "conversationId": "rejected", "role": "user", "content": content,
+                "createdAt": datetime(2024, 1, 1)}
+
+    async def scenario():
+        for content in ("before", "bad", "after"):
+            await writer.write(message(content))
+        for _ in range(2):
+            await writer.flush()
+            assert [m["content"] for m in writer.pending_for("rejected")] == ["bad", "after"]
+        # The third failed attempt gives up on it, the next flush writes what was queued behind
+        await writer.flush()
+        assert [m["content"] for m in writer.pending_for("rejected")] == ["after"]
+        await writer.write(message("later"))
+        await writer.close()
+        written = [m["content"] async for m in messages.find({"conversationId": "rejected"})]
+        dead = await db[DEAD_LETTER_COLLECTION].find_one({})
+        return written, dead
+
+    written, dead = asyncio.run(scenario())
+    assert written == ["before", "after", "later"]
+    assert dead["message"]["content"] == "bad"
+    assert dead["attempts"] == 3
+    assert dead["error"]["code"] == 121
+    assert writer.dead_lettered == 1
+    assert writer._attempts == {}
@@ -0,0 +1,67 @@
+import asyncio
+import json
+from app.utils.sse import encode_event, coalesce_events, sse_stream, HEARTBEAT_FRAME
+
+
+async def token_events(tokens, delay=0.0):
+    yield {"type": "start", "conversationId": "c"}
+    for token in tokens:
+        if delay:
+            await asyncio.sleep(delay)
+        yield {"type": "content", "content": token}
+    yield {"type": "end", "conversationId": "c"}
+
+
+async def collect(iterator):
+    return [item async for item in iterator]
+
+
+def test_encode_event_escapes_content():
+    """Test that quotes and newlines in content cannot break the frame"""
+    frame = encode_event({"type": "content", "content": 'say "hi"\n\ndata: x'})
+    assert frame.startswith(b"data: ") and frame.endswith(b"\n\n")
+    assert frame.count(b"\n") == 2
+    assert json.loads(frame[len(b"data: "):])["content"] == 'say "hi"\n\ndata: x'
+
+
+def test_coalesces_content_between_other_events():
+    """Test that token deltas are merged into one frame by the time window"""
+    tokens = [f"t{i} " for i in range(20)]
+    events = asyncio.run(collect(coalesce_events(token_events(tokens), window=1.0)))
+    assert [e["type"] for e in events] == ["start", "content", "end"]
+    assert events[1]["content"] == "".join(tokens)
+
+
+def test_coalescing_flushes_by_size_and_can_be_disabled():
+    """Test the byte limit and per-token mode"""
+    tokens = ["abcd"] * 10
+    events = asyncio.run(collect(coalesce_events(token_events(tokens), window=1.0, max_bytes=8)))
+    assert [e["content"] for e in events if e["type"] == "content"] == ["abcdabcd"] * 5
+
+    events = asyncio.run(collect(coalesce_events(token_events(tokens), window=0)))
+    assert len([e for e in events if e["type"] == "content"]) == 10
+
+
+def test_flushes_on_window_and_sends_heartbeats():
+    """Test that slow streams are flushed by time and idle streams get heartbeats"""
+    events = asyncio.run(collect(coalesce_events(token_events(["a", "b"], delay=0.05), window=0.01)))
+    assert [e["content"] for e in events if e and e["type"] == "content"] == ["a", "b"]
+
+    frames = asyncio.run(collect(sse_stream(token_events(["a"], delay=0.05), heartbeat_interval=0.02)))
+    assert HEARTBEAT_FRAME in frames
+
+
+def test_sse_stream_sends_event_ids_and_keeps_the_newest_when_merging():
+    """Test that coalesced frames carry the ID of their last delta"""
+    async def source():
+        yield {"type": "start", "id": "s:1"}
+        yield {"type": "content", "content": "a", "id": "s:2"}
+        yield {"type": "content", "content": "b", "id": "s:3"}
+        yield {"type": "end", "id": "s:4"}
+
+    async def collect():
+        return [frame async for frame in sse_stream(source(), window=1)]
+
+    frames = asyncio.run(collect())
+    assert frames[1] == b'id: s:3\ndata: {"type":"content","content":"ab"}\n\n'
+    assert frames[2].startswith(b"id: s:4\n")
@@ -0,0 +1,143 @@
+import asyncio
+import time
+import pytest
+from app.chatbot.streams import (
+    StreamRegistry,
+    StreamExpiredError,
+    StreamNotFoundError,
+    parse_event_id,
+)
+
+
+async def events(count, delay=0.0):
+    yield {"type": "start"}
+    for i in range(count):
+        await asyncio.sleep(delay)
+        yield {"type": "content", "content": str(i)}
+    yield {"type": "end"}
+
+
+async def take(source, count):
+    received = []
+    async for event in source:
+        received.append(event)
+        if len(received) == count:
+            break
+    await source.aclose()
+    return received
+
+
+def test_resume_replays_missed_events_and_follows_live_generation():
+    """Test that a reconnect with Last-Event-ID continues where the client stopped"""
+    async def scenario():
+        registry = StreamRegistry(grace=5)
+        buffer = registry.start("c", events(5, delay=0.01))
+        first = await take(registry.follow(buffer), 3)
+        # Generation keeps running while the client is away
+        await asyncio.sleep(0.02)
+        resumed_buffer, after = registry.resume(first[-1]["id"])
+        rest = [event async for event in registry.follow(resumed_buffer, after)]
+        return buffer, first, rest
+
+    buffer, first, rest = asyncio.run(scenario())
+    assert first[0]["streamId"] == buffer.stream_id
+    contents = [e["content"] for e in first + rest if e["type"] == "content"]
+    assert contents == ["0", "1", "2", "3", "4"]
+    assert rest[-1]["type"] == "end"
+    assert [parse_event_id(e["id"])[1] for e in first + rest] == list(range(1, 8))
+
+
+def test_resume_fails_once_events_are_evicted():
+    """Test that the ring buffer bounds memory and refuses gaps"""
+    async def scenario():
+        registry = StreamRegistry(max_events=3)
+        buffer = registry.start("c", events(5))
+        await buffer.task
+        return registry, buffer
+
+    registry, buffer = asyncio.run(scenario())
+    assert len(buffer.events) == 3
+    with pytest.raises(StreamExpiredError):
+        registry.resume(f"{buffer.stream_id}:1")
+    registry.resume(f"{buffer.stream_id}:4")
+    with pytest.raises(StreamNotFoundError):
+        registry.resume("missing:1")
+    with pytest.raises(ValueError):
+        parse_event_id("not-an-id")
+
+
+def test_orphaned_generation_is_cancelled_after_grace():
+    """Test that a generation nobody reattaches to is stopped"""
+    async def scenario():
+        registry = StreamRegistry(grace=0.02)
+        buffer = registry.start("c", events(100, delay=0.01))
+        await take(registry.follow(buffer), 2)
+        await asyncio.sleep(0.1)
+        return buffer
+
+    buffer = asyncio.run(scenario())
+    assert buffer.done
+    assert buffer.events[-1][1]["type"] == "content"
+
+
+def test_finished_streams_are_evicted_by_count():
+    """Test that the registry keeps at most max_streams finished streams"""
+    async def scenario():
+        registry = StreamRegistry(max_streams=2)
+        buffers = []
+        for _ in range(4):
+            buffer = registry.start("c", events(1))
+            await buffer.task
+            buffers.append(buffer)
+        return registry, buffers
+
+    registry, buffers = asyncio.run(scenario())
+    assert registry.stats()["streams"] == 2
+    with pytest.raises(StreamNotFoundError):
+        registry.get(buffers[0].stream_id)
+    registry.get(buffers[-1].stream_id)
+
+
+def test_dropped_sse_client_stops_the_generation_within_the_default_grace(chatbot_service, fake_openai, monkeypatch):
+    """Test that a client dropping /message/stream cancels a long reply soon after the grace period"""
+    import httpx
+    import uvicorn
+    from app.chatbot import service as service_module
+    from app.config import settings
+    from app.main import app
+
+    monkeypatch.setattr(service_module, "_chatbot_service", chatbot_service)
+    grace = chatbot_service.streams.grace
+    assert grace == settings.STREAM_RESUME_GRACE_SECONDS
+    # The fake model streams a word every 10 ms: a reply of about ten seconds
+    message = " ".join(f"word{i}" for i in range(1000))
+
+    async def scenario():
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, lifespan="off", ws="none", log_level="warning"))
+        task = asyncio.ensure_future(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+        port = server.servers[0].sockets[0].getsockname()[1]
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+                payload = {"conversationId": "dropped", "message": message}
+                async with client.stream("POST", "/chatbot/message/stream", json=payload) as response:
+                    async for line in response.aiter_lines():
+                        if '"content"' in line:
+                            break
+            dropped = time.monotonic()
+            while chatbot_service.stream_stats()["abandoned"] == 0 and time.monotonic() - dropped < grace + 2:
+                await asyncio.sleep(0.05)
+            elapsed = time.monotonic() - dropped
+            await chatbot_service.message_writer.flush()
+            return elapsed
+        finally:
+            server.should_exit = True
+            await task
+
+    elapsed = asyncio.run(scenario())
+    assert chatbot_service.stream_stats()["abandoned"] == 1
+    assert elapsed < grace + 2
+    assert fake_openai.closed_streams == 1
+    history = asyncio.run(chatbot_service.get_conversation_history("dropped"))
+    assert history[-1]["truncated"] is True
@@ -0,0 +1,73 @@
+import asyncio
+import httpx
+from openai import AsyncOpenAI
+from app.utils.openai_client import OpenAIClient
+from app.utils.scheduler import RequestScheduler
+from app.utils.upstreams import Upstream, UpstreamPool, ROUTING_EWMA
+from tests.fake_openai import FakeOpenAI
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def make_upstream(name, fake):
+    http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=fake.app))
+    client = AsyncOpenAI(base_url="http://fake/v1", api_key="test", max_retries=0, http_client=http_client)
+    return Upstream(name, client, "fake-model")
+
+
+def make_client(pool):
+    return OpenAIClient(pool=pool, scheduler=RequestScheduler(max_retries=0))
+
+
+def test_fails_over_and_opens_circuit():
+    """Test that failing upstreams are failed over mid-request and then ejected"""
+    broken = FakeOpenAI(fail_statuses=[503] * 100)
+    healthy = FakeOpenAI(reply="from healthy")
+
+    async def scenario():
+        pool = UpstreamPool(
+            [make_upstream("broken", broken), make_upstream("healthy", healthy)],
+            failure_threshold=2,
+            cooldown=60,
+        )
+        client = make_client(pool)
+        for _ in range(10):
+            completion = await client.create_chat_completion(MESSAGES)
+            assert completion.choices[0].message.content == "from healthy"
+        return {stats["name"]: stats for stats in client.upstream_stats()}
+
+    stats = asyncio.run(scenario())
+    assert stats["broken"]["circuitOpen"] is True
+    # Once the circuit opened, the broken upstream got no more traffic
+    assert broken.requests == 2
+    assert stats["healthy"]["requests"] == 10
+    assert stats["healthy"]["outstanding"] == 0
+
+
+def test_least_outstanding_spreads_concurrent_load():
+    """Test that concurrent requests are spread across upstreams"""
+    fakes = [FakeOpenAI(latency=0.02) for _ in range(3)]
+
+    async def scenario():
+        pool = UpstreamPool([make_upstream(f"u{i}", fake) for i, fake in enumerate(fakes)])
+        client = make_client(pool)
+        await asyncio.gather(*[client.create_chat_completion(MESSAGES) for _ in range(9)])
+
+    asyncio.run(scenario())
+    assert [fake.requests for fake in fakes] == [3, 3, 3]
+
+
+def test_ewma_routing_prefers_faster_upstream():
+    """Test that latency-based routing sends most traffic to the faster upstream"""
+    slow, fast = FakeOpenAI(latency=0.03), FakeOpenAI(latency=0.001)
+
+    async def scenario():
+        pool = UpstreamPool(
+            [make_upstream("slow", slow), make_upstream("fast", fast)], routing=ROUTING_EWMA
+        )
+        client = make_client(pool)
+        for _ in range(10):
+            await client.create_chat_completion(MESSAGES)
+
+    asyncio.run(scenario())
+    assert fast.requests > slow.requests
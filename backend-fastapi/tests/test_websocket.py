@@ -0,0 +1,86 @@
+import asyncio
+import json
+import pytest
+from fastapi.testclient import TestClient
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from app.chatbot import service as service_module
+from app.chatbot.websocket import ChatSocket
+from app.main import app
+
+
+@pytest.fixture
+def client(chatbot_service, monkeypatch):
+    monkeypatch.setattr(service_module, "_chatbot_service", chatbot_service)
+    return TestClient(app)
+
+
+def receive_until(ws, done):
+    frames = []
+    while not done(frames):
+        frames.append(ws.receive_json())
+    return frames
+
+
+def test_turns_of_many_conversations_share_one_connection(client):
+    """Test that concurrent turns are tagged by conversation and run side by side"""
+    with client.websocket_connect("/chatbot/ws?coalesce_ms=0") as ws:
+        ws.send_json({"type": "message", "conversationId": "a", "message": "first", "requestId": 1})
+        ws.send_json({"type": "message", "conversationId": "b", "message": "second"})
+        frames = receive_until(ws, lambda frames: sum(f["type"] == "end" for f in frames) == 2)
+
+        for conversation_id, reply in (("a", "reply to first"), ("b", "reply to second")):
+            mine = [f for f in frames if f["conversationId"] == conversation_id]
+            assert mine[0]["type"] == "start"
+            assert mine[-1]["type"] == "end"
+            assert "".join(f["content"] for f in mine if f["type"] == "content") == reply
+        assert all(f.get("requestId") == 1 for f in frames if f["conversationId"] == "a")
+        # Both turns were in flight at once
+        order = [f["conversationId"] for f in frames]
+        assert order.index("b") < len(order) - order[::-1].index("a") - 1
+
+        ws.send_text("not json")
+        assert ws.receive_json()["code"] == "invalid_frame"
+        ws.send_json({"type": "message", "conversationId": "a"})
+        assert ws.receive_json()["code"] == "invalid_message"
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json() == {"type": "pong"}
+
+
+def test_cancel_stops_the_generation_and_keeps_the_connection(client, chatbot_service, fake_openai):
+    """Test that a cancel frame stops one turn, saves its partial reply and leaves others usable"""
+    long_message = " ".join(f"word{i}" for i in range(200))
+    with client.websocket_connect("/chatbot/ws?coalesce_ms=0") as ws:
+        ws.send_json({"type": "message", "conversationId": "long", "message": long_message})
+        receive_until(ws, lambda frames: any(f["type"] == "content" for f in frames))
+        ws.send_json({"type": "message", "conversationId": "long", "message": "again"})
+        ws.send_json({"type": "cancel", "conversationId": "long"})
+        frames = receive_until(ws, lambda frames: frames and frames[-1]["type"] == "cancelled")
+        assert any(f.get("code") == "busy" for f in frames)
+        assert fake_openai.closed_streams == 1
+
+        # The conversation is free again once the cancelled turn is gone
+        ws.send_json({"type": "message", "conversationId": "long", "message": "after"})
+        frames = receive_until(ws, lambda frames: frames and frames[-1]["type"] == "end")
+        assert "".join(f["content"] for f in frames if f["type"] == "content") == "reply to after"
+
+    assert chatbot_service.stream_stats()["abandoned"] == 1
+    assert chatbot_service.locks.stats()["busyConversations"] == 0
+
+
+def test_turn_cancelled_before_it_starts_frees_the_conversation(chatbot_service):
+    """Test that cancelling a turn whose task never ran releases it and reports the cancel"""
+
+    async def scenario():
+        socket = ChatSocket(None, chatbot_service)
+        await socket._start_turn({"type": "message", "conversationId": "early", "message": "hi"})
+        socket._cancel("early")
+        for _ in range(3):
+            await asyncio.sleep(0)
+        return socket
+
+    socket = asyncio.run(scenario())
+    assert socket._turns == {}
+    assert json.loads(socket._outbox.get_nowait()) == {"type": "cancelled", "conversationId": "early"}
+    assert chatbot_service.locks.stats()["busyConversations"] == 0